@@ -0,0 +1,216 @@
+# Benchmark of every stage of PLCalculator on synthetic fills.
+# Usage: python benchmark.py --instruments 20 --fills 50000 --output bench.json
+
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+try:
+    from . import kernels
+    from .constants import BASE_COLUMNS
+    from .pl_calculator import (
+        ACCUMULATIONS,
+        ENGINES,
+        MEMORY_MODES,
+        STAGES,
+        PLCalculator,
+    )
+except ImportError:  # executed as a script
+    import kernels
+    from constants import BASE_COLUMNS
+    from pl_calculator import (
+        ACCUMULATIONS,
+        ENGINES,
+        MEMORY_MODES,
+        STAGES,
+        PLCalculator,
+    )
+
+
+def generate_fills(
+    instruments: int = 10,
+    fills_per_instrument: int = 1000,
+    flip_probability: float = 0.05,
+    usd_base_share: float = 0.5,
+    seed: int = 0,
+) -> pd.DataFrame:
+    """Generates random fills with BASE_COLUMNS
+
+    The position of every instrument follows a random walk that never touches
+    zero exactly. With flip_probability a fill takes it through zero to the
+    other side, which is what drives flag_liquidation and amount_liquidated.
+
+    Args:
+        instruments (int, optional): Number of instruments. Defaults to 10.
+        fills_per_instrument (int, optional): Fills of every instrument, about
+            one in a thousand is dropped as empty. Defaults to 1000.
+        flip_probability (float, optional): Chance that a fill flips the
+            position. Defaults to 0.05.
+        usd_base_share (float, optional): Share of USD/XXX instruments, the
+            rest are XXX/USD. Defaults to 0.5.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: Fills of all instruments interleaved in time order
+    """
+    rng = np.random.default_rng(seed)
+    shape = (instruments, fills_per_instrument)
+    flips = rng.random(shape) < flip_probability
+    flips[:, 0] = False
+    signs = np.where(rng.random((instruments, 1)) < 0.5, -1, 1) * np.cumprod(
+        np.where(flips, -1, 1), axis=1
+    )
+    positions = signs * rng.integers(1, 1000, shape)
+    trades = np.diff(positions, axis=1, prepend=0)
+
+    usd_base = rng.random(instruments) < usd_base_share
+    start_prices = np.where(usd_base, rng.uniform(50, 500, instruments), 1.0)
+    steps = 1 + rng.normal(0, 0.001, shape)
+    prices = np.round(start_prices[:, None] * np.cumprod(steps, axis=1), 4)
+    names = [f"C{i:04d}" for i in range(instruments)]
+    pairs = [
+        ("USD", name) if base else (name, "USD") for name, base in zip(names, usd_base)
+    ]
+    codes = np.repeat(np.arange(instruments), fills_per_instrument)
+    seconds = np.sort(rng.integers(0, 86_400 * 30, shape), axis=1)
+
+    fills = pd.DataFrame(
+        {
+            "instrument_exch": [f"{pairs[code][0]}/{pairs[code][1]}" for code in codes],
+            "cur_base": [pairs[code][0] for code in codes],
+            "cur_quote": [pairs[code][1] for code in codes],
+            "side": np.sign(trades).ravel(),
+            "amount": np.abs(trades).ravel(),
+            "price": prices.ravel(),
+            "ts": pd.Timestamp("2020-01-01")
+            + pd.to_timedelta(seconds.ravel(), unit="s"),
+        },
+        columns=BASE_COLUMNS,
+    )
+    # the rare fills that leave the position unchanged would be empty
+    fills = fills[fills["amount"] > 0]
+    return fills.sort_values("ts", kind="stable", ignore_index=True)
+
+
+def _run_stages(
+    input: pd.DataFrame, engine: str, measure, memory: str, accumulation: str
+) -> dict:
+    pl_calc = PLCalculator(
+        input.copy(), engine=engine, memory=memory, accumulation=accumulation
+    )
+    steps = [(stage, getattr(pl_calc, stage)) for stage in STAGES]
+    steps.append(("calculate_totals", pl_calc.calculate_totals))
+    return {name: measure(step) for name, step in steps}
+
+
+def _time(step) -> dict:
+    wall, cpu = time.perf_counter(), time.process_time()
+    step()
+    return {
+        "wall_s": time.perf_counter() - wall,
+        "cpu_s": time.process_time() - cpu,
+    }
+
+
+def _peak_memory(step) -> dict:
+    tracemalloc.start()
+    try:
+        step()
+        return {"peak_bytes": tracemalloc.get_traced_memory()[1]}
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(
+    input: pd.DataFrame,
+    engine: str = "vectorized",
+    memory: str = "default",
+    accumulation: str = "float",
+) -> dict:
+    """Times every stage of calculate() and calculate_totals() separately
+
+    Wall and CPU time are measured in one run, peak memory in a second run
+    under tracemalloc so that tracing doesn't distort the timings.
+
+    Args:
+        input (pd.DataFrame): Fills with at least BASE_COLUMNS
+        engine (str, optional): One of ENGINES. Defaults to 'vectorized'.
+        memory (str, optional): One of MEMORY_MODES, "compact" needs the
+            vectorized engine. Defaults to 'default'.
+        accumulation (str, optional): One of ACCUMULATIONS, "compensated"
+            needs the vectorized engine. Defaults to 'float'.
+
+    Returns:
+        dict: wall_s, cpu_s, rows_per_s and peak_bytes of every stage
+    """
+    if engine == "vectorized":
+        # compile the numba kernels outside of the measured runs
+        _run_stages(input.head(10), engine, lambda step: step(), memory, accumulation)
+    timings = _run_stages(input, engine, _time, memory, accumulation)
+    peaks = _run_stages(input, engine, _peak_memory, memory, accumulation)
+    results = {}
+    for stage, timing in timings.items():
+        results[stage] = {
+            **timing,
+            "rows_per_s": len(input) / timing["wall_s"] if timing["wall_s"] else None,
+            **peaks[stage],
+        }
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark PLCalculator stages")
+    parser.add_argument("--instruments", type=int, default=10)
+    parser.add_argument("--fills", type=int, default=10_000, help="per instrument")
+    parser.add_argument("--flip-probability", type=float, default=0.05)
+    parser.add_argument("--usd-base-share", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--engines", nargs="+", choices=ENGINES, default=["vectorized"])
+    parser.add_argument("--memory", choices=MEMORY_MODES, default="default")
+    parser.add_argument("--accumulation", choices=ACCUMULATIONS, default="float")
+    parser.add_argument("--output", help="JSON file to save the results to")
+    args = parser.parse_args(args)
+
+    params = {
+        "instruments": args.instruments,
+        "fills_per_instrument": args.fills,
+        "flip_probability": args.flip_probability,
+        "usd_base_share": args.usd_base_share,
+        "seed": args.seed,
+    }
+    fills = generate_fills(**params)
+    report = {
+        "params": {**params, "rows": len(fills)},
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "numba": kernels.load_numba() is not None,
+        },
+        "memory": args.memory,
+        "accumulation": args.accumulation,
+        "engines": {
+            engine: benchmark(fills, engine, args.memory, args.accumulation)
+            for engine in args.engines
+        },
+    }
+    for engine, stages in report["engines"].items():
+        for stage, result in stages.items():
+            print(
+                f"{engine:>10} {stage:>20} {result['wall_s']:10.4f} s "
+                f"{result['rows_per_s'] or 0:14,.0f} rows/s "
+                f"{result['peak_bytes'] / 2**20:10.1f} MiB"
+            )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    main()
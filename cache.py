@@ -0,0 +1,219 @@
+# On-disk cache of per-instrument calculate() outputs.
+# Instruments are independent, so the derived columns of an instrument only
+# depend on its own rows. Each instrument's rows are hashed, and instruments
+# with a cached result for the same hash, engine version and options are
+# loaded instead of recalculated. The cache keeps to a size limit by evicting
+# the least recently used entries.
+
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .pl_calculator import ENGINE_VERSION, PLCalculator
+    from .segments import Segments
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    from pl_calculator import ENGINE_VERSION, PLCalculator
+    from segments import Segments
+
+# Options of PLCalculator that change results without being part of the rows.
+# Objects such as fx_rates or initial_state can't be hashed by content and
+# aren't cached.
+CACHED_OPTIONS = (
+    "engine",
+    "cost_basis",
+    "fee_policy",
+    "sort_by_ts",
+    "group_by",
+    "accumulation",
+)
+
+
+def _digest(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else repr(part).encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Directory of cached derived columns with least recently used eviction
+
+    Every entry is a pickle of one instrument's derived columns. Its file name
+    starts with a digest of the instrument, so all entries of an instrument
+    can be invalidated, and ends with the key of its input. Reading an entry
+    touches its file, eviction removes the files touched longest ago. Entries
+    are pickles, only use a directory no one else can write to.
+
+    Args:
+        directory (str): Directory of the cache, created if missing
+        max_bytes (int, optional): Size the entries are evicted down to after
+            every store. Defaults to 1 GiB.
+    """
+
+    SUFFIX = ".pkl"
+
+    def __init__(self, directory: str, max_bytes: int = 2**30):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def _prefix(instrument) -> str:
+        return _digest(instrument)[:16]
+
+    def _path(self, instrument, key: str) -> str:
+        name = f"{self._prefix(instrument)}_{key}{self.SUFFIX}"
+        return os.path.join(self.directory, name)
+
+    def get(self, instrument, key: str):
+        """Cached derived columns of an instrument, None if there are none"""
+        path = self._path(instrument, key)
+        try:
+            derived = pd.read_pickle(path)
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        os.utime(path)
+        self.hits += 1
+        return derived
+
+    def put(self, instrument, key: str, derived: pd.DataFrame):
+        """Stores the derived columns of an instrument under key"""
+        path = self._path(instrument, key)
+        # written aside and renamed, so readers never see a partial entry
+        derived.to_pickle(f"{path}.tmp")
+        os.replace(f"{path}.tmp", path)
+
+    def entries(self) -> list:
+        """Paths of all entries, least recently used first"""
+        paths = [
+            entry.path
+            for entry in os.scandir(self.directory)
+            if entry.name.endswith(self.SUFFIX)
+        ]
+        return sorted(paths, key=os.path.getmtime)
+
+    def size(self) -> int:
+        """Bytes taken by all entries"""
+        return sum(os.path.getsize(path) for path in self.entries())
+
+    def evict(self):
+        """Removes least recently used entries until max_bytes is kept"""
+        entries = self.entries()
+        sizes = [os.path.getsize(path) for path in entries]
+        total = sum(sizes)
+        for path, size in zip(entries, sizes):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+    def invalidate(self, instruments=None):
+        """Removes the entries of the given instruments, or all entries
+
+        Args:
+            instruments (iterable, optional): Instruments to forget. Defaults
+                to None, which clears the cache.
+        """
+        prefixes = None
+        if instruments is not None:
+            prefixes = {self._prefix(instrument) for instrument in instruments}
+        for path in self.entries():
+            if prefixes is None or os.path.basename(path)[:16] in prefixes:
+                os.remove(path)
+
+
+def instrument_keys(input: pd.DataFrame, segments: Segments, options: dict) -> list:
+    """Cache key of every instrument's rows under the given options
+
+    Rows are hashed with pandas in one vectorized pass, the key of an
+    instrument digests its rows' hashes in order with the column names and
+    dtypes, ENGINE_VERSION and the options.
+
+    Args:
+        input (pd.DataFrame): Fills
+        segments (Segments): Segments of input by instrument_exch
+        options (dict): PLCalculator options, see CACHED_OPTIONS
+
+    Returns:
+        list: Key of every segment
+    """
+    row_hashes = segments.sort(
+        pd.util.hash_pandas_object(input, index=False).to_numpy()
+    )
+    schema = [(column, str(dtype)) for column, dtype in input.dtypes.items()]
+    settings = (ENGINE_VERSION, schema, sorted(options.items()))
+    return [
+        _digest(settings, np.ascontiguousarray(row_hashes[start:end]).tobytes())
+        for start, end in zip(segments.offsets[:-1], segments.offsets[1:])
+    ]
+
+
+def calculate_cached(
+    input: pd.DataFrame, cache: ResultCache, **options
+) -> pd.DataFrame:
+    """Same as PLCalculator(input, **options).calculate() through a cache
+
+    Instruments whose rows and options are unchanged since an earlier call
+    are loaded from the cache, only the others are calculated, together in
+    one PLCalculator.
+
+    Args:
+        input (pd.DataFrame): Fills with at least BASE_COLUMNS
+        cache (ResultCache): Cache to read and store derived columns
+        **options: Options of PLCalculator among CACHED_OPTIONS
+
+    Raises:
+        ValueError: If an option can't be cached
+
+    Returns:
+        pd.DataFrame: Input with the derived columns, in the original row order
+    """
+    unsupported = sorted(set(options) - set(CACHED_OPTIONS))
+    if unsupported:
+        raise ValueError(f"Options {unsupported} can't be cached")
+    segments = Segments.from_frame(input)
+    keys = instrument_keys(input, segments, options)
+    order = segments.order
+    if order is None:
+        order = np.arange(len(input))
+    rows = [
+        order[start:end]
+        for start, end in zip(segments.offsets[:-1], segments.offsets[1:])
+    ]
+
+    parts = {}
+    missed = []
+    for code, (instrument, key) in enumerate(zip(segments.keys, keys)):
+        derived = cache.get(instrument, key)
+        if derived is None:
+            missed.append(code)
+        else:
+            parts[code] = derived
+    if missed:
+        positions = np.concatenate([rows[code] for code in missed])
+        fills = input.iloc[np.sort(positions)].copy()
+        result = PLCalculator(fills, **options).calculate()
+        derived = result[[column for column in result if column not in input]]
+        derived = derived.set_axis(np.sort(positions))
+        for code in missed:
+            part = derived.loc[rows[code]].reset_index(drop=True)
+            cache.put(segments.keys[code], keys[code], part)
+            parts[code] = part
+        cache.evict()
+
+    output = input.copy()
+    if not parts:
+        return output
+    derived = pd.concat([parts[code] for code in range(len(rows))], ignore_index=True)
+    # back from instrument order to the original row order
+    derived = derived.iloc[np.argsort(np.concatenate(rows), kind="stable")]
+    for column in derived:
+        output[column] = derived[column].to_numpy()
+    return output
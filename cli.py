@@ -0,0 +1,216 @@
+# Command-line P&L calculation of a file of fills.
+# Modules are imported when a run needs them, so --help and short runs don't
+# load numba, pyarrow or multiprocessing.
+# Usage: python cli.py fills.csv --output rows.parquet --totals totals.json
+
+import argparse
+import contextlib
+import importlib
+import sys
+
+# Same as the values of reader.FORMATS and pl_calculator.ENGINES, repeated so
+# that parsing the arguments doesn't import pandas
+FILE_FORMATS = ("csv", "parquet", "arrow")
+ENGINES = ("rowwise", "vectorized")
+
+
+def _load(name: str):
+    # sibling module, imported on first use
+    if __package__:
+        return importlib.import_module(f".{name}", __package__)
+    return importlib.import_module(name)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="P&L from a file of fills")
+    parser.add_argument("input", nargs="?", default="data.csv", help="file of fills")
+    parser.add_argument("--input-format", choices=FILE_FORMATS)
+    parser.add_argument("--output", help="file the fills with P&L are written to")
+    parser.add_argument("--output-format", choices=FILE_FORMATS)
+    parser.add_argument(
+        "--totals",
+        default="total_metrics.json",
+        help=".json or table file the totals are written to, empty for none",
+    )
+    parser.add_argument("--delimiter", default=";", help="delimiter of CSV")
+    parser.add_argument("--thousands", default=" ", help="thousands separator of CSV")
+    parser.add_argument("--decimal", default=",", help="decimal separator of CSV")
+    parser.add_argument("--engine", choices=ENGINES, default="vectorized")
+    parser.add_argument("--workers", type=int, default=1, help="processes")
+    parser.add_argument(
+        "--chunksize", type=int, help="read and calculate a csv file in chunks"
+    )
+    parser.add_argument(
+        "--instruments", nargs="+", help="only calculate these instruments"
+    )
+    parser.add_argument(
+        "--group-by",
+        nargs="+",
+        help="columns of a composite key, e.g. account strategy instrument_exch",
+    )
+    parser.add_argument(
+        "--roll-up", nargs="+", help="group-by columns to sum the totals up to"
+    )
+    parser.add_argument(
+        "--cache", help="directory of cached per-instrument results to reuse"
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=2**30, help="bytes kept in the cache"
+    )
+    parser.add_argument(
+        "--timings", action="store_true", help="print wall time per stage to stderr"
+    )
+    return parser
+
+
+def _check(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    if args.group_by and (args.chunksize is not None or args.workers != 1):
+        parser.error("--group-by runs on a single process without --chunksize")
+    if args.cache and (args.chunksize is not None or args.workers != 1):
+        parser.error("--cache runs on a single process without --chunksize")
+    if args.roll_up and not set(args.roll_up) <= set(args.group_by or []):
+        parser.error("--roll-up takes columns of --group-by")
+    if args.chunksize is not None:
+        reader = _load("reader")
+        input_format = args.input_format or reader.file_format(args.input)
+        if input_format != "csv":
+            parser.error("--chunksize needs a csv input")
+        if args.engine != "vectorized":
+            parser.error("--chunksize needs the vectorized engine")
+        if args.workers != 1:
+            parser.error("--chunksize runs on a single process, drop --workers")
+        output_format = args.output and (
+            args.output_format or reader.file_format(args.output)
+        )
+        if output_format not in (None, "csv"):
+            parser.error("--chunksize appends rows to a csv output only")
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+
+def _filter(fills, instruments):
+    if instruments is None:
+        return fills
+    return fills[fills["instrument_exch"].isin(instruments)].reset_index(drop=True)
+
+
+def _calculate_chunks(args, phase):
+    reader = _load("reader")
+    writer = _load("writer")
+    incremental = _load("incremental").IncrementalPLCalculator()
+    chunks = reader.read_data_chunks(
+        args.input,
+        chunksize=args.chunksize,
+        delimiter=args.delimiter,
+        thousands=args.thousands,
+        decimal=args.decimal,
+    )
+    for number, chunk in enumerate(chunks):
+        chunk = _filter(chunk, args.instruments)
+        with phase("chunk", len(chunk)):
+            rows, _ = incremental.update(chunk)
+        if args.output:
+            with phase("write", len(rows)):
+                writer.write_data(
+                    rows,
+                    args.output,
+                    delimiter=args.delimiter,
+                    decimal=args.decimal,
+                    format="csv",
+                    append=number > 0,
+                )
+    return incremental.totals()
+
+
+def _calculate(args, observer, phase):
+    reader = _load("reader")
+    pl_calculator = _load("pl_calculator")
+    with phase("read", None):
+        fills = reader.read_any(
+            args.input,
+            format=args.input_format,
+            delimiter=args.delimiter,
+            thousands=args.thousands,
+            decimal=args.decimal,
+        )
+        fills = _filter(fills, args.instruments)
+    if args.workers > 1:
+        with phase("calculate", len(fills)):
+            rows = _load("parallel").calculate_parallel(
+                fills, args.workers, args.engine
+            )
+            totals = pl_calculator.totals_from_state(
+                pl_calculator.state_from_rows(rows)
+            )
+    elif args.cache:
+        with phase("calculate", len(fills)):
+            cache = _load("cache")
+            options = {"engine": args.engine}
+            if args.group_by:
+                options["group_by"] = args.group_by
+            rows = cache.calculate_cached(
+                fills, cache.ResultCache(args.cache, args.cache_size), **options
+            )
+            state = pl_calculator.state_from_rows(
+                rows, args.group_by or "instrument_exch"
+            )
+            totals = pl_calculator.totals_from_state(state, args.roll_up)
+    else:
+        pl_calc = pl_calculator.PLCalculator(
+            fills, engine=args.engine, observer=observer, group_by=args.group_by
+        )
+        rows = pl_calc.calculate()
+        totals = pl_calc.calculate_totals(by=args.roll_up)
+    if args.output:
+        with phase("write", len(rows)):
+            _load("writer").write_data(
+                rows,
+                args.output,
+                delimiter=args.delimiter,
+                decimal=args.decimal,
+                format=args.output_format,
+            )
+    return totals
+
+
+def main(args=None):
+    """Calculates the fills of a file and writes their rows and totals
+
+    Args:
+        args (list, optional): Command-line arguments. Defaults to sys.argv.
+
+    Returns:
+        pd.DataFrame: Totals as returned by PLCalculator.calculate_totals
+    """
+    parser = build_parser()
+    args = parser.parse_args(args)
+    _check(parser, args)
+
+    observer = None
+    if args.timings:
+        observer = _load("metrics").StageMetrics()
+
+    def phase(stage: str, rows):
+        if observer is None:
+            return contextlib.nullcontext()
+        return _load("metrics").measure(stage, rows, observer)
+
+    if args.chunksize is None:
+        totals = _calculate(args, observer, phase)
+    else:
+        totals = _calculate_chunks(args, phase)
+    if args.totals:
+        _load("sinks").sink_for(args.totals).write(totals)
+    print(totals)
+    if observer is not None:
+        for record in observer.records:
+            rows = "" if record["rows"] is None else f"{record['rows']:14,} rows"
+            print(
+                f"{record['stage']:>20} {record['wall_seconds']:10.4f} s {rows}",
+                file=sys.stderr,
+            )
+    return totals
+
+
+if __name__ == "__main__":
+    main()
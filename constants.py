@@ -7,3 +7,55 @@ BASE_COLUMNS = [
     "price",
     "ts",
 ]
+
+# Columns added to the fills by PLCalculator.calculate(), in order
+DERIVED_COLUMNS = [
+    "amount_signed",
+    "running_balance",
+    "lag_running_balance",
+    "amount_liquidated",
+    "flag_liquidation",
+    "inventory_change",
+    "running_inventory",
+    "inventory_cost",
+    "realized_pnl_quote_currency",
+    "unrealized_pnl_quote_currency",
+    "realized_pnl_usd",
+    "unrealized_pnl_usd",
+]
+
+# Optional columns of the fills for the specific-ID cost basis: the id of the
+# lot a fill opens and the id of the lot it closes first
+LOT_COLUMNS = ["lot_id", "close_lot_id"]
+
+# Optional columns of the fills with the fee of every fill and its currency,
+# used by the fee policies of PLCalculator
+FEE_COLUMNS = ["fee", "fee_currency"]
+
+# Columns added to the fills by PLCalculator.calculate() with a fee policy
+FEE_DERIVED_COLUMNS = ["fee_quote_currency", "fee_usd"]
+
+# Compact dtypes of BASE_COLUMNS, repeated strings become categoricals and
+# side fits in a single byte. Used for chunked reading and the compact memory
+# mode of PLCalculator.
+COMPACT_DTYPES = {
+    "instrument_exch": "category",
+    "cur_base": "category",
+    "cur_quote": "category",
+    "side": "int8",
+    "amount": "float64",
+    "price": "float64",
+}
+
+# Per-instrument end state that lets the vectorized engine continue from
+# earlier fills without recomputing them, indexed by instrument_exch.
+STATE_COLUMNS = [
+    "running_balance",
+    "running_balance_compensation",
+    "running_inventory",
+    "inventory_cost",
+    "realized_pnl_usd",
+    "unrealized_pnl_usd",
+    "price",
+    "ts",
+]
@@ -0,0 +1,433 @@
+# Differential testing of the engines against the row-wise reference.
+# Random fill sequences are calculated by the reference and by every candidate
+# engine, every derived column is compared, and failing inputs are shrunk to a
+# minimal reproducer.
+# Usage: python differential.py --cases 200 --candidates vectorized compact
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .constants import BASE_COLUMNS, DERIVED_COLUMNS
+    from .pl_calculator import STAGES, PLCalculator
+except ImportError:  # executed as a script
+    from constants import BASE_COLUMNS, DERIVED_COLUMNS
+    from pl_calculator import STAGES, PLCalculator
+
+# Derived columns that only depend on the positions, calculated by the
+# reference on all fills at once
+POSITION_COLUMNS = DERIVED_COLUMNS[:5]
+
+# Engines compared against the reference by default, each takes a copy of the
+# fills and returns them with the derived columns
+CANDIDATES = {
+    "vectorized": lambda input: PLCalculator(input, engine="vectorized").calculate(),
+    "compact": lambda input: PLCalculator(
+        input, engine="vectorized", memory="compact"
+    ).calculate(),
+    "sort_by_ts": lambda input: PLCalculator(
+        input, engine="vectorized", sort_by_ts=True
+    ).calculate(),
+}
+
+_CURRENCIES = ["KZT", "PHP", "EUR", "GBP", "JPY", "AUD"]
+
+
+def random_fills(
+    rng: np.random.Generator,
+    max_instruments: int = 3,
+    max_fills: int = 20,
+    flip_probability: float = 0.2,
+    flatten_probability: float = 0.1,
+    fractional_probability: float = 0.3,
+) -> pd.DataFrame:
+    """Generates a short random fill sequence with the cases engines get wrong
+
+    Unlike benchmark.generate_fills, positions flip through zero, go exactly
+    flat and reopen, amounts may be fractional and instruments are few with
+    short histories, so that first fills with NaN lags are frequent. USD/XXX
+    pairs with large prices and XXX/USD pairs with small ones are mixed.
+
+    Args:
+        rng (np.random.Generator): Source of randomness
+        max_instruments (int, optional): Instruments are 1 up to this many.
+            Defaults to 3.
+        max_fills (int, optional): Fills of every instrument are 1 up to this
+            many. Defaults to 20.
+        flip_probability (float, optional): Chance that a fill takes the
+            position through zero. Defaults to 0.2.
+        flatten_probability (float, optional): Chance that a fill closes the
+            position exactly. Defaults to 0.1.
+        fractional_probability (float, optional): Chance that an instrument
+            trades fractional amounts. Defaults to 0.3.
+
+    Returns:
+        pd.DataFrame: Fills with BASE_COLUMNS, instruments interleaved in ts
+            order
+    """
+    instruments = int(rng.integers(1, max_instruments + 1))
+    rows = []
+    codes = []
+    for code, currency in enumerate(
+        rng.choice(_CURRENCIES, instruments, replace=False)
+    ):
+        usd_base = rng.random() < 0.5
+        if usd_base:
+            pair, price = ("USD", currency), rng.uniform(50, 500)
+        else:
+            pair, price = (currency, "USD"), rng.uniform(0.5, 2)
+        step = 0.25 if rng.random() < fractional_probability else 1
+        position = 0
+        for _ in range(int(rng.integers(1, max_fills + 1))):
+            draw = rng.random()
+            size = int(rng.integers(1, 100)) * step
+            if position != 0 and draw < flatten_probability:
+                trade = -position
+            elif position != 0 and draw < flatten_probability + flip_probability:
+                trade = -position - np.sign(position) * size
+            else:
+                trade = size if rng.random() < 0.5 else -size
+            position += trade
+            price *= 1 + rng.normal(0, 0.01)
+            codes.append(code)
+            rows.append(
+                (
+                    "/".join(pair),
+                    *pair,
+                    1 if trade > 0 else -1,
+                    abs(trade),
+                    round(price, 2 if usd_base else 5),
+                )
+            )
+    fills = pd.DataFrame(rows, columns=BASE_COLUMNS[:-1])
+    # slots shuffled across instruments, every instrument fills its own slots in
+    # order, so the instruments interleave and keep their fill order
+    slots = np.array(codes)
+    rng.shuffle(slots)
+    fills.index = np.argsort(slots, kind="stable")
+    fills = fills.sort_index()
+    fills["ts"] = pd.Timestamp("2020-01-01") + pd.to_timedelta(
+        np.arange(len(fills)), unit="min"
+    )
+    return fills
+
+
+def reference(input: pd.DataFrame) -> pd.DataFrame:
+    """Derived columns of the row-wise engine, restarted at every flat position
+
+    The reference divides by the running balance, so it has no inventory once
+    a position is exactly flat, while engines close the position out there and
+    start over. The fills of every instrument are therefore split at its flat
+    fills and the pieces between them are calculated by the reference on their
+    own. A flat fill is left without inventory and realizes its P&L against
+    the inventory cost of the fill before it, the fill reopening the position
+    after it starts from that empty inventory.
+
+    Args:
+        input (pd.DataFrame): Fills with BASE_COLUMNS and a unique index
+
+    Returns:
+        pd.DataFrame: Fills with DERIVED_COLUMNS
+    """
+    positions = PLCalculator(input.copy())
+    for stage in STAGES[: STAGES.index("flags_calc") + 1]:
+        getattr(positions, stage)()
+    expected = positions.input
+    instrument = input["instrument_exch"]
+    flat = expected["running_balance"] == 0
+    piece = flat.astype(int).groupby(instrument).cumsum() - flat
+    # the first fill of an instrument is never flat, so every piece has fills
+    result = PLCalculator(
+        input[~flat].assign(piece=piece[~flat]),
+        group_by=["instrument_exch", "piece"],
+    ).calculate()
+    for column in DERIVED_COLUMNS[len(POSITION_COLUMNS) :]:
+        expected[column] = result[column]
+
+    state = ["running_inventory", "inventory_cost"]
+    lag = expected.groupby(instrument)[state].shift()
+    expected.loc[flat, "inventory_change"] = -lag.loc[flat, "running_inventory"]
+    expected.loc[flat, state] = 0.0
+    restarted = flat | flat.groupby(instrument).shift(fill_value=False)
+    if restarted.any():
+        lag = expected.groupby(instrument)[state].shift()
+        rows = expected[restarted].assign(
+            lag_running_inventory=lag["running_inventory"],
+            lag_inventory_cost=lag["inventory_cost"],
+        )
+        for pnl, formula in (
+            ("realized_pnl", PLCalculator._realized_pnl),
+            ("unrealized_pnl", PLCalculator._unrealized_pnl),
+        ):
+            column = f"{pnl}_quote_currency"
+            rows[column] = rows.apply(formula, axis=1)
+            expected.loc[restarted, column] = rows[column]
+            expected.loc[restarted, f"{pnl}_usd"] = rows.apply(
+                lambda row: PLCalculator._convert_to_usd(row, column), axis=1
+            )
+    return expected
+
+
+# Columns of the differences returned by compare()
+DIFFERENCE_COLUMNS = ["column", "row", "expected", "actual"]
+
+
+def compare(
+    expected: pd.DataFrame,
+    actual: pd.DataFrame,
+    rtol: float = 1e-9,
+    atol: float = 0.0,
+) -> pd.DataFrame:
+    """Differences between the reference and a candidate
+
+    Values agree within rtol and atol as in np.isclose, NaN agrees with NaN.
+    On every fill that leaves the position flat, running_inventory and
+    inventory_cost of the candidate must be exactly zero.
+
+    Args:
+        expected (pd.DataFrame): Output of reference()
+        actual (pd.DataFrame): Output of the candidate, in the same row order
+        rtol (float, optional): Relative tolerance. Defaults to 1e-9.
+        atol (float, optional): Absolute tolerance. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: DIFFERENCE_COLUMNS of every value that differs, empty if
+            the candidate agrees
+    """
+    if not actual.index.equals(expected.index):
+        return pd.DataFrame(
+            [("index", None, list(expected.index), list(actual.index))],
+            columns=DIFFERENCE_COLUMNS,
+        )
+    differences = []
+    flat = (expected["running_balance"] == 0).to_numpy()
+    for column in DERIVED_COLUMNS:
+        wanted = expected[column].to_numpy(dtype=np.float64)
+        got = actual[column].to_numpy(dtype=np.float64)
+        wrong = ~np.isclose(got, wanted, rtol=rtol, atol=atol, equal_nan=True)
+        if column in ("running_inventory", "inventory_cost"):
+            # reported once below, without tolerance
+            wrong &= ~flat
+        differences += zip(
+            [column] * wrong.sum(),
+            expected.index[wrong],
+            wanted[wrong],
+            got[wrong],
+        )
+    for column in ("running_inventory", "inventory_cost"):
+        got = actual[column].to_numpy(dtype=np.float64)[flat]
+        wrong = got != 0
+        differences += zip(
+            [column] * wrong.sum(),
+            expected.index[flat][wrong],
+            [0.0] * wrong.sum(),
+            got[wrong],
+        )
+    return pd.DataFrame(differences, columns=DIFFERENCE_COLUMNS)
+
+
+def check(input: pd.DataFrame, candidate, rtol: float = 1e-9, atol: float = 0.0):
+    """Differences of a candidate from the reference on one input
+
+    Args:
+        input (pd.DataFrame): Fills with BASE_COLUMNS and a unique index
+        candidate (callable): Takes a copy of the fills and returns them with
+            DERIVED_COLUMNS, see CANDIDATES
+        rtol (float, optional): Relative tolerance. Defaults to 1e-9.
+        atol (float, optional): Absolute tolerance. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: See compare(), an exception of the candidate is one
+            difference in the column "exception"
+    """
+    expected = reference(input)
+    try:
+        actual = candidate(input.copy())
+    except Exception as error:
+        return pd.DataFrame(
+            [("exception", None, None, repr(error))], columns=DIFFERENCE_COLUMNS
+        )
+    return compare(expected, actual, rtol, atol)
+
+
+def _simpler_values(value: float) -> list:
+    # Candidates replacing a positive amount or price, simplest first
+    simpler = [1.0, float(max(round(value), 1)), round(value, 2)]
+    return [candidate for candidate in dict.fromkeys(simpler) if candidate < value]
+
+
+def shrink(input: pd.DataFrame, fails) -> pd.DataFrame:
+    """Smallest input found that still fails
+
+    Greedily drops whole instruments, then chunks of rows of halving size
+    down to single rows (delta debugging), then replaces amounts and prices
+    by simpler ones, until no step makes progress. Every step keeps the
+    relative order of the remaining fills.
+
+    Args:
+        input (pd.DataFrame): Failing fills
+        fails (callable): True if the fills passed to it still fail
+
+    Returns:
+        pd.DataFrame: Shrunk fills, renumbered from zero
+    """
+    progress = True
+    while progress:
+        progress = False
+        for instrument in input["instrument_exch"].unique():
+            trial = input[input["instrument_exch"] != instrument]
+            if len(trial) and fails(trial):
+                input, progress = trial, True
+        chunk = len(input) // 2
+        while chunk >= 1:
+            start = 0
+            while start < len(input):
+                trial = input.drop(input.index[start : start + chunk])
+                if len(trial) and fails(trial):
+                    input, progress = trial, True
+                else:
+                    start += chunk
+            chunk //= 2
+        for column in ("amount", "price"):
+            for row in input.index:
+                for value in _simpler_values(input.at[row, column]):
+                    trial = input.copy()
+                    trial.at[row, column] = value
+                    if fails(trial):
+                        input, progress = trial, True
+                        break
+    return input.reset_index(drop=True)
+
+
+class Failure:
+    """Shrunk input on which a candidate disagrees with the reference
+
+    Args:
+        candidate (str): Name of the candidate
+        input (pd.DataFrame): Shrunk fills
+        differences (pd.DataFrame): Differences on the shrunk fills, see
+            compare()
+        case (int): Number of the generated case that failed
+        rows (int): Rows of the generated case before shrinking
+    """
+
+    def __init__(
+        self,
+        candidate: str,
+        input: pd.DataFrame,
+        differences: pd.DataFrame,
+        case: int,
+        rows: int,
+    ):
+        self.candidate = candidate
+        self.input = input
+        self.differences = differences
+        self.case = case
+        self.rows = rows
+
+    def reproducer(self) -> str:
+        """Python source building the shrunk fills"""
+        rows = "".join(
+            f"        {tuple(row)!r},\n"
+            for row in self.input.astype({"ts": str}).itertuples(index=False)
+        )
+        return (
+            f"input = pd.DataFrame(\n    [\n{rows}    ],\n"
+            f"    columns={list(self.input.columns)!r},\n)\n"
+            'input["ts"] = pd.to_datetime(input["ts"])'
+        )
+
+    def __str__(self) -> str:
+        return (
+            f"{self.candidate} differs from the reference on case {self.case}, "
+            f"shrunk from {self.rows} to {len(self.input)} rows:\n"
+            f"{self.differences.to_string(index=False)}\n{self.reproducer()}"
+        )
+
+
+def run(
+    cases: int = 100,
+    seed: int = 0,
+    candidates: dict = None,
+    rtol: float = 1e-9,
+    atol: float = 0.0,
+    shrinking: bool = True,
+    **options,
+) -> list:
+    """Compares candidates with the reference on random fill sequences
+
+    A candidate is no longer checked after its first failure, as one bug
+    tends to fail many cases.
+
+    Args:
+        cases (int, optional): Number of generated inputs. Defaults to 100.
+        seed (int, optional): Random seed, case n of a seed is always the
+            same input. Defaults to 0.
+        candidates (dict, optional): Callables by name, see CANDIDATES.
+            Defaults to CANDIDATES.
+        rtol (float, optional): Relative tolerance. Defaults to 1e-9.
+        atol (float, optional): Absolute tolerance. Defaults to 0.
+        shrinking (bool, optional): Shrinks failing inputs. Defaults to True.
+        **options: Options of random_fills
+
+    Returns:
+        list: Failure of every failing candidate
+    """
+    remaining = dict(CANDIDATES if candidates is None else candidates)
+    failures = []
+    for case in range(cases):
+        if not remaining:
+            break
+        input = random_fills(np.random.default_rng([seed, case]), **options)
+        for name, candidate in list(remaining.items()):
+            differences = check(input, candidate, rtol, atol)
+            if differences.empty:
+                continue
+            shrunk = input.reset_index(drop=True)
+            if shrinking:
+                shrunk = shrink(
+                    input, lambda trial: not check(trial, candidate, rtol, atol).empty
+                )
+                differences = check(shrunk, candidate, rtol, atol)
+            failures.append(Failure(name, shrunk, differences, case, len(input)))
+            del remaining[name]
+    return failures
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Compare the engines with the row-wise reference"
+    )
+    parser.add_argument("--cases", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--candidates", nargs="+", choices=list(CANDIDATES), default=list(CANDIDATES)
+    )
+    parser.add_argument("--rtol", type=float, default=1e-9)
+    parser.add_argument("--atol", type=float, default=0.0)
+    parser.add_argument("--max-instruments", type=int, default=3)
+    parser.add_argument("--max-fills", type=int, default=20)
+    parser.add_argument("--no-shrinking", action="store_true")
+    args = parser.parse_args(args)
+
+    failures = run(
+        cases=args.cases,
+        seed=args.seed,
+        candidates={name: CANDIDATES[name] for name in args.candidates},
+        rtol=args.rtol,
+        atol=args.atol,
+        shrinking=not args.no_shrinking,
+        max_instruments=args.max_instruments,
+        max_fills=args.max_fills,
+    )
+    for failure in failures:
+        print(failure, end="\n\n")
+    passed = sorted(set(args.candidates) - {failure.candidate for failure in failures})
+    print(f"{args.cases} cases, agreeing: {', '.join(passed) or 'none'}")
+    return failures
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+# Conversion of quote currency P&L to USD for the vectorized engine.
+# Every currency pair is resolved once to a conversion mode, rows then only
+# look up the mode of their pair instead of comparing strings. Pairs without
+# USD are converted through an FXRates table when one is given.
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .segments import _factorize_composite
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    from segments import _factorize_composite
+
+USD = "USD"
+
+QUOTE_USD = 0
+BASE_USD = 1
+UNSUPPORTED = -1
+
+
+def _pair_mode(cur_base: str, cur_quote: str) -> int:
+    if cur_quote == USD:
+        return QUOTE_USD
+    elif cur_base == USD:
+        return BASE_USD
+    else:
+        return UNSUPPORTED
+
+
+def conversion_modes(input: pd.DataFrame) -> np.ndarray:
+    """Resolves the USD conversion mode of every row
+
+    The mode is computed once per distinct (cur_base, cur_quote) pair and
+    broadcast back to the rows.
+
+    Args:
+        input (pd.DataFrame): Fills with cur_base and cur_quote columns
+
+    Returns:
+        np.ndarray: QUOTE_USD, BASE_USD or UNSUPPORTED for every row
+    """
+    codes, pairs = _factorize_composite(input, ["cur_base", "cur_quote"])
+    table = np.array(
+        [_pair_mode(cur_base, cur_quote) for cur_base, cur_quote in pairs],
+        dtype=np.int8,
+    )
+    return table[codes]
+
+
+def check_conversion_modes(input: pd.DataFrame, modes: np.ndarray):
+    """Raises before any conversion if some instrument can't be converted to USD
+
+    Args:
+        input (pd.DataFrame): Fills with an instrument_exch column
+        modes (np.ndarray): Output of conversion_modes for the same rows
+
+    Raises:
+        ValueError: If neither quote nor base currency is USD for some instrument
+    """
+    unsupported = modes == UNSUPPORTED
+    if unsupported.any():
+        instruments = sorted(input.loc[unsupported, "instrument_exch"].unique())
+        raise ValueError(
+            f"Neither quote nor base currency is USD for {', '.join(instruments)}"
+        )
+
+
+def convert_to_usd(
+    values: np.ndarray,
+    price: np.ndarray,
+    modes: np.ndarray,
+    cross_rates: np.ndarray = None,
+) -> np.ndarray:
+    """Columnar version of PLCalculator._convert_to_usd
+
+    Args:
+        values (np.ndarray): Amounts in quote currency
+        price (np.ndarray): Fill price, used as the rate for USD-base pairs
+        modes (np.ndarray): Output of conversion_modes for the same rows
+        cross_rates (np.ndarray, optional): USD value of one unit of the quote
+            currency, used for the UNSUPPORTED rows, see FXRates.usd_rates.
+            Defaults to None, which leaves those rows unconverted.
+
+    Returns:
+        np.ndarray: Amounts in USD
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        converted = np.where(modes == BASE_USD, values / price, values)
+    if cross_rates is not None:
+        converted = np.where(modes == UNSUPPORTED, values * cross_rates, converted)
+    return converted
+
+
+def fees_to_quote(
+    fee: np.ndarray,
+    fee_currency: np.ndarray,
+    cur_base: np.ndarray,
+    cur_quote: np.ndarray,
+    price: np.ndarray,
+    modes: np.ndarray,
+    cross_rates: np.ndarray = None,
+    fee_usd_rates: np.ndarray = None,
+) -> np.ndarray:
+    """Fees in the quote currency of their fill
+
+    Fees in the quote currency are taken as is and fees in the base currency
+    at the fill price. Any other currency goes through USD: its USD rate
+    divided by the USD value of one unit of quote currency, the inverse of
+    convert_to_usd.
+
+    Args:
+        fee (np.ndarray): Fee amounts
+        fee_currency (np.ndarray): Currency of every fee
+        cur_base (np.ndarray): Base currency of the fill
+        cur_quote (np.ndarray): Quote currency of the fill
+        price (np.ndarray): Fill price
+        modes (np.ndarray): Output of conversion_modes for the same rows
+        cross_rates (np.ndarray, optional): USD value of one unit of the quote
+            currency for the UNSUPPORTED rows. Defaults to None.
+        fee_usd_rates (np.ndarray, optional): USD value of one unit of the fee
+            currency, 1 for USD, needed where it is neither cur_base nor
+            cur_quote. Defaults to None.
+
+    Returns:
+        np.ndarray: Fees in quote currency, NaN where a rate is missing
+    """
+    fee = np.asarray(fee, dtype=np.float64)
+    price = np.asarray(price, dtype=np.float64)
+    in_quote = fee_currency == cur_quote
+    in_base = fee_currency == cur_base
+    converted = np.where(in_base, fee * price, fee)
+    other = ~(in_quote | in_base)
+    if other.any():
+        with np.errstate(divide="ignore"):
+            usd_per_quote = np.where(modes == BASE_USD, 1 / price, 1.0)
+        if cross_rates is not None:
+            usd_per_quote = np.where(modes == UNSUPPORTED, cross_rates, usd_per_quote)
+        if fee_usd_rates is None:
+            fee_usd_rates = np.full(len(fee), np.nan)
+        converted = np.where(other, fee * fee_usd_rates / usd_per_quote, converted)
+    return converted
+
+
+class FXRates:
+    """Time-indexed FX rate table converting crosses such as EUR/KZT to USD
+
+    Every currency is resolved once to the shortest path of rate pairs that
+    leads to USD, e.g. KZT -> USD through USD/KZT or through EUR/KZT and
+    EUR/USD. A time takes the last rate at or before it. Rates of a currency
+    are cached per time bucket, so a large book only looks up every (currency,
+    bucket) once, except in buckets in which some rate of the path changes,
+    whose times are looked up one by one.
+
+    Args:
+        rates (pd.DataFrame): Rates with cur_base, cur_quote, ts and rate
+            columns, one unit of cur_base costs rate units of cur_quote
+        bucket (str, optional): Length of the cached time buckets as a pandas
+            frequency. Defaults to '1min'.
+    """
+
+    def __init__(self, rates: pd.DataFrame, bucket: str = "1min"):
+        self.bucket = bucket
+        pair_codes, pairs = _factorize_composite(rates, ["cur_base", "cur_quote"])
+        ts = pd.to_datetime(rates["ts"]).astype("datetime64[ns]").to_numpy()
+        order = np.lexsort((ts, pair_codes))
+        bounds = np.searchsorted(pair_codes[order], np.arange(len(pairs) + 1))
+        self._pairs = list(pairs)
+        self._ts = [ts[order[a:b]] for a, b in zip(bounds[:-1], bounds[1:])]
+        self._rates = [
+            rates["rate"].to_numpy(dtype=np.float64)[order[a:b]]
+            for a, b in zip(bounds[:-1], bounds[1:])
+        ]
+        self._paths = {}
+        # currency -> sorted bucket starts, their rates and whether a rate
+        # changes inside them
+        self._cache = {}
+
+    def path(self, currency: str) -> list:
+        """Hops converting currency to USD as (pair, invert) tuples
+
+        Args:
+            currency (str): Currency to convert
+
+        Raises:
+            ValueError: If no chain of rates leads from currency to USD
+
+        Returns:
+            list: Pair positions in the table, invert when the hop goes from
+                cur_quote to cur_base
+        """
+        if currency not in self._paths:
+            self._paths[currency] = self._resolve(currency)
+        if self._paths[currency] is None:
+            raise ValueError(f"No FX rates lead from {currency} to {USD}")
+        return self._paths[currency]
+
+    def _resolve(self, currency: str):
+        # breadth-first search, so the path uses as few rates as possible
+        paths = {currency: []}
+        queue = [currency]
+        for current in queue:
+            if current == USD:
+                return paths[current]
+            for pair, (cur_base, cur_quote) in enumerate(self._pairs):
+                for source, target, invert in (
+                    (cur_base, cur_quote, False),
+                    (cur_quote, cur_base, True),
+                ):
+                    if source == current and target not in paths:
+                        paths[target] = paths[current] + [(pair, invert)]
+                        queue.append(target)
+        return None
+
+    def check(self, currencies):
+        """Raises if some of the currencies can't be converted to USD
+
+        Raises:
+            ValueError: If no chain of rates leads from a currency to USD
+        """
+        missing = []
+        for currency in sorted(set(currencies)):
+            try:
+                self.path(currency)
+            except ValueError:
+                missing.append(currency)
+        if missing:
+            raise ValueError(f"No FX rates lead from {', '.join(missing)} to {USD}")
+
+    def _rates_at(self, currency: str, ts: np.ndarray) -> np.ndarray:
+        rates = np.ones(len(ts), dtype=np.float64)
+        for pair, invert in self.path(currency):
+            positions = np.searchsorted(self._ts[pair], ts, side="right") - 1
+            hop = np.where(
+                positions >= 0, self._rates[pair][np.maximum(positions, 0)], np.nan
+            )
+            rates = rates / hop if invert else rates * hop
+        return rates
+
+    def _changing(self, currency: str, starts: np.ndarray) -> np.ndarray:
+        # True for buckets in which a rate of the path changes after the start
+        ends = starts + pd.tseries.frequencies.to_offset(self.bucket).nanos
+        changing = np.zeros(len(starts), dtype=bool)
+        for pair, _ in self.path(currency):
+            after = np.searchsorted(self._ts[pair], starts, side="right")
+            changing |= np.searchsorted(self._ts[pair], ends, side="left") > after
+        return changing
+
+    def usd_rates(self, currencies, ts) -> np.ndarray:
+        """USD value of one unit of every row's currency at its time
+
+        Args:
+            currencies (array-like): Currency of every row
+            ts (array-like): Time of every row
+
+        Returns:
+            np.ndarray: Rates, NaN before the first rate of some hop
+        """
+        ts = pd.to_datetime(np.asarray(ts)).astype("datetime64[ns]").to_numpy()
+        nanos = pd.tseries.frequencies.to_offset(self.bucket).nanos
+        buckets = ts.view(np.int64) // nanos * nanos
+        currency_codes, names = pd.factorize(np.asarray(currencies, dtype=object))
+        rates = np.empty(len(ts), dtype=np.float64)
+        for code, currency in enumerate(names):
+            rows = np.flatnonzero(currency_codes == code)
+            keys, codes = np.unique(buckets[rows], return_inverse=True)
+            cached, cached_rates, cached_changing = self._cached(currency, keys)
+            positions = np.searchsorted(cached, keys)
+            rates[rows] = cached_rates[positions][codes]
+            # rows in buckets with a rate change are looked up at their time
+            exact = rows[cached_changing[positions][codes]]
+            rates[exact] = self._rates_at(currency, ts[exact])
+        return rates
+
+    def _cached(self, currency: str, buckets: np.ndarray) -> tuple:
+        # sorted bucket starts of a currency with their rate and whether it
+        # changes inside, extended with the buckets not looked up before
+        cached, cached_rates, cached_changing = self._cache.get(
+            currency,
+            (np.empty(0, np.int64), np.empty(0, np.float64), np.empty(0, bool)),
+        )
+        positions = np.searchsorted(cached, buckets)
+        found = np.zeros(len(buckets), dtype=bool)
+        inside = positions < len(cached)
+        found[inside] = cached[positions[inside]] == buckets[inside]
+        if not found.all():
+            missing = buckets[~found]
+            starts = missing.view("datetime64[ns]")
+            merged = [
+                np.concatenate([old, new])
+                for old, new in zip(
+                    (cached, cached_rates, cached_changing),
+                    (
+                        missing,
+                        self._rates_at(currency, starts),
+                        self._changing(currency, starts),
+                    ),
+                )
+            ]
+            order = np.argsort(merged[0], kind="stable")
+            self._cache[currency] = tuple(values[order] for values in merged)
+        return self._cache[currency]
@@ -0,0 +1,233 @@
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .constants import BASE_COLUMNS, STATE_COLUMNS
+    from .pl_calculator import PLCalculator, totals_from_state
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    from constants import BASE_COLUMNS, STATE_COLUMNS
+    from pl_calculator import PLCalculator, totals_from_state
+
+# Position of a state in the ts order of its instrument: arrival number of the
+# last fill it covers and how many fills it covers
+CURSOR_COLUMNS = ["seq", "fills"]
+
+
+class IncrementalPLCalculator:
+    """Calculates P&L batch by batch, keeping the state of every instrument
+
+    Each batch only contains the new fills, which must come after the fills of
+    earlier batches of the same instrument. Results equal a full recompute of
+    all fills at once, up to the rounding of the summed realized P&L.
+
+    Args:
+        state (pd.DataFrame, optional): State to start from, see
+            PLCalculator.final_state. Defaults to None, which means no history.
+    """
+
+    def __init__(self, state: pd.DataFrame = None):
+        self.state = state
+
+    def update(self, new_fills: pd.DataFrame) -> tuple:
+        """Calculates the new fills and advances the state
+
+        Args:
+            new_fills (pd.DataFrame): Fills with at least BASE_COLUMNS
+
+        Returns:
+            tuple: Derived columns of the new fills as returned by
+                PLCalculator.calculate and the updated totals
+        """
+        pl_calc = PLCalculator(new_fills, engine="vectorized", initial_state=self.state)
+        rows = pl_calc.calculate()
+        self.state = pl_calc.final_state()
+        return rows, self.totals()
+
+    def update_chunks(self, chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+        """Calculates chunks of fills one after another, see reader.read_data_chunks
+
+        Only one chunk is held at a time, instruments spanning several chunks
+        continue from the state left by the previous chunk.
+
+        Args:
+            chunks (Iterable[pd.DataFrame]): Consecutive chunks of fills
+
+        Yields:
+            pd.DataFrame: Derived columns of every chunk
+        """
+        for chunk in chunks:
+            rows, _ = self.update(chunk)
+            yield rows
+
+    def totals(self) -> pd.DataFrame:
+        """Total P&L of every instrument seen so far"""
+        if self.state is None:
+            return totals_from_state(
+                pd.DataFrame(
+                    columns=["unrealized_pnl_usd", "realized_pnl_usd"],
+                    index=pd.Index([], name="instrument_exch"),
+                )
+            )
+        return totals_from_state(self.state)
+
+
+class LateFillPLCalculator(IncrementalPLCalculator):
+    """Calculates batches of fills that may arrive late or out of order
+
+    Fills of every instrument are calculated in ts order, fills with equal ts
+    in arrival order. A batch with fills older than the state of their
+    instrument, e.g. back-office corrections, restarts only that instrument
+    from its latest checkpoint at or before the oldest new fill and replays
+    the fills after it. Instruments with fills in order just continue from
+    their state. Results equal a full recompute with sort_by_ts, up to the
+    rounding of the summed realized P&L.
+
+    Every fill is kept in the history of its instrument to be replayed, so a
+    batch only touches the history of the instruments it has fills of.
+    Checkpoints are copies of the state of an instrument taken after a batch
+    once it has checkpoint_every more fills than its previous checkpoint.
+
+    Args:
+        checkpoint_every (int, optional): Fills of an instrument between two
+            checkpoints. Fewer replay less but keep more states. Defaults to
+            1000.
+    """
+
+    def __init__(self, checkpoint_every: int = 1000):
+        super().__init__()
+        self.checkpoint_every = checkpoint_every
+        # fills of every instrument indexed by their arrival number, as the
+        # chunks of the batches since the history was last read
+        self.history = {}
+        self._arrivals = 0
+        # STATE_COLUMNS and CURSOR_COLUMNS, several rows per instrument in ts
+        # order, None while no instrument has one
+        self.checkpoints = None
+        self._cursor = None
+
+    def update(self, new_fills: pd.DataFrame) -> tuple:
+        """Calculates the new fills and restates the fills after late ones
+
+        Args:
+            new_fills (pd.DataFrame): Fills with at least BASE_COLUMNS in any
+                ts order
+
+        Returns:
+            tuple: Derived columns of the new and the replayed fills as
+                returned by PLCalculator.calculate, indexed by arrival number,
+                and the updated totals
+        """
+        start = self._arrivals
+        new_fills = new_fills[BASE_COLUMNS].set_axis(
+            pd.RangeIndex(start, start + len(new_fills))
+        )
+        if new_fills.empty:
+            return new_fills, self.totals()
+        if not self.history:
+            fills, restart = new_fills, None
+        else:
+            first_ts = new_fills.groupby("instrument_exch", observed=True)["ts"].min()
+            restart = self._restart_points(first_ts)
+            # fills at or after the state of their instrument replay nothing
+            state_ts = self.state["ts"].reindex(first_ts.index)
+            late = first_ts.index[(first_ts < state_ts).to_numpy()]
+            replayed = [self._replayed(instrument, restart) for instrument in late]
+            replayed = [part for part in replayed if len(part)]
+            if replayed:
+                # in arrival order like the fills were first calculated
+                replayed = [pd.concat(replayed).sort_index()]
+            fills = pd.concat(replayed + [new_fills])
+        pl_calc = PLCalculator(
+            fills,
+            engine="vectorized",
+            initial_state=None if restart is None else restart[STATE_COLUMNS],
+            sort_by_ts=True,
+        )
+        rows = pl_calc.calculate()
+
+        segments = pl_calc.segments
+        fill_counts = np.diff(segments.offsets)
+        if restart is not None:
+            fill_counts += (
+                restart["fills"].reindex(segments.keys, fill_value=0).to_numpy()
+            )
+        cursor = pd.DataFrame(
+            {
+                "seq": segments.last(segments.sort(fills.index.to_numpy())),
+                "fills": fill_counts,
+            },
+            index=segments.keys,
+        )
+        self._advance(pl_calc.final_state(), cursor)
+        for instrument, chunk in new_fills.groupby(
+            "instrument_exch", observed=True, sort=False
+        ):
+            self.history.setdefault(instrument, []).append(chunk)
+        self._arrivals += len(new_fills)
+        return rows, self.totals()
+
+    def _restart_points(self, first_ts: pd.Series) -> pd.DataFrame:
+        # Latest state of every instrument at or before its oldest new fill,
+        # new fills sort after it since they arrive later. Checkpoints after
+        # it are stale and dropped. The current state becomes a checkpoint
+        # first if it is far enough from the previous one.
+        current = self.state.join(self._cursor)
+        current = current[current.index.isin(first_ts.index)]
+        checkpoints = self.checkpoints
+        previous = pd.Series(0, index=current.index)
+        if checkpoints is not None:
+            previous = (
+                checkpoints["fills"]
+                .groupby(level=0)
+                .last()
+                .reindex(current.index, fill_value=0)
+            )
+        promoted = current[current["fills"] - previous >= self.checkpoint_every]
+        if len(promoted):
+            checkpoints = pd.concat([checkpoints, promoted]).sort_index(kind="stable")
+        if checkpoints is not None:
+            limit = first_ts.reindex(checkpoints.index).to_numpy()
+            stale = checkpoints["ts"].to_numpy() > limit
+            self.checkpoints = checkpoints = checkpoints[~stale]
+
+        valid = current[current["ts"] <= first_ts.reindex(current.index)]
+        if checkpoints is None:
+            return valid
+        candidates = pd.concat(
+            [checkpoints[checkpoints.index.isin(first_ts.index)], valid]
+        )
+        return candidates[~candidates.index.duplicated(keep="last")]
+
+    def _fills_of(self, instrument) -> pd.DataFrame:
+        # history of an instrument, its chunks joined once on read
+        chunks = self.history[instrument]
+        if len(chunks) > 1:
+            chunks[:] = [pd.concat(chunks)]
+        return chunks[0]
+
+    def _replayed(self, instrument, restart: pd.DataFrame) -> pd.DataFrame:
+        # fills of the instrument after its restart point in ts order
+        history = self._fills_of(instrument)
+        if instrument not in restart.index:
+            # instruments without restart point are replayed from their first fill
+            return history
+        point = restart.loc[instrument]
+        ts = history["ts"].to_numpy()
+        point_ts = pd.Timestamp(point["ts"]).to_datetime64()
+        after = (ts > point_ts) | (
+            (ts == point_ts) & (history.index.to_numpy() > point["seq"])
+        )
+        return history[after]
+
+    def _advance(self, state: pd.DataFrame, cursor: pd.DataFrame):
+        if self.state is None:
+            self.state, self._cursor = state, cursor
+            return
+        self.state = pd.concat(
+            [self.state.drop(state.index, errors="ignore"), state]
+        ).sort_index()
+        self._cursor = pd.concat(
+            [self._cursor.drop(cursor.index, errors="ignore"), cursor]
+        ).sort_index()
@@ -0,0 +1,515 @@
+# Array-level kernels behind the "vectorized" engine of PLCalculator.
+# Every function here works on whole NumPy columns and mirrors one of the
+# row-wise helpers of PLCalculator, so both engines give identical results.
+
+import importlib
+import os
+import sys
+
+import numpy as np
+
+# numba is optional and only imported by the first loop kernel that runs, so
+# that the row-wise engine and short runs don't pay for importing it. Loops
+# run as plain Python without it.
+_NOT_LOADED = object()
+numba = _NOT_LOADED
+
+# Compiled loop of every loop kernel run so far
+_JITTED = {}
+
+
+def load_numba():
+    """Imports numba on first call
+
+    Returns:
+        module: numba, None if it isn't installed
+    """
+    global numba
+    if numba is _NOT_LOADED:
+        try:
+            import numba as module
+        except ImportError:
+            module = None
+        numba = module
+    return numba
+
+
+def signed_amount(side: np.ndarray, amount: np.ndarray) -> np.ndarray:
+    """Columnar version of PLCalculator.signed_amount
+
+    Args:
+        side (np.ndarray): Side of the fill, 1 for buy and anything else for sell
+        amount (np.ndarray): Unsigned amount of the fill
+
+    Returns:
+        np.ndarray: amount for buys and -amount for sells
+    """
+    return np.where(side == 1, amount, -amount)
+
+
+def amount_liquidated(
+    amount_signed: np.ndarray, lag_running_balance: np.ndarray
+) -> np.ndarray:
+    """Columnar version of PLCalculator._amount_liquidated
+
+    NaN in lag_running_balance (first fill of an instrument) never liquidates.
+    If nothing is liquidated the result is integer zeros, as the row-wise
+    apply infers int64 when every row returns 0.
+
+    Args:
+        amount_signed (np.ndarray): Signed amount of the fill
+        lag_running_balance (np.ndarray): Running balance before the fill
+
+    Returns:
+        np.ndarray: min(|amount_signed|, |lag_running_balance|) for fills
+            against the open position, 0 otherwise
+    """
+    liquidating = np.sign(amount_signed) * np.sign(lag_running_balance) == -1
+    if not liquidating.any():
+        return np.zeros(len(amount_signed), dtype=np.int64)
+    return np.where(
+        liquidating,
+        np.minimum(np.abs(amount_signed), np.abs(lag_running_balance)),
+        0,
+    )
+
+
+def liquidation_flags(
+    amount_signed: np.ndarray, running_balance: np.ndarray
+) -> np.ndarray:
+    """Columnar version of PLCalculator._liquidation_check
+
+    Args:
+        amount_signed (np.ndarray): Signed amount of the fill
+        running_balance (np.ndarray): Running balance after the fill
+
+    Returns:
+        np.ndarray: 1 where the fill and the resulting balance have opposite
+            signs, 0 otherwise
+    """
+    return (np.sign(amount_signed) * np.sign(running_balance) == -1).astype(int)
+
+
+def _package_loop(loop):
+    # The on-disk cache of numba records the module a loop was compiled in and
+    # imports it by name when loading, so a cache written for package.kernels
+    # fails to load for this file imported as kernels from a script. Loops are
+    # always compiled from the package module, None if it can't be imported.
+    if __package__:
+        return loop
+    directory = os.path.dirname(os.path.abspath(__file__))
+    package = os.path.basename(directory)
+    if not package.isidentifier():
+        return None
+    parent = os.path.dirname(directory)
+    if parent not in sys.path:
+        sys.path.append(parent)
+    try:
+        module = importlib.import_module(f"{package}.kernels")
+    except ImportError:
+        return None
+    if os.path.abspath(module.__file__) != os.path.abspath(__file__):
+        return None
+    return getattr(module, loop.__name__)
+
+
+def _run_loop(loop, inputs: list, sizes: list) -> list:
+    # Runs a loop kernel compiled when numba is available, otherwise as plain
+    # Python over lists, which is much faster than indexing NumPy scalars.
+    if load_numba() is not None:
+        if loop not in _JITTED:
+            package_loop = _package_loop(loop)
+            if package_loop is None:
+                _JITTED[loop] = numba.njit(loop)
+            else:
+                _JITTED[loop] = numba.njit(cache=True)(package_loop)
+        outputs = [np.empty(size, dtype=np.float64) for size in sizes]
+        _JITTED[loop](*inputs, *outputs)
+        return outputs
+    outputs = [[0.0] * size for size in sizes]
+    loop(*[array.tolist() for array in inputs], *outputs)
+    return [np.array(output, dtype=np.float64) for output in outputs]
+
+
+def _inventory_loop(
+    starts,
+    initial_inventory,
+    initial_cost,
+    side,
+    price,
+    amount_signed,
+    running_balance,
+    lag_running_balance,
+    amount_liquidated,
+    flag_liquidation,
+    capitalized_fee,
+    compensated,
+    inventory_change,
+    running_inventory,
+    inventory_cost,
+):
+    # Same state machine as PLCalculator.inventory_metrics, with the state reset
+    # at every segment start instead of a nested loop per group. Compensated
+    # runs keep the inventory as a Neumaier sum, the rounding error of every
+    # addition is collected in compensation and the total is their sum.
+    segment = -1
+    inventory = 0.0
+    compensation = 0.0
+    cost = 0.0
+    for i in range(len(starts)):
+        if starts[i]:
+            segment += 1
+            inventory = initial_inventory[segment]
+            compensation = 0.0
+            cost = initial_cost[segment]
+        if lag_running_balance[i] == 0 or amount_liquidated[i] > 0:
+            change = price[i] * running_balance[i] * (1 - flag_liquidation[i])
+        else:
+            change = amount_signed[i] * price[i] * (1 - flag_liquidation[i])
+        change += side[i] * amount_liquidated[i] * cost
+        if capitalized_fee[i] != 0:
+            change += capitalized_fee[i]
+        if running_balance[i] == 0:
+            # The row-wise reference divides by zero here. A flat position
+            # carries no inventory, so close it out and start over.
+            change = -(inventory + compensation) if compensated[0] else -inventory
+            inventory = 0.0
+            compensation = 0.0
+            cost = 0.0
+        elif compensated[0]:
+            total = inventory + change
+            if abs(inventory) >= abs(change):
+                compensation += (inventory - total) + change
+            else:
+                compensation += (change - total) + inventory
+            inventory = total
+            cost = (inventory + compensation) / running_balance[i]
+        else:
+            inventory += change
+            cost = inventory / running_balance[i]
+        inventory_change[i] = change
+        running_inventory[i] = inventory + compensation if compensated[0] else inventory
+        inventory_cost[i] = cost
+
+
+def _initial(values, segments: int) -> np.ndarray:
+    if values is None:
+        return np.zeros(segments, dtype=np.float64)
+    return np.asarray(values, dtype=np.float64)
+
+
+def inventory_metrics(
+    starts: np.ndarray,
+    side: np.ndarray,
+    price: np.ndarray,
+    amount_signed: np.ndarray,
+    running_balance: np.ndarray,
+    lag_running_balance: np.ndarray,
+    amount_liquidated: np.ndarray,
+    flag_liquidation: np.ndarray,
+    initial_inventory: np.ndarray = None,
+    initial_cost: np.ndarray = None,
+    capitalized_fee: np.ndarray = None,
+    compensated: bool = False,
+) -> tuple:
+    """Columnar version of PLCalculator.inventory_metrics
+
+    Rows must be sorted so that every instrument is one contiguous segment in
+    its original order, with starts marking the first row of each segment.
+    The state machine is JIT-compiled with numba when it is installed and runs
+    as a plain Python loop over lists otherwise.
+
+    Args:
+        initial_inventory (np.ndarray, optional): running_inventory carried into
+            every segment. Defaults to zeros.
+        initial_cost (np.ndarray, optional): inventory_cost carried into every
+            segment. Defaults to zeros.
+        capitalized_fee (np.ndarray, optional): Fee in quote currency added to
+            the inventory of every row, which raises the cost of longs and
+            lowers the entry price of shorts. Defaults to zeros.
+        compensated (bool, optional): Accumulates the inventory with Neumaier
+            compensated summation, which keeps the error of long histories at
+            about one rounding instead of growing with every fill. Results
+            then differ from the reference in the last bits. Defaults to False.
+
+    Returns:
+        tuple: inventory_change, running_inventory and inventory_cost arrays
+    """
+    starts = np.asarray(starts, dtype=bool)
+    segments = int(starts.sum())
+    inputs = [
+        starts,
+        _initial(initial_inventory, segments),
+        _initial(initial_cost, segments),
+    ] + [
+        np.asarray(column, dtype=np.float64)
+        for column in (
+            side,
+            price,
+            amount_signed,
+            running_balance,
+            lag_running_balance,
+            amount_liquidated,
+            flag_liquidation,
+        )
+    ]
+    if capitalized_fee is None:
+        capitalized_fee = np.zeros(len(starts))
+    inputs.append(np.asarray(capitalized_fee, dtype=np.float64))
+    inputs.append(np.array([compensated], dtype=np.bool_))
+    return tuple(_run_loop(_inventory_loop, inputs, [len(starts)] * 3))
+
+
+def realized_pnl(
+    side: np.ndarray,
+    price: np.ndarray,
+    amount_liquidated: np.ndarray,
+    lag_running_inventory: np.ndarray,
+    lag_inventory_cost: np.ndarray,
+) -> np.ndarray:
+    """Columnar version of PLCalculator._realized_pnl"""
+    price_diff = (
+        -1 * side * price - 1 * np.sign(lag_running_inventory) * lag_inventory_cost
+    )
+    return amount_liquidated * price_diff
+
+
+def unrealized_pnl(
+    price: np.ndarray,
+    running_balance: np.ndarray,
+    lag_running_inventory: np.ndarray,
+    lag_inventory_cost: np.ndarray,
+) -> np.ndarray:
+    """Columnar version of PLCalculator._unrealized_pnl"""
+    price_diff = price - lag_inventory_cost
+    sign = np.sign(lag_running_inventory)
+    return price_diff * running_balance * sign
+
+
+def _compensated_cumsum_loop(
+    starts, initial_total, initial_compensation, values, out, compensation_out
+):
+    # Kahan summation restarted at every segment start, the algorithm pandas
+    # uses for groupby(...).cumsum() on floats. NaN rows stay NaN and are skipped.
+    segment = -1
+    total = 0.0
+    compensation = 0.0
+    for i in range(len(values)):
+        if starts[i]:
+            segment += 1
+            total = initial_total[segment]
+            compensation = initial_compensation[segment]
+            compensation_out[segment] = compensation
+        value = values[i]
+        if value != value:
+            out[i] = value
+            continue
+        y = value - compensation
+        t = total + y
+        compensation = t - total - y
+        total = t
+        out[i] = total
+        compensation_out[segment] = compensation
+
+
+def compensated_cumsum(
+    starts: np.ndarray,
+    values: np.ndarray,
+    initial_total: np.ndarray = None,
+    initial_compensation: np.ndarray = None,
+) -> tuple:
+    """Cumulative sum of floats inside every segment, identical to groupby cumsum
+
+    Passing the totals and compensations returned for earlier rows continues
+    the sums exactly as if all rows had been summed in one go.
+
+    Args:
+        starts (np.ndarray): True on the first row of every segment
+        values (np.ndarray): Values in segment order
+        initial_total (np.ndarray, optional): Sum carried into every segment.
+            Defaults to zeros.
+        initial_compensation (np.ndarray, optional): Kahan compensation carried
+            into every segment. Defaults to zeros.
+
+    Returns:
+        tuple: Running sums restarted at every segment and the compensation
+            at the end of every segment
+    """
+    starts = np.asarray(starts, dtype=bool)
+    segments = int(starts.sum())
+    out, compensation = _run_loop(
+        _compensated_cumsum_loop,
+        [
+            starts,
+            _initial(initial_total, segments),
+            _initial(initial_compensation, segments),
+            np.asarray(values, dtype=np.float64),
+        ],
+        [len(starts), segments],
+    )
+    return out, compensation
+
+
+def _compensated_sum_loop(offsets, values, out):
+    # Neumaier summation of every segment, NaN rows are skipped
+    for segment in range(len(offsets) - 1):
+        total = 0.0
+        compensation = 0.0
+        for i in range(offsets[segment], offsets[segment + 1]):
+            value = values[i]
+            if value != value:
+                continue
+            t = total + value
+            if abs(total) >= abs(value):
+                compensation += (total - t) + value
+            else:
+                compensation += (value - t) + total
+            total = t
+        out[segment] = total + compensation
+
+
+def compensated_sum(offsets: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Sum of every segment with Neumaier compensated summation, skipping NaN
+
+    Args:
+        offsets (np.ndarray): Start of every segment followed by the end of
+            the last one, see Segments.offsets
+        values (np.ndarray): Values in segment order
+
+    Returns:
+        np.ndarray: Sum of every segment
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    (out,) = _run_loop(
+        _compensated_sum_loop,
+        [offsets, np.asarray(values, dtype=np.float64)],
+        [len(offsets) - 1],
+    )
+    return out
+
+
+# Lot selection of lot_metrics
+FIFO = 0
+LIFO = 1
+
+
+def _lot_loop(
+    starts,
+    method,
+    targets,
+    side,
+    price,
+    amount_signed,
+    running_balance,
+    amount_liquidated,
+    quantity,
+    lot_price,
+    lots,
+    inventory_change,
+    running_inventory,
+    inventory_cost,
+    realized,
+):
+    # Open lots of the current segment are row positions in lots[head:tail],
+    # a deque consumed from the head for FIFO and from the tail for LIFO.
+    # Every row opens at most one lot at its own position, so the deque never
+    # outgrows the segment. Lots emptied by a specific-ID close stay in the
+    # deque with zero quantity and are skipped once when reached.
+    head = 0
+    tail = 0
+    value = 0.0
+    inventory = 0.0
+    for i in range(len(starts)):
+        if starts[i]:
+            head = i
+            tail = i
+            value = 0.0
+            inventory = 0.0
+        remaining = amount_liquidated[i]
+        # a closing fill trades against the position, so -side is its sign
+        direction = -side[i]
+        pnl = 0.0
+        target = targets[i]
+        if remaining > 0 and target >= 0 and quantity[target] > 0:
+            take = min(remaining, quantity[target])
+            pnl += take * (price[i] - lot_price[target]) * direction
+            value -= take * lot_price[target]
+            quantity[target] -= take
+            remaining -= take
+        while remaining > 0 and head < tail:
+            lot = lots[head] if method[0] == FIFO else lots[tail - 1]
+            take = min(remaining, quantity[lot])
+            pnl += take * (price[i] - lot_price[lot]) * direction
+            value -= take * lot_price[lot]
+            quantity[lot] -= take
+            remaining -= take
+            if quantity[lot] <= 0:
+                if method[0] == FIFO:
+                    head += 1
+                else:
+                    tail -= 1
+        opened = abs(amount_signed[i]) - amount_liquidated[i]
+        if opened > 0:
+            quantity[i] = opened
+            lot_price[i] = price[i]
+            lots[tail] = i
+            tail += 1
+            value += opened * price[i]
+        if running_balance[i] == 0:
+            # same reset of a flat position as _inventory_loop
+            head = tail
+            value = 0.0
+            change = -inventory
+            inventory = 0.0
+            cost = 0.0
+        else:
+            sign = 1.0 if running_balance[i] > 0 else -1.0
+            change = sign * value - inventory
+            inventory = sign * value
+            cost = inventory / running_balance[i]
+        inventory_change[i] = change
+        running_inventory[i] = inventory
+        inventory_cost[i] = cost
+        realized[i] = pnl
+
+
+def lot_metrics(
+    starts: np.ndarray,
+    method: int,
+    side: np.ndarray,
+    price: np.ndarray,
+    amount_signed: np.ndarray,
+    running_balance: np.ndarray,
+    amount_liquidated: np.ndarray,
+    targets: np.ndarray = None,
+) -> tuple:
+    """Inventory and realized P&L with lot-level FIFO or LIFO cost basis
+
+    Counterpart of inventory_metrics for lot methods. Liquidated amounts
+    close the oldest (FIFO) or newest (LIFO) open lots, whatever exceeds the
+    position opens a lot on the other side, like amount_liquidated does on a
+    flip. Rows must be in segment order, see inventory_metrics.
+
+    Args:
+        method (int): FIFO or LIFO
+        targets (np.ndarray, optional): Position of the lot every row closes
+            first (specific identification), -1 for none. Defaults to none.
+
+    Returns:
+        tuple: inventory_change, running_inventory, inventory_cost and
+            realized P&L in quote currency arrays
+    """
+    starts = np.asarray(starts, dtype=bool)
+    size = len(starts)
+    if targets is None:
+        targets = np.full(size, -1, dtype=np.int64)
+    inputs = [
+        starts,
+        np.array([method], dtype=np.int64),
+        np.asarray(targets, dtype=np.int64),
+    ] + [
+        np.asarray(column, dtype=np.float64)
+        for column in (side, price, amount_signed, running_balance, amount_liquidated)
+    ]
+    scratch = [np.zeros(size), np.zeros(size), np.zeros(size, dtype=np.int64)]
+    return tuple(_run_loop(_lot_loop, inputs + scratch, [size] * 4))
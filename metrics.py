@@ -0,0 +1,122 @@
+# Instrumentation of PLCalculator stages.
+# An observer is any callable taking the record of one stage, StageMetrics
+# collects them and exports JSON or Prometheus text.
+
+import contextlib
+import json
+import time
+import tracemalloc
+
+# Fields of a stage record besides its name, with their Prometheus help text
+RECORD_FIELDS = {
+    "wall_seconds": "Wall time of the stage",
+    "cpu_seconds": "CPU time of the stage",
+    "rows": "Rows processed by the stage",
+    "memory_delta_bytes": "Traced memory after minus before the stage",
+    "failed": "1 if the stage raised, 0 otherwise",
+}
+
+
+@contextlib.contextmanager
+def measure(stage: str, rows: int, observer):
+    """Measures the enclosed block and passes its record to the observer
+
+    Memory is only measured while tracemalloc is tracing, otherwise
+    memory_delta_bytes is None. A block that raises is reported as well, with
+    failed set to 1 and error to the repr of the exception, which is then
+    raised on.
+
+    Args:
+        stage (str): Name of the stage
+        rows (int): Rows processed by the stage
+        observer (callable): Called with the record dict after the block
+    """
+    tracing = tracemalloc.is_tracing()
+    memory = tracemalloc.get_traced_memory()[0] if tracing else None
+    wall, cpu = time.perf_counter(), time.process_time()
+    error = None
+    try:
+        yield
+    except BaseException as exception:
+        error = repr(exception)
+        raise
+    finally:
+        observer(
+            {
+                "stage": stage,
+                "wall_seconds": time.perf_counter() - wall,
+                "cpu_seconds": time.process_time() - cpu,
+                "rows": rows,
+                "memory_delta_bytes": (
+                    tracemalloc.get_traced_memory()[0] - memory if tracing else None
+                ),
+                "failed": int(error is not None),
+                "error": error,
+            }
+        )
+
+
+def _label_value(value) -> str:
+    # escaping of label values in the Prometheus text exposition format
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class StageMetrics:
+    """Observer collecting the records of every stage run
+
+    Args:
+        trace_memory (bool, optional): Start tracemalloc so that memory deltas
+            are recorded, at the price of slower stages. Defaults to False.
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.records = []
+        self._started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start()
+
+    def __call__(self, record: dict):
+        self.records.append(record)
+
+    def stop(self):
+        """Stops tracemalloc if it was started by this object"""
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+
+    def latest(self) -> dict:
+        """Last record of every stage, keyed by stage name"""
+        return {record["stage"]: record for record in self.records}
+
+    def to_json(self) -> str:
+        """All records as a JSON array"""
+        return json.dumps(self.records)
+
+    def to_prometheus(self, prefix: str = "pl_calculator_stage", labels=None) -> str:
+        """Last record of every stage in the Prometheus text exposition format
+
+        Args:
+            prefix (str, optional): Metric name prefix. Defaults to
+                'pl_calculator_stage'.
+            labels (dict, optional): Extra labels for every sample, e.g. the
+                job name. Defaults to None.
+
+        Returns:
+            str: One gauge per record field with a stage label
+        """
+        latest = self.latest()
+        lines = []
+        for field, help in RECORD_FIELDS.items():
+            name = f"{prefix}_{field}"
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            for stage, record in latest.items():
+                if record[field] is None:
+                    continue
+                sample_labels = {**(labels or {}), "stage": stage}
+                label_text = ",".join(
+                    f'{key}="{_label_value(value)}"'
+                    for key, value in sample_labels.items()
+                )
+                lines.append(f"{name}{{{label_text}}} {record[field]}")
+        return "\n".join(lines) + "\n"
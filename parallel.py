@@ -0,0 +1,166 @@
+# Parallel P&L calculation across instruments.
+# Instruments are independent, so the rows are split into shards of whole
+# instruments balanced by row count and every shard runs in its own process.
+# Columns travel through shared memory, only small descriptors are pickled.
+
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+try:
+    from . import fx
+    from .constants import DERIVED_COLUMNS
+    from .pl_calculator import PLCalculator
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    import fx
+    from constants import DERIVED_COLUMNS
+    from pl_calculator import PLCalculator
+
+
+def shard_instruments(row_counts: np.ndarray, shards: int) -> list:
+    """Splits instruments into shards with about the same number of rows
+
+    Largest instruments are placed first, each into the currently lightest
+    shard (longest processing time first).
+
+    Args:
+        row_counts (np.ndarray): Number of rows of every instrument code
+        shards (int): Number of shards
+
+    Returns:
+        list: Array of instrument codes for every non-empty shard
+    """
+    heap = [(0, shard) for shard in range(shards)]
+    members = [[] for _ in range(shards)]
+    for code in np.argsort(-np.asarray(row_counts), kind="stable"):
+        rows, shard = heapq.heappop(heap)
+        members[shard].append(code)
+        heapq.heappush(heap, (rows + row_counts[code], shard))
+    return [np.array(codes, dtype=np.int64) for codes in members if codes]
+
+
+def _share(values: np.ndarray, blocks: list) -> tuple:
+    block = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(values.shape, dtype=values.dtype, buffer=block.buf)[...] = values
+    return block.name, values.dtype.str, values.shape
+
+
+def _attach(descriptor: tuple, blocks: list) -> np.ndarray:
+    name, dtype, shape = descriptor
+    block = shared_memory.SharedMemory(name=name)
+    blocks.append(block)
+    return np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _calculate_shard(task: tuple) -> dict:
+    columns, output, start, end, instruments, pairs, engine = task
+    blocks = []
+    try:
+        shared = {
+            name: _attach(descriptor, blocks) for name, descriptor in columns.items()
+        }
+        rows = shared["order"][start:end].copy()
+        pair_codes = shared["pair_code"][rows]
+        frame = pd.DataFrame(
+            {
+                "instrument_exch": pd.Categorical.from_codes(
+                    shared["instrument_code"][rows], categories=instruments
+                ),
+                "cur_base": pairs[0][pair_codes],
+                "cur_quote": pairs[1][pair_codes],
+                "side": shared["side"][rows],
+                "amount": shared["amount"][rows],
+                "price": shared["price"][rows],
+            }
+        )
+        del shared
+        result = PLCalculator(frame, engine=engine).calculate()
+        derived = _attach(output, blocks)
+        for position, column in enumerate(DERIVED_COLUMNS):
+            derived[rows, position] = result[column].to_numpy()
+        del derived
+        return {column: result[column].dtype.str for column in DERIVED_COLUMNS}
+    finally:
+        for block in blocks:
+            block.close()
+
+
+def calculate_parallel(
+    input: pd.DataFrame, workers: int = None, engine: str = "vectorized"
+) -> pd.DataFrame:
+    """Same as PLCalculator(input, engine).calculate() but on several processes
+
+    Args:
+        input (pd.DataFrame): Fills with at least BASE_COLUMNS
+        workers (int, optional): Number of processes. Defaults to the CPU count.
+        engine (str, optional): Engine used inside every process. Defaults to
+            'vectorized'.
+
+    Raises:
+        ValueError: If neither quote nor base currency is USD for some instrument
+
+    Returns:
+        pd.DataFrame: Input with the derived columns, in the original row order
+    """
+    workers = workers or os.cpu_count()
+    modes = fx.conversion_modes(input)
+    fx.check_conversion_modes(input, modes)
+    codes, instruments = pd.factorize(input["instrument_exch"], sort=True)
+    shards = shard_instruments(np.bincount(codes, minlength=len(instruments)), workers)
+    if len(shards) <= 1:
+        return PLCalculator(input, engine=engine).calculate()
+
+    shard_of_code = np.empty(len(instruments), dtype=np.int64)
+    for shard, members in enumerate(shards):
+        shard_of_code[members] = shard
+    row_shards = shard_of_code[codes]
+    # rows of a shard are contiguous in order and keep their original order
+    order = np.argsort(row_shards, kind="stable")
+    bounds = np.searchsorted(row_shards[order], np.arange(len(shards) + 1))
+    pair_codes, pairs = pd.MultiIndex.from_frame(
+        input[["cur_base", "cur_quote"]]
+    ).factorize()
+    pairs = tuple(
+        np.asarray(pairs.get_level_values(level), dtype=object) for level in range(2)
+    )
+
+    blocks = []
+    try:
+        columns = {
+            "order": _share(order, blocks),
+            "instrument_code": _share(codes, blocks),
+            "pair_code": _share(pair_codes, blocks),
+        }
+        for column in ("side", "amount", "price"):
+            columns[column] = _share(input[column].to_numpy(), blocks)
+        output = _share(np.zeros((len(input), len(DERIVED_COLUMNS))), blocks)
+        output_block = blocks[-1]
+        tasks = [
+            (
+                columns,
+                output,
+                bounds[shard],
+                bounds[shard + 1],
+                np.asarray(instruments),
+                pairs,
+                engine,
+            )
+            for shard in range(len(shards))
+        ]
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            dtypes = list(pool.map(_calculate_shard, tasks))
+        derived = np.ndarray(output[2], dtype=output[1], buffer=output_block.buf)
+        for position, column in enumerate(DERIVED_COLUMNS):
+            dtype = np.result_type(*[shard_dtypes[column] for shard_dtypes in dtypes])
+            input[column] = derived[:, position].astype(dtype)
+        del derived
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+    return input
@@ -7,36 +7,468 @@
 # 6. Calculate inventory metrics. It's basically running inventory, inventory cost, inventory change
 # 7. Calculate pnl. It's basically realized pnl, unrealized pnl for quote currency and USD
 # 8. Calculate totals. It's basically total pnl for each instrument
-# 9. Write to file.
+# 9. Write totals to a sink chosen by the caller, see sinks.py
 
-import json
+import contextlib
 
 import numpy as np
 import pandas as pd
 
+try:
+    from . import fx, kernels, metrics
+    from .constants import (
+        BASE_COLUMNS,
+        COMPACT_DTYPES,
+        DERIVED_COLUMNS,
+        FEE_COLUMNS,
+        FEE_DERIVED_COLUMNS,
+        LOT_COLUMNS,
+    )
+    from .quotes import mark_state
+    from .segments import Segments
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    import fx
+    import kernels
+    import metrics
+    from constants import (
+        BASE_COLUMNS,
+        COMPACT_DTYPES,
+        DERIVED_COLUMNS,
+        FEE_COLUMNS,
+        FEE_DERIVED_COLUMNS,
+        LOT_COLUMNS,
+    )
+    from quotes import mark_state
+    from segments import Segments
+
+# "rowwise" is the reference implementation, "vectorized" computes whole columns
+# with the NumPy kernels and must give identical results.
+ENGINES = ("rowwise", "vectorized")
+
+# Version of the results of calculate(), bumped by every change that alters
+# them so that cached results of other versions are never used, see cache.py
+ENGINE_VERSION = 1
+
+# Methods run by calculate(), in order
+STAGES = (
+    "signed_amount",
+    "running_balance",
+    "lag_running_balance",
+    "amount_liquidated",
+    "flags_calc",
+    "inventory_metrics",
+    "pnl_calc",
+)
+
+# "average" is the weighted average cost of the reference implementation, the
+# others close individual lots, see kernels.lot_metrics
+COST_BASES = ("average", "fifo", "lifo", "specific")
+
+# "realized" books every fee as realized P&L of its fill, "inventory" adds the
+# fee of the part of a fill that opens a position to the inventory, so that it
+# is realized with the cost basis when the position is closed
+FEE_POLICIES = ("realized", "inventory")
+
+# "float" accumulates the inventory and the realized P&L totals in plain
+# float64 like the reference implementation, "compensated" uses Neumaier
+# compensated summation so that long histories don't drift
+ACCUMULATIONS = ("float", "compensated")
+
+# "default" adds every derived column to the input, "compact" works on a copy
+# with COMPACT_DTYPES and keeps intermediates as arrays, see PLCalculator.
+MEMORY_MODES = ("default", "compact")
+
+# Last stage reading each intermediate or sorted base column, after which
+# compact mode frees it, None for columns no later stage reads. Columns of
+# _FINAL_STATE_COLUMNS are kept beyond, unless the result holds them exactly.
+_LAST_READ_BY = {
+    "side": "pnl_calc",
+    "price": "pnl_calc",
+    "amount_signed": "inventory_metrics",
+    "lag_running_balance": "inventory_metrics",
+    "flag_liquidation": "inventory_metrics",
+    "amount_liquidated": "pnl_calc",
+    "inventory_change": None,
+    "realized_pnl_quote_currency": None,
+    "unrealized_pnl_quote_currency": None,
+    "fee_quote_currency": None,
+    "fee_usd": None,
+    "running_balance": "pnl_calc",
+    "running_inventory": "pnl_calc",
+    "inventory_cost": "pnl_calc",
+    "realized_pnl_usd": None,
+    "unrealized_pnl_usd": None,
+}
+
+# Derived columns final_state() reads after the last stage
+_FINAL_STATE_COLUMNS = {
+    "running_balance",
+    "running_inventory",
+    "inventory_cost",
+    "realized_pnl_usd",
+    "unrealized_pnl_usd",
+}
+
+
+def totals_from_state(state: pd.DataFrame, by: list = None) -> pd.DataFrame:
+    """Total P&L of every instrument from its end state
+
+    Args:
+        state (pd.DataFrame): Per-instrument state with at least
+            unrealized_pnl_usd and realized_pnl_usd, see PLCalculator.final_state
+        by (list, optional): Levels of a composite group key to roll the
+            totals up to, e.g. ['account']. Defaults to None, which keeps
+            every group.
+
+    Raises:
+        ValueError: If by names levels the state isn't indexed by
+
+    Returns:
+        pd.DataFrame: unrealized_pnl, realized_pnl and total_pnl indexed by
+            instrument_exch, the group key or the levels of by
+    """
+    totals = pd.DataFrame(
+        {
+            "unrealized_pnl": state["unrealized_pnl_usd"].astype(float),
+            "realized_pnl": state["realized_pnl_usd"].astype(float),
+        },
+        index=state.index,
+    )
+    if totals.index.nlevels == 1:
+        totals.index.name = "instrument_exch"
+    if by is not None:
+        unknown = sorted(set(by) - set(totals.index.names))
+        if unknown:
+            raise ValueError(f"Totals can't be rolled up by {unknown}")
+        totals = totals.groupby(level=list(by)).sum()
+    totals["total_pnl"] = totals["unrealized_pnl"] + totals["realized_pnl"]
+    return totals
+
+
+def state_from_rows(rows: pd.DataFrame, group_by="instrument_exch") -> pd.DataFrame:
+    """Per-instrument state from the rows of a calculation
+
+    Positions are those after the last row of every instrument, realized P&L
+    is summed. Works on the output of any engine, e.g. of
+    parallel.calculate_parallel.
+
+    Args:
+        rows (pd.DataFrame): Output of PLCalculator.calculate, fills of every
+            instrument in calculation order
+        group_by (str or list, optional): Group key of the calculation.
+            Defaults to 'instrument_exch'.
+
+    Returns:
+        pd.DataFrame: STATE_COLUMNS except running_balance_compensation,
+            indexed by the group key
+    """
+    last_fills = rows.drop_duplicates(group_by, keep="last")
+    state = last_fills.set_index(group_by)[
+        [
+            "running_balance",
+            "running_inventory",
+            "inventory_cost",
+            "unrealized_pnl_usd",
+            "price",
+            "ts",
+        ]
+    ].sort_index()
+    state["realized_pnl_usd"] = rows.groupby(group_by)["realized_pnl_usd"].sum()
+    return state
+
 
 class PLCalculator:
     """This class calculates P&L for a given input DataFrame.
+
+    Args:
+        input (pd.DataFrame): Fills with at least BASE_COLUMNS
+        engine (str, optional): One of ENGINES. Defaults to 'rowwise'.
+        initial_state (pd.DataFrame, optional): Per-instrument state with
+            STATE_COLUMNS after earlier fills, as returned by final_state().
+            The input then continues from it. Only supported by the vectorized
+            engine. Defaults to None.
+        observer (callable, optional): Called with a record of wall time, CPU
+            time, rows, memory delta and whether it failed after every stage,
+            e.g. a metrics.StageMetrics. Defaults to None.
+        memory (str, optional): One of MEMORY_MODES. "compact" leaves the
+            caller's frame untouched and calculates on a copy of BASE_COLUMNS
+            with COMPACT_DTYPES. Intermediates left out of the result stay
+            arrays that are freed once no stage needs them, the others are
+            only stored in the result. Memory drops with columns and
+            float_dtype, all columns in float64 peak a little lower than the
+            default mode. Only supported by the vectorized engine. Defaults
+            to 'default'.
+        columns (list, optional): Derived columns added to the result in
+            compact mode. Defaults to all DERIVED_COLUMNS.
+        float_dtype (str, optional): Dtype of the derived float columns in
+            compact mode. 'float32' halves them at about 7 significant digits,
+            calculations and final_state() stay float64. Defaults to 'float64'.
+        fx_rates (fx.FXRates, optional): Rate table converting pairs without
+            USD, e.g. EUR/KZT, through the USD rate of their quote currency at
+            the fill time. Only supported by the vectorized engine. Defaults
+            to None, which rejects such pairs.
+        cost_basis (str, optional): One of COST_BASES. "fifo" and "lifo" close
+            the oldest or newest open lots, "specific" first closes the lot
+            whose lot_id equals the close_lot_id of the fill and then falls
+            back to FIFO. Lot methods are only supported by the vectorized
+            engine without initial_state. Defaults to 'average'.
+        sort_by_ts (bool, optional): Calculates the fills of every instrument
+            in ts order instead of row order, fills with equal ts keep their
+            row order. The result stays in row order. Only supported by the
+            vectorized engine. Defaults to False.
+        group_by (list, optional): Columns of a composite group key, e.g.
+            ['account', 'strategy', 'instrument_exch']. Every group keeps its
+            own position, totals and final_state() are indexed by the key.
+            Must contain instrument_exch. Defaults to ['instrument_exch'].
+        fee_policy (str, optional): One of FEE_POLICIES. Fees of the
+            FEE_COLUMNS are converted to the quote currency and to USD, added
+            as FEE_DERIVED_COLUMNS and taken off the P&L. "inventory" needs
+            the average cost basis. Only supported by the vectorized engine.
+            Defaults to None, which ignores fees.
+        accumulation (str, optional): One of ACCUMULATIONS. "compensated"
+            keeps running_inventory and the realized P&L of final_state()
+            accurate to about one rounding over any number of fills, at the
+            price of differing from the reference in the last bits. Only
+            supported by the vectorized engine with the average cost basis.
+            Defaults to 'float'.
     """
-    def __init__(self, input: pd.DataFrame):
+    def __init__(
+        self,
+        input: pd.DataFrame,
+        engine: str = "rowwise",
+        initial_state: pd.DataFrame = None,
+        observer=None,
+        memory: str = "default",
+        columns: list = None,
+        float_dtype: str = "float64",
+        fx_rates: fx.FXRates = None,
+        cost_basis: str = "average",
+        sort_by_ts: bool = False,
+        group_by: list = None,
+        fee_policy: str = None,
+        accumulation: str = "float",
+    ):
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine!r}, expected one of {ENGINES}")
+        if initial_state is not None and engine != "vectorized":
+            raise ValueError("initial_state is only supported by the vectorized engine")
+        if fx_rates is not None and engine != "vectorized":
+            raise ValueError("fx_rates is only supported by the vectorized engine")
+        if sort_by_ts and engine != "vectorized":
+            raise ValueError("sort_by_ts is only supported by the vectorized engine")
+        if cost_basis not in COST_BASES:
+            raise ValueError(
+                f"Unknown cost basis {cost_basis!r}, expected one of {COST_BASES}"
+            )
+        if cost_basis != "average" and (
+            engine != "vectorized" or initial_state is not None
+        ):
+            raise ValueError(
+                f"{cost_basis} cost basis is only supported by the vectorized "
+                "engine without initial_state"
+            )
+        if cost_basis == "specific" and not set(LOT_COLUMNS) <= set(input.columns):
+            raise ValueError(f"specific cost basis needs the columns {LOT_COLUMNS}")
+        group_by = ["instrument_exch"] if group_by is None else list(group_by)
+        if "instrument_exch" not in group_by:
+            raise ValueError("group_by must contain instrument_exch")
+        if fee_policy is not None:
+            if fee_policy not in FEE_POLICIES:
+                raise ValueError(
+                    f"Unknown fee policy {fee_policy!r}, expected one of "
+                    f"{FEE_POLICIES}"
+                )
+            if engine != "vectorized":
+                raise ValueError("fees are only supported by the vectorized engine")
+            if not set(FEE_COLUMNS) <= set(input.columns):
+                raise ValueError(f"fee_policy needs the columns {FEE_COLUMNS}")
+            if fee_policy == "inventory" and cost_basis != "average":
+                raise ValueError("inventory fee policy needs the average cost basis")
+        if accumulation not in ACCUMULATIONS:
+            raise ValueError(
+                f"Unknown accumulation {accumulation!r}, expected one of "
+                f"{ACCUMULATIONS}"
+            )
+        if accumulation != "float" and (
+            engine != "vectorized" or cost_basis != "average"
+        ):
+            raise ValueError(
+                f"{accumulation} accumulation is only supported by the vectorized "
+                "engine with the average cost basis"
+            )
+        if memory not in MEMORY_MODES:
+            raise ValueError(
+                f"Unknown memory mode {memory!r}, expected one of {MEMORY_MODES}"
+            )
+        if memory == "compact" and engine != "vectorized":
+            raise ValueError(
+                "compact memory is only supported by the vectorized engine"
+            )
+        derived = DERIVED_COLUMNS + (FEE_DERIVED_COLUMNS if fee_policy else [])
+        columns = list(derived if columns is None else columns)
+        unknown = sorted(set(columns) - set(derived))
+        if unknown:
+            raise ValueError(f"Unknown derived columns {unknown}")
+        if np.dtype(float_dtype) not in (np.float32, np.float64):
+            raise ValueError(
+                f"float_dtype must be float32 or float64, not {float_dtype}"
+            )
+        if memory == "compact":
+            extra = [column for column in LOT_COLUMNS if column in input] + [
+                column for column in group_by if column not in BASE_COLUMNS
+            ]
+            if fee_policy is not None:
+                extra += FEE_COLUMNS
+            input = input[BASE_COLUMNS + extra].astype(COMPACT_DTYPES)
         self.input = input
+        self.memory = memory
+        self.columns = columns
+        self.float_dtype = np.dtype(float_dtype)
+        self._arrays = {}
+        self._final_state = None
+        self.engine = engine
+        self.initial_state = initial_state
+        self.observer = observer
+        self.fx_rates = fx_rates
+        self.cost_basis = cost_basis
+        self.sort_by_ts = sort_by_ts
+        # a single key column groups like before, several need a list
+        self.group_by = group_by[0] if len(group_by) == 1 else group_by
+        self.fee_policy = fee_policy
+        self.accumulation = accumulation
+        self._lot_outputs = None
+        self._fee_outputs = None
+        self._conversion_modes = None
+        self._cross_rates = None
+        self._segments = None
+        self._running_balance_compensation = None
+
+    @property
+    def vectorized(self) -> bool:
+        return self.engine == "vectorized"
+
+    @property
+    def compact(self) -> bool:
+        return self.memory == "compact"
+
+    @property
+    def segments(self) -> Segments:
+        """Segments of the group key of the input, built once on first use"""
+        if self._segments is None:
+            self._segments = Segments.from_frame(
+                self.input,
+                by=self.group_by,
+                sort_by="ts" if self.sort_by_ts else None,
+            )
+        return self._segments
+
+    def _sorted(self, column: str) -> np.ndarray:
+        if column in self._arrays:
+            return self._arrays[column]
+        values = self.segments.sort(self.input[column].to_numpy())
+        if self.compact and column in BASE_COLUMNS and column in _LAST_READ_BY:
+            # base columns read by several stages are sorted once
+            self._arrays[column] = values
+        return values
+
+    def _in_result(self, column: str) -> bool:
+        # the result frame holds the exact float64 values of the column
+        return column in self.columns and self.float_dtype == np.float64
+
+    def _assign_sorted(self, column: str, values: np.ndarray):
+        if not self.compact:
+            self.input[column] = self.segments.unsort(values)
+            return
+        if column == "flag_liquidation":
+            values = values.astype(np.int8)
+        # later reads sort the result column again instead of keeping a copy
+        needed = _LAST_READ_BY.get(column, "") is not None or (
+            column in _FINAL_STATE_COLUMNS
+        )
+        if needed and not self._in_result(column):
+            self._arrays[column] = values
+        if column in self.columns:
+            if values.dtype.kind == "f":
+                values = values.astype(self.float_dtype, copy=False)
+            self.input[column] = self.segments.unsort(values)
+
+    # Element-wise kernels work in row order in default mode and in segment
+    # order in compact mode, where the intermediates are kept sorted.
+    def _elementwise(self, column: str) -> np.ndarray:
+        if self.compact:
+            return self._sorted(column)
+        return self.input[column].to_numpy()
+
+    def _assign_elementwise(self, column: str, values: np.ndarray):
+        if self.compact:
+            self._assign_sorted(column, values)
+        else:
+            self.input[column] = values
+
+    def _release(self, stage: str):
+        for column, last_stage in _LAST_READ_BY.items():
+            if last_stage != stage:
+                continue
+            if column not in _FINAL_STATE_COLUMNS:
+                self._arrays.pop(column, None)
+        if stage == "pnl_calc":
+            self._lot_outputs = None
+            self._fee_outputs = None
+
+    def _observe(self, stage: str):
+        if self.observer is None:
+            return contextlib.nullcontext()
+        return metrics.measure(stage, len(self.input), self.observer)
+
+    def _initial(self, column: str, fill_value=np.nan):
+        # value of a state column carried into every segment, None without state
+        if self.initial_state is None:
+            return None
+        return (
+            self.initial_state[column]
+            .reindex(self.segments.keys, fill_value=fill_value)
+            .to_numpy()
+        )
 
     def signed_amount(self):
+        if self.vectorized:
+            self._assign_elementwise(
+                "amount_signed",
+                kernels.signed_amount(
+                    self._elementwise("side"), self._elementwise("amount")
+                ),
+            )
+            return self.input
         self.input["amount_signed"] = self.input.apply(
             lambda row: row["amount"] if row["side"] == 1 else -row["amount"], axis=1
         )
         return self.input
 
     def running_balance(self):
-        self.input["running_balance"] = (
-            self.input[["instrument_exch", "amount_signed"]]
-            .groupby("instrument_exch")
-            .cumsum()
-        )
+        if self.vectorized:
+            running_balance, compensation = self.segments.running_sum(
+                self._sorted("amount_signed"),
+                self._initial("running_balance", 0),
+                self._initial("running_balance_compensation", 0.0),
+            )
+            self._assign_sorted("running_balance", running_balance)
+            self._running_balance_compensation = compensation
+            return self.input
+        self.input["running_balance"] = self.input.groupby(self.group_by)[
+            "amount_signed"
+        ].cumsum()
         return self.input
 
     def lag_running_balance(self):
-        self.input["lag_running_balance"] = self.input.groupby("instrument_exch")[
+        if self.vectorized:
+            self._assign_sorted(
+                "lag_running_balance",
+                self.segments.shift(
+                    self._sorted("running_balance"), self._initial("running_balance")
+                ),
+            )
+            return self.input
+        self.input["lag_running_balance"] = self.input.groupby(self.group_by)[
             "running_balance"
         ].shift(1)
         return self.input
@@ -61,21 +493,162 @@ class PLCalculator:
         return df
 
     def amount_liquidated(self):
+        if self.vectorized:
+            self._assign_elementwise(
+                "amount_liquidated",
+                kernels.amount_liquidated(
+                    self._elementwise("amount_signed"),
+                    self._elementwise("lag_running_balance"),
+                ),
+            )
+            return self.input
         self.input["amount_liquidated"] = self.input.apply(
             lambda row: self._amount_liquidated(row), axis=1
         )
         return self.input
 
     def flags_calc(self):
-        for name, group in self.input.groupby("instrument_exch"):
+        if self.vectorized:
+            self._assign_elementwise(
+                "flag_liquidation",
+                kernels.liquidation_flags(
+                    self._elementwise("amount_signed"),
+                    self._elementwise("running_balance"),
+                ),
+            )
+            return self.input
+        for name, group in self.input.groupby(self.group_by):
             self.input.loc[
                 group.index, "flag_liquidation"
             ] = self._liquidation_check_group(group)
         self.input["flag_liquidation"] = self.input["flag_liquidation"].astype(int)
         return self.input
 
+    def _lot_targets(self) -> np.ndarray:
+        # sorted position of the lot every row closes first, -1 for none,
+        # lot ids are unique per group
+        groups = self.segments.sort(self.segments.codes)
+        lot_ids = pd.Series(self._sorted("lot_id"))
+        close_lot_ids = pd.Series(self._sorted("close_lot_id"))
+        opening = lot_ids.notna().to_numpy()
+        lots = pd.MultiIndex.from_arrays([groups[opening], lot_ids[opening]])
+        first = ~lots.duplicated()
+        positions = np.flatnonzero(opening)[first]
+        matches = lots[first].get_indexer(
+            pd.MultiIndex.from_arrays([groups, close_lot_ids])
+        )
+        return np.where(
+            (matches >= 0) & close_lot_ids.notna().to_numpy(), positions[matches], -1
+        )
+
+    def _lot_metrics(self) -> tuple:
+        # inventory columns and realized P&L of a lot cost basis, sorted
+        if self._lot_outputs is None:
+            self._lot_outputs = kernels.lot_metrics(
+                self.segments.starts,
+                kernels.LIFO if self.cost_basis == "lifo" else kernels.FIFO,
+                *(
+                    self._sorted(column)
+                    for column in (
+                        "side",
+                        "price",
+                        "amount_signed",
+                        "running_balance",
+                        "amount_liquidated",
+                    )
+                ),
+                targets=self._lot_targets() if self.cost_basis == "specific" else None,
+            )
+        return self._lot_outputs
+
+    def _fees(self) -> tuple:
+        # fee in quote currency and its part added to the inventory, sorted
+        if self._fee_outputs is None:
+            modes = self.conversion_modes()
+            fee = self.input["fee"].to_numpy(dtype=np.float64, na_value=0.0)
+            currency = self.input["fee_currency"].to_numpy(dtype=object)
+            cur_base = self.input["cur_base"].to_numpy(dtype=object)
+            cur_quote = self.input["cur_quote"].to_numpy(dtype=object)
+            charged = fee != 0
+            if pd.isna(currency[charged]).any():
+                raise ValueError("Some fees have no fee_currency")
+            other = charged & (currency != cur_base) & (currency != cur_quote)
+            fee_usd_rates = None
+            if other.any():
+                fee_usd_rates = np.where(currency == fx.USD, 1.0, np.nan)
+                foreign = other & (currency != fx.USD)
+                if foreign.any():
+                    if self.fx_rates is None:
+                        names = ", ".join(sorted(set(currency[foreign])))
+                        raise ValueError(f"Fees in {names} need fx_rates")
+                    self.fx_rates.check(currency[foreign])
+                    fee_usd_rates[foreign] = self.fx_rates.usd_rates(
+                        currency[foreign], self.input["ts"].to_numpy()[foreign]
+                    )
+            fee_quote = fx.fees_to_quote(
+                fee,
+                currency,
+                cur_base,
+                cur_quote,
+                self.input["price"].to_numpy(),
+                modes,
+                self._cross_rates,
+                fee_usd_rates,
+            )
+            missing = np.isnan(fee_quote) & charged
+            if missing.any():
+                instruments = ", ".join(
+                    sorted(self.input.loc[missing, "instrument_exch"].unique())
+                )
+                raise ValueError(
+                    f"No FX rate at the time of some fees of {instruments}"
+                )
+            fee_quote = self.segments.sort(np.where(charged, fee_quote, 0.0))
+            capitalized = np.zeros(len(fee_quote))
+            if self.fee_policy == "inventory":
+                # share of the fill that opens or extends a position
+                amount = np.abs(self._sorted("amount_signed"))
+                opened = amount - self._sorted("amount_liquidated")
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    capitalized = np.where(amount > 0, fee_quote * opened / amount, 0.0)
+            self._fee_outputs = fee_quote, capitalized
+        return self._fee_outputs
+
     def inventory_metrics(self):
-        input_data = self.input.groupby("instrument_exch")
+        if self.vectorized:
+            if self.cost_basis == "average":
+                outputs = kernels.inventory_metrics(
+                    self.segments.starts,
+                    *(
+                        self._sorted(column)
+                        for column in (
+                            "side",
+                            "price",
+                            "amount_signed",
+                            "running_balance",
+                            "lag_running_balance",
+                            "amount_liquidated",
+                            "flag_liquidation",
+                        )
+                    ),
+                    initial_inventory=self._initial("running_inventory", 0.0),
+                    initial_cost=self._initial("inventory_cost", 0.0),
+                    capitalized_fee=self._fees()[1] if self.fee_policy else None,
+                    compensated=self.accumulation == "compensated",
+                )
+            else:
+                outputs = self._lot_metrics()[:3]
+            if self.compact:
+                for column, values in zip(
+                    ["inventory_change", "running_inventory", "inventory_cost"], outputs
+                ):
+                    self._assign_sorted(column, values)
+                return self.input
+            self.input[
+                ["inventory_change", "running_inventory", "inventory_cost"]
+            ] = self.segments.unsort(np.column_stack(outputs))
+            return self.input
+        input_data = self.input.groupby(self.group_by)
         for name, group in input_data:
             running_inventory = 0
             inventory_cost = 0
@@ -125,11 +698,99 @@ class PLCalculator:
         else:
             raise ValueError("Neither quote nor base currency is USD")
 
+    def conversion_modes(self) -> np.ndarray:
+        """Resolves and validates the USD conversion mode of every row once
+
+        With fx_rates the USD rates of pairs without USD are looked up as well.
+
+        Raises:
+            ValueError: If neither quote nor base currency is USD for some
+                instrument and fx_rates can't convert its quote currency
+        """
+        if self._conversion_modes is None:
+            modes = fx.conversion_modes(self.input)
+            if self.fx_rates is None:
+                fx.check_conversion_modes(self.input, modes)
+            else:
+                self._cross_rates = self._lookup_cross_rates(modes)
+            self._conversion_modes = modes
+        return self._conversion_modes
+
+    def _lookup_cross_rates(self, modes: np.ndarray):
+        cross = modes == fx.UNSUPPORTED
+        if not cross.any():
+            return None
+        currencies = self.input["cur_quote"].to_numpy()[cross]
+        self.fx_rates.check(currencies)
+        rates = np.full(len(modes), np.nan)
+        rates[cross] = self.fx_rates.usd_rates(
+            currencies, self.input["ts"].to_numpy()[cross]
+        )
+        missing = cross & np.isnan(rates)
+        if missing.any():
+            instruments = sorted(self.input.loc[missing, "instrument_exch"].unique())
+            raise ValueError(
+                f"No FX rate at the time of some fills of {', '.join(instruments)}"
+            )
+        return rates
+
     def pnl_calc(self):
-        self.input["lag_running_inventory"] = self.input.groupby("instrument_exch")[
+        if self.vectorized:
+            modes = self.segments.sort(self.conversion_modes())
+            cross_rates = self._cross_rates
+            if cross_rates is not None:
+                cross_rates = self.segments.sort(cross_rates)
+            lag_running_inventory = self.segments.shift(
+                self._sorted("running_inventory"), self._initial("running_inventory")
+            )
+            lag_inventory_cost = self.segments.shift(
+                self._sorted("inventory_cost"), self._initial("inventory_cost")
+            )
+            price = self._sorted("price")
+            if self.cost_basis != "average":
+                realized = self._lot_metrics()[3]
+            else:
+                realized = kernels.realized_pnl(
+                    self._sorted("side"),
+                    price,
+                    self._sorted("amount_liquidated"),
+                    lag_running_inventory,
+                    lag_inventory_cost,
+                )
+            unrealized = kernels.unrealized_pnl(
+                price,
+                self._sorted("running_balance"),
+                lag_running_inventory,
+                lag_inventory_cost,
+            )
+            del lag_running_inventory, lag_inventory_cost
+            if self.fee_policy is not None:
+                fee_quote, capitalized = self._fees()
+                # capitalized fees are realized later through the cost basis,
+                # first fills without realized P&L still book their fee
+                booked = fee_quote - capitalized
+                realized = np.where(
+                    booked != 0, np.nan_to_num(realized) - booked, realized
+                )
+                self._assign_sorted("fee_quote_currency", fee_quote)
+                self._assign_sorted(
+                    "fee_usd", fx.convert_to_usd(fee_quote, price, modes, cross_rates)
+                )
+            self._assign_sorted("realized_pnl_quote_currency", realized)
+            self._assign_sorted("unrealized_pnl_quote_currency", unrealized)
+            self._assign_sorted(
+                "realized_pnl_usd",
+                fx.convert_to_usd(realized, price, modes, cross_rates),
+            )
+            self._assign_sorted(
+                "unrealized_pnl_usd",
+                fx.convert_to_usd(unrealized, price, modes, cross_rates),
+            )
+            return self.input
+        self.input["lag_running_inventory"] = self.input.groupby(self.group_by)[
             "running_inventory"
         ].shift(1)
-        self.input["lag_inventory_cost"] = self.input.groupby("instrument_exch")[
+        self.input["lag_inventory_cost"] = self.input.groupby(self.group_by)[
             "inventory_cost"
         ].shift(1)
         self.input["realized_pnl_quote_currency"] = self.input.apply(
@@ -153,28 +814,131 @@ class PLCalculator:
 
         return self.input
 
-    def calculate_totals(self):
-        groups = self.input.groupby("instrument_exch")
-        total_metrics = {}
-        for name, group in groups:
-            unrealized_pnl = group["unrealized_pnl_usd"].iloc[-1]
-            realized_pnl = group["realized_pnl_usd"].sum()
-            total_pnl = unrealized_pnl + realized_pnl
-            total_metrics[name] = {
-                "unrealized_pnl": unrealized_pnl,
-                "realized_pnl": realized_pnl,
-                "total_pnl": total_pnl,
-            }
-        print(total_metrics)
-        with open("total_metrics.json", "w") as f:
-            json.dump(total_metrics, f)
+    def calculate_totals(
+        self, sink=None, quotes=None, ts=None, by: list = None
+    ) -> pd.DataFrame:
+        """Total P&L of every instrument in USD
+
+        Unrealized P&L is the one of the last fill, realized P&L is summed.
+
+        Args:
+            sink (optional): Sink from sinks the totals are written to, e.g.
+                sinks.JsonSink('total_metrics.json'). Defaults to None, which
+                writes nothing.
+            quotes (pd.DataFrame, optional): Quotes with quotes.QUOTE_COLUMNS.
+                Positions are then marked at the last quote up to ts unless
+                their last fill is more recent. Instruments carried over from
+                initial_state without fills keep their unrealized P&L.
+                Defaults to None.
+            ts (optional): Point in time to mark the quotes at. Defaults to
+                the last quote.
+            by (list, optional): Columns of group_by to roll the totals up
+                to, e.g. ['account'] for the totals of every account. Defaults
+                to None, which gives the totals of every group.
+
+        Raises:
+            ValueError: If by has columns that aren't in group_by
+
+        Returns:
+            pd.DataFrame: unrealized_pnl, realized_pnl and total_pnl indexed by
+                instrument_exch, the group key or the columns of by
+        """
+        with self._observe("calculate_totals"):
+            if self.vectorized:
+                state = self.final_state()
+            else:
+                state = state_from_rows(self.input, self.group_by)
+            if quotes is not None:
+                state["unrealized_pnl_usd"] = self._mark_to_market(state, quotes, ts)
+            totals = totals_from_state(state, by)
+            if sink is not None:
+                sink.write(totals)
+        return totals
+
+    def _mark_to_market(self, state: pd.DataFrame, quotes: pd.DataFrame, ts):
+        if ts is None:
+            ts = quotes["ts"].max()
+        pairs = (
+            self.input[["instrument_exch", "cur_base", "cur_quote"]]
+            .drop_duplicates("instrument_exch")
+            .set_index("instrument_exch")
+            .reindex(state.index.get_level_values("instrument_exch"))
+        )
+        # instruments carried over without fills have no known pair
+        unknown = pairs["cur_quote"].isna().to_numpy()
+        modes = fx.conversion_modes(pairs)
+        cross = (modes == fx.UNSUPPORTED) & ~unknown
+        cross_rates = None
+        if cross.any():
+            cross_rates = np.full(len(modes), np.nan)
+            cross_rates[cross] = self.fx_rates.usd_rates(
+                pairs["cur_quote"].to_numpy()[cross],
+                np.full(cross.sum(), pd.Timestamp(ts)),
+            )
+        marked = mark_state(state, modes, quotes, ts, cross_rates)
+        return np.where(unknown, state["unrealized_pnl_usd"].to_numpy(), marked)
+
+    def _last(self, column: str) -> np.ndarray:
+        # last value of every segment without sorting the whole column
+        if column in self._arrays:
+            return self.segments.last(self._arrays[column])
+        rows = self.segments.offsets[1:] - 1
+        if self.segments.order is not None:
+            rows = self.segments.order[rows]
+        return self.input[column].to_numpy()[rows]
+
+    def final_state(self) -> pd.DataFrame:
+        """Per-instrument state after the calculated fills
+
+        Instruments of initial_state without new fills are carried over as is.
+
+        Returns:
+            pd.DataFrame: STATE_COLUMNS indexed by instrument_exch, or by the
+                group key with several group_by columns
+        """
+        if not self.vectorized:
+            raise ValueError("final_state is only supported by the vectorized engine")
+        if self._final_state is not None:
+            return self._final_state.copy()
+        realized = self.segments.sum(
+            self._sorted("realized_pnl_usd"),
+            compensated=self.accumulation == "compensated",
+        )
+        if self.initial_state is not None:
+            realized = realized + self._initial("realized_pnl_usd", 0.0)
+        compensation = self._running_balance_compensation
+        if compensation is None:
+            compensation = np.zeros(len(self.segments), dtype=np.float64)
+        state = pd.DataFrame(
+            {
+                "running_balance": self._last("running_balance"),
+                "running_balance_compensation": compensation,
+                "running_inventory": self._last("running_inventory"),
+                "inventory_cost": self._last("inventory_cost"),
+                "realized_pnl_usd": realized,
+                "unrealized_pnl_usd": self._last("unrealized_pnl_usd"),
+                "price": self._last("price"),
+                "ts": self._last("ts"),
+            },
+            index=self.segments.keys,
+        )
+        if self.initial_state is not None:
+            carried = self.initial_state.drop(state.index, errors="ignore")
+            state = pd.concat([carried, state]).sort_index()
+        return state
 
     def calculate(self):
-        self.signed_amount()
-        self.running_balance()
-        self.lag_running_balance()
-        self.amount_liquidated()
-        self.flags_calc()
-        self.inventory_metrics()
-        self.pnl_calc()
+        if self.vectorized:
+            # fail on unsupported currency pairs before any other work
+            self.conversion_modes()
+        self._final_state = None
+        for stage in STAGES:
+            with self._observe(stage):
+                getattr(self, stage)()
+            if self.compact:
+                self._release(stage)
+        if self.compact:
+            # the state is all that is left to read from the remaining arrays
+            self._final_state = self.final_state()
+            self._arrays.clear()
         return self.input
\ No newline at end of file
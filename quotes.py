@@ -0,0 +1,147 @@
+# Mark-to-market against an external price feed.
+# Quotes are matched to positions with an as-of merge on ts per instrument,
+# so millions of quotes are joined in one sorted pass without row lookups.
+# A quote only replaces the fill price when it is at least as recent.
+
+import numpy as np
+import pandas as pd
+
+try:
+    from . import fx, kernels
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    import fx
+    import kernels
+
+QUOTE_COLUMNS = ["instrument_exch", "ts", "price"]
+
+
+def mark_position(
+    fills: pd.DataFrame,
+    price: np.ndarray,
+    modes: np.ndarray = None,
+    cross_rates: np.ndarray = None,
+) -> np.ndarray:
+    """Unrealized P&L in USD of the position after each fill, marked at price
+
+    Same as a fill of zero amount at price, i.e. kernels.unrealized_pnl with
+    the inventory after the fill instead of before it.
+
+    Args:
+        fills (pd.DataFrame): Rows of PLCalculator.calculate output
+        price (np.ndarray): Mark price of every row
+        modes (np.ndarray, optional): fx conversion mode of every row.
+            Defaults to the modes of the cur_base and cur_quote columns.
+        cross_rates (np.ndarray, optional): USD rates of the quote currency of
+            pairs without USD, see fx.convert_to_usd. Defaults to None.
+
+    Returns:
+        np.ndarray: Unrealized P&L in USD
+    """
+    unrealized = kernels.unrealized_pnl(
+        price,
+        fills["running_balance"].to_numpy(),
+        fills["running_inventory"].to_numpy(),
+        fills["inventory_cost"].to_numpy(),
+    )
+    if modes is None:
+        modes = fx.conversion_modes(fills)
+    return fx.convert_to_usd(unrealized, price, modes, cross_rates)
+
+
+def asof_quotes(
+    instruments, ts, quotes: pd.DataFrame, allow_exact_matches: bool = True
+) -> tuple:
+    """Latest quote of every instrument at or before the given times
+
+    Args:
+        instruments (array-like): Instrument of every row
+        ts (array-like): Point in time of every row
+        quotes (pd.DataFrame): Quotes with QUOTE_COLUMNS in any order
+        allow_exact_matches (bool, optional): Whether a quote at exactly ts
+            counts, False takes only quotes strictly before ts. Defaults to True.
+
+    Returns:
+        tuple: Quote price and quote ts of every row, NaN and NaT without quote
+    """
+    codes, names = pd.factorize(np.asarray(instruments))
+    names = pd.Index(names)
+    left = pd.DataFrame(
+        {
+            "code": codes,
+            "ts": pd.to_datetime(np.asarray(ts)).astype("datetime64[ns]"),
+            "row": np.arange(len(codes)),
+        }
+    ).sort_values("ts", kind="stable")
+    right = pd.DataFrame(
+        {
+            "code": names.get_indexer(np.asarray(quotes["instrument_exch"])),
+            "ts": pd.to_datetime(quotes["ts"]).astype("datetime64[ns]").to_numpy(),
+            "quote_price": quotes["price"].to_numpy(dtype=np.float64),
+        }
+    )
+    right = right[right["code"] >= 0].sort_values("ts", kind="stable")
+    right["quote_ts"] = right["ts"]
+    merged = pd.merge_asof(
+        left, right, on="ts", by="code", allow_exact_matches=allow_exact_matches
+    )
+    rows = merged["row"].to_numpy()
+    price = np.empty(len(codes), dtype=np.float64)
+    price[rows] = merged["quote_price"].to_numpy()
+    quote_ts = np.empty(len(codes), dtype="datetime64[ns]")
+    quote_ts[rows] = merged["quote_ts"].to_numpy()
+    return price, quote_ts
+
+
+def mark_prices(price, ts, quote_price, quote_ts) -> np.ndarray:
+    """Quote price where the quote is at least as recent as the fill
+
+    Args:
+        price (array-like): Price of the last fill
+        ts (array-like): Time of the last fill
+        quote_price (np.ndarray): Quote price, NaN without quote
+        quote_ts (np.ndarray): Quote time, NaT without quote
+
+    Returns:
+        np.ndarray: Price to mark every position at
+    """
+    ts = pd.to_datetime(np.asarray(ts)).astype("datetime64[ns]").to_numpy()
+    fresh = ~np.isnan(quote_price) & (quote_ts >= ts)
+    return np.where(fresh, quote_price, np.asarray(price, dtype=np.float64))
+
+
+def mark_state(
+    state: pd.DataFrame,
+    modes: np.ndarray,
+    quotes: pd.DataFrame,
+    ts=None,
+    cross_rates: np.ndarray = None,
+) -> np.ndarray:
+    """Unrealized P&L in USD of per-instrument positions marked at quotes
+
+    Every position is marked at the latest quote up to ts unless its last fill
+    is more recent, like a fill of zero amount at the quote price.
+
+    Args:
+        state (pd.DataFrame): Positions indexed by instrument_exch, or by a
+            group key with an instrument_exch level, with running_balance,
+            running_inventory, inventory_cost and the price and ts of the
+            last fill, see PLCalculator.final_state
+        modes (np.ndarray): fx conversion mode of every position
+        quotes (pd.DataFrame): Quotes with QUOTE_COLUMNS
+        ts (optional): Point in time to mark at. Defaults to the last quote.
+        cross_rates (np.ndarray, optional): USD rates at ts of the quote
+            currency of pairs without USD. Defaults to None.
+
+    Returns:
+        np.ndarray: Unrealized P&L in USD of every position
+    """
+    if ts is None:
+        ts = quotes["ts"].max()
+    instruments = state.index
+    if instruments.nlevels > 1:
+        instruments = instruments.get_level_values("instrument_exch")
+    quote_price, quote_ts = asof_quotes(
+        instruments, np.full(len(state), pd.Timestamp(ts)), quotes
+    )
+    price = mark_prices(state["price"], state["ts"], quote_price, quote_ts)
+    return mark_position(state, price, modes, cross_rates)
@@ -1,5 +1,25 @@
+import os
+from typing import Iterator
+
 import pandas as pd
 
+try:
+    from .constants import COMPACT_DTYPES
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    from constants import COMPACT_DTYPES
+
+# File formats by extension, anything else is read as the semicolon CSV
+FORMATS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+
+# Explicit dtypes for chunked reading
+CHUNK_DTYPES = COMPACT_DTYPES
+
 
 def read_data(filename: str, delimiter=";", thousands=" ", decimal=",") -> pd.DataFrame:
     """This function reads data from a csv file and returns a pandas DataFrame
@@ -16,3 +36,105 @@ def read_data(filename: str, delimiter=";", thousands=" ", decimal=",") -> pd.Da
     return pd.read_csv(
         filename, delimiter=delimiter, thousands=thousands, decimal=decimal
     )
+
+
+def read_data_chunks(
+    filename: str, chunksize=100_000, delimiter=";", thousands=" ", decimal=","
+) -> Iterator[pd.DataFrame]:
+    """This function reads data from a csv file in chunks of bounded size
+
+    Columns get CHUNK_DTYPES and ts is parsed to datetimes, so that only one
+    chunk has to fit in memory at a time.
+
+    Args:
+        filename (str): Path to the csv file
+        chunksize (int, optional): Rows per chunk. Defaults to 100 000.
+        delimiter (str, optional): Delimiter of CSV. Defaults to ';'.
+        thousands (str, optional): Delimiter of thousands for numbers. Defaults to ' '.
+        decimal (str, optional): Delimiter of decimal places. Defaults to ','.
+
+    Yields:
+        pd.DataFrame: Consecutive chunks of the file
+    """
+    with pd.read_csv(
+        filename,
+        delimiter=delimiter,
+        thousands=thousands,
+        decimal=decimal,
+        dtype=CHUNK_DTYPES,
+        parse_dates=["ts"],
+        chunksize=chunksize,
+    ) as chunks:
+        yield from chunks
+
+
+def file_format(filename: str) -> str:
+    """Format of a file from its extension, one of the values of FORMATS"""
+    return FORMATS.get(os.path.splitext(str(filename))[1].lower(), "csv")
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+    except ImportError as e:
+        raise ImportError(
+            "Arrow and Parquet files require pyarrow, install it with "
+            "pip install pyarrow"
+        ) from e
+    return pyarrow
+
+
+def read_parquet(filename: str, columns=None) -> pd.DataFrame:
+    """This function reads data from a Parquet file, memory-mapping it
+
+    Args:
+        filename (str): Path to the Parquet file
+        columns (list, optional): Columns to read. Defaults to all columns.
+
+    Returns:
+        pd.DataFrame: Pandas DataFrame
+    """
+    _import_pyarrow()
+    return pd.read_parquet(filename, columns=columns, memory_map=True)
+
+
+def read_arrow(filename: str, columns=None) -> pd.DataFrame:
+    """This function reads data from an Arrow IPC (Feather v2) file
+
+    The file is memory-mapped, so no text is parsed and the columns are read
+    straight from the mapped buffers.
+
+    Args:
+        filename (str): Path to the Arrow file
+        columns (list, optional): Columns to read. Defaults to all columns.
+
+    Returns:
+        pd.DataFrame: Pandas DataFrame
+    """
+    pyarrow = _import_pyarrow()
+    with pyarrow.memory_map(str(filename), "r") as source:
+        table = pyarrow.ipc.open_file(source).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas(split_blocks=True)
+
+
+def read_any(filename: str, format: str = None, **csv_options) -> pd.DataFrame:
+    """This function reads data in the format given by the file extension
+
+    Args:
+        filename (str): Path to a csv, Parquet or Arrow file
+        format (str, optional): One of the values of FORMATS. Defaults to
+            the format of the file extension.
+        **csv_options: Passed to read_data for csv files
+
+    Returns:
+        pd.DataFrame: Pandas DataFrame
+    """
+    file_type = format or file_format(filename)
+    if file_type == "parquet":
+        return read_parquet(filename)
+    if file_type == "arrow":
+        return read_arrow(filename)
+    return read_data(filename, **csv_options)
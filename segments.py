@@ -0,0 +1,193 @@
+# Grouping of fills into contiguous per-instrument segments.
+# The key is factorized and the rows are stably sorted once, every vectorized
+# stage then works on segment offsets instead of regrouping by the string key.
+
+import numpy as np
+import pandas as pd
+
+try:
+    from . import kernels
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    import kernels
+
+
+class Segments:
+    """Stable sort of rows by group plus the boundaries of every group
+
+    Rows keep their original relative order inside a group, the same order
+    DataFrame.groupby iterates them in.
+
+    Args:
+        codes (np.ndarray): Group code of every row in original order
+        keys (pd.Index): Group key of every code, sorted
+        sort_by (np.ndarray, optional): Secondary sort key inside a group.
+            Defaults to None.
+    """
+
+    def __init__(self, codes: np.ndarray, keys: pd.Index, sort_by=None):
+        self.codes = codes
+        self.keys = keys
+        if sort_by is None:
+            order = np.argsort(codes, kind="stable")
+        else:
+            order = np.lexsort((sort_by, codes))
+        # None means the rows are already grouped, sort/unsort are then no-ops
+        self.order = None if (order == np.arange(len(order))).all() else order
+        counts = np.bincount(codes, minlength=len(keys))
+        self.offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.starts = np.zeros(len(codes), dtype=bool)
+        self.starts[self.offsets[:-1][counts > 0]] = True
+
+    @classmethod
+    def from_frame(cls, input: pd.DataFrame, by="instrument_exch", sort_by=None):
+        """Factorizes the group columns of a frame and sorts its rows once
+
+        Args:
+            input (pd.DataFrame): Fills
+            by (str or list, optional): Group column or columns of a composite
+                key, e.g. ['account', 'instrument_exch']. Defaults to
+                'instrument_exch'.
+            sort_by (str, optional): Column to sort by inside a group.
+                Defaults to None.
+
+        Returns:
+            Segments: Segments of the frame, keyed by a pd.Index for one group
+                column and by a pd.MultiIndex for several
+        """
+        if not isinstance(by, str) and len(by) == 1:
+            by = by[0]
+        if isinstance(by, str):
+            codes, keys = _factorize(input[by])
+            keys = pd.Index(keys, name=by)
+        else:
+            codes, keys = _factorize_composite(input, by)
+        return cls(
+            codes,
+            keys,
+            None if sort_by is None else input[sort_by].to_numpy(),
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def sort(self, values: np.ndarray) -> np.ndarray:
+        """Reorders values from original row order to segment order"""
+        if self.order is None:
+            return values
+        return values[self.order]
+
+    def unsort(self, values: np.ndarray) -> np.ndarray:
+        """Reorders values from segment order back to original row order"""
+        if self.order is None:
+            return values
+        result = np.empty_like(values)
+        result[self.order] = values
+        return result
+
+    def cumsum(self, values: np.ndarray) -> np.ndarray:
+        """Cumulative sum inside every segment, values in segment order"""
+        return self.running_sum(values)[0]
+
+    def running_sum(self, values: np.ndarray, initial=None, compensation=None):
+        """Cumulative sum inside every segment continuing from carried sums
+
+        Args:
+            values (np.ndarray): Values in segment order
+            initial (np.ndarray, optional): Sum carried into every segment.
+                Defaults to None.
+            compensation (np.ndarray, optional): Kahan compensation carried into
+                every segment, only used for floats. Defaults to None.
+
+        Returns:
+            tuple: Running sums and the compensation at the end of every segment
+        """
+        if np.issubdtype(values.dtype, np.integer) and (
+            initial is None or np.issubdtype(np.asarray(initial).dtype, np.integer)
+        ):
+            # exact for integers, one pass over the whole array
+            totals = np.cumsum(values)
+            before = np.concatenate(([0], totals))[self.offsets[:-1]]
+            if initial is not None:
+                before = before - initial
+            totals -= np.repeat(before, np.diff(self.offsets))
+            return totals, np.zeros(len(self), dtype=np.float64)
+        # floats use the compensated summation of groupby to round the same way
+        return kernels.compensated_cumsum(self.starts, values, initial, compensation)
+
+    def shift(self, values: np.ndarray, initial=None) -> np.ndarray:
+        """Previous value inside every segment
+
+        Args:
+            values (np.ndarray): Values in segment order
+            initial (np.ndarray, optional): Value before the first row of every
+                segment. Defaults to None, which means NaN.
+
+        Returns:
+            np.ndarray: Shifted values as floats
+        """
+        result = np.empty(len(values), dtype=np.float64)
+        result[1:] = values[:-1]
+        result[self.starts] = np.nan if initial is None else initial
+        return result
+
+    def last(self, values: np.ndarray) -> np.ndarray:
+        """Last value of every segment, values in segment order"""
+        return values[self.offsets[1:] - 1]
+
+    def sum(self, values: np.ndarray, compensated: bool = False) -> np.ndarray:
+        """Sum of every segment skipping NaN, values in segment order
+
+        Args:
+            values (np.ndarray): Values in segment order
+            compensated (bool, optional): Sums floats with Neumaier compensated
+                summation instead of adding them up in order. Defaults to
+                False.
+
+        Returns:
+            np.ndarray: Sum of every segment
+        """
+        if compensated:
+            return kernels.compensated_sum(self.offsets, values)
+        values = np.nan_to_num(values, nan=0.0)
+        if len(values) == 0:
+            return np.zeros(len(self), dtype=values.dtype)
+        # reduceat takes the value at the start of an empty segment instead of
+        # zero, and its index must stay inside the array
+        starts = np.minimum(self.offsets[:-1], len(values) - 1)
+        sums = np.add.reduceat(values, starts)
+        sums[self.offsets[:-1] == self.offsets[1:]] = 0
+        return sums
+
+
+def _factorize(column: pd.Series) -> tuple:
+    # sorted integer codes and keys of one column
+    codes, keys = pd.factorize(column, sort=True)
+    if isinstance(keys, pd.CategoricalIndex):
+        # categories differ between chunks, keys are compared by value
+        keys = keys.astype(keys.categories.dtype)
+    return codes, keys
+
+
+def _factorize_composite(input: pd.DataFrame, by: list) -> tuple:
+    # Every column is factorized on its own and the codes are combined into
+    # one integer per row, whose order is the lexicographic order of the key.
+    # Only combinations that occur become groups.
+    factorized = [_factorize(input[column]) for column in by]
+    sizes = [max(len(keys), 1) for _, keys in factorized]
+    if np.prod(sizes, dtype=np.float64) >= 2**63:
+        raise ValueError(f"Too many distinct values in the group columns {by}")
+    combined = np.zeros(len(input), dtype=np.int64)
+    for (codes, _), size in zip(factorized, sizes):
+        combined = combined * size + codes
+    codes, groups = pd.factorize(combined, sort=True)
+    level_codes = []
+    for size in reversed(sizes):
+        groups, level = np.divmod(groups, size)
+        level_codes.append(level)
+    keys = pd.MultiIndex(
+        levels=[keys for _, keys in factorized],
+        codes=level_codes[::-1],
+        names=by,
+    )
+    return codes, keys
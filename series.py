@@ -0,0 +1,150 @@
+# Time-bucketed P&L curves from the row-level output of PLCalculator.calculate.
+# Every bucket takes the cumulative realized P&L and the position after its
+# last fill, marked at that fill's price or a later quote, so no bucket has to
+# be recalculated. This is the mark of calculate_totals with quotes, not the
+# unrealized_pnl_usd of the last fill, which uses the cost before that fill.
+
+import numpy as np
+import pandas as pd
+
+try:
+    from . import fx
+    from .quotes import asof_quotes, mark_position, mark_prices
+    from .segments import _factorize_composite
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    import fx
+    from quotes import asof_quotes, mark_position, mark_prices
+    from segments import _factorize_composite
+
+SERIES_COLUMNS = ["realized_pnl", "unrealized_pnl", "total_pnl"]
+
+# Columns of a fill needed to mark the position after it
+MARK_COLUMNS = [
+    "instrument_exch",
+    "cur_base",
+    "cur_quote",
+    "price",
+    "running_balance",
+    "running_inventory",
+    "inventory_cost",
+]
+
+
+def pnl_series(
+    result: pd.DataFrame,
+    freq: str = "1D",
+    quotes: pd.DataFrame = None,
+    fx_rates: fx.FXRates = None,
+    group_by="instrument_exch",
+    carry: bool = True,
+) -> pd.DataFrame:
+    """Realized, unrealized and total P&L of every instrument per time bucket
+
+    Buckets are labelled by their start and hold the values as of their end.
+    An instrument has a row for every bucket from its first fill to the last
+    bucket of the input, buckets without fills carry the previous position.
+    Rows are built from the last fill of every instrument and bucket, so
+    memory grows with the rows returned, not with instruments times buckets.
+
+    Unrealized P&L marks the position after the last fill of the bucket, the
+    same as PLCalculator.calculate_totals(quotes=quotes, ts=bucket end). It
+    differs from calculate_totals() without quotes, whose unrealized P&L is
+    that of the last fill, computed with the cost before the fill.
+
+    Args:
+        result (pd.DataFrame): Output of PLCalculator.calculate, fills of every
+            instrument in time order
+        freq (str, optional): Fixed bucket length as a pandas frequency, e.g.
+            '5min', or '1D' for end of day. Defaults to '1D'.
+        quotes (pd.DataFrame, optional): Quotes with quotes.QUOTE_COLUMNS. The
+            position is then marked at the last quote before the bucket end
+            unless the last fill is more recent. Defaults to None, which marks
+            at the last fill price.
+        fx_rates (fx.FXRates, optional): Rate table converting pairs without
+            USD at the bucket end, required when the result has such pairs.
+            Defaults to None.
+        group_by (str or list, optional): Group key of the calculation, e.g.
+            ['account', 'instrument_exch'], every group gets its own curve.
+            Must contain instrument_exch. Defaults to 'instrument_exch'.
+        carry (bool, optional): Adds the buckets without fills of a group,
+            marked at their own end. False only returns the buckets in which
+            the group has fills. Defaults to True.
+
+    Raises:
+        ValueError: If the result has pairs without USD but no fx_rates, or
+            group_by has no instrument_exch
+
+    Returns:
+        pd.DataFrame: SERIES_COLUMNS indexed by the group key and ts
+    """
+    key = [group_by] if isinstance(group_by, str) else list(group_by)
+    if "instrument_exch" not in key:
+        raise ValueError("group_by must contain instrument_exch")
+    bucket = result["ts"].dt.floor(freq)
+    realized = (
+        result["realized_pnl_usd"]
+        .fillna(0.0)
+        .groupby([result[column] for column in key], observed=True)
+        .cumsum()
+    )
+    columns = list(dict.fromkeys(key + MARK_COLUMNS))
+    last = (
+        result[columns + ["ts"]]
+        .rename(columns={"ts": "fill_ts"})
+        .assign(bucket=bucket, realized_pnl=realized)
+        .drop_duplicates(key + ["bucket"], keep="last")
+    )
+
+    values = [column for column in last.columns if column not in key + ["bucket"]]
+    codes, _ = _factorize_composite(last, key)
+    step = pd.Timedelta(pd.tseries.frequencies.to_offset(freq).nanos)
+    start = bucket.min()
+    positions = ((last["bucket"] - start) // step).to_numpy(dtype=np.int64)
+    buckets = int(positions.max()) + 1
+    # last fills ordered by group and bucket, numbered by both
+    ordinals = codes.astype(np.int64) * buckets + positions
+    order = np.argsort(ordinals, kind="stable")
+    ordinals, positions = ordinals[order], positions[order]
+    if carry:
+        # every group from its first bucket on takes the last fill at or before
+        # each bucket, groups have no position before their first bucket
+        first = np.flatnonzero(np.diff(ordinals // buckets, prepend=-1))
+        counts = buckets - positions[first]
+        row_starts = np.repeat(np.cumsum(counts) - counts, counts)
+        positions = (
+            np.arange(counts.sum()) - row_starts + np.repeat(positions[first], counts)
+        )
+        wanted = np.repeat(ordinals[first] // buckets, counts) * buckets + positions
+        order = order[np.searchsorted(ordinals, wanted, side="right") - 1]
+    rows = last.iloc[order]
+    grid = rows[values].set_axis(
+        pd.MultiIndex.from_arrays(
+            [rows[column] for column in key]
+            + [pd.DatetimeIndex(start + positions * step).astype(bucket.dtype)],
+            names=key + ["ts"],
+        )
+    )
+
+    price = grid["price"].to_numpy()
+    ends = grid.index.get_level_values("ts") + pd.tseries.frequencies.to_offset(freq)
+    if quotes is not None:
+        instruments = grid.index.get_level_values("instrument_exch")
+        quote_price, quote_ts = asof_quotes(
+            instruments, ends, quotes, allow_exact_matches=False
+        )
+        price = mark_prices(price, grid["fill_ts"], quote_price, quote_ts)
+    modes = fx.conversion_modes(grid)
+    cross_rates = None
+    if fx_rates is None:
+        fx.check_conversion_modes(grid.reset_index(), modes)
+    elif (modes == fx.UNSUPPORTED).any():
+        cross_rates = fx_rates.usd_rates(grid["cur_quote"].to_numpy(), ends)
+    series = pd.DataFrame(
+        {
+            "realized_pnl": grid["realized_pnl"],
+            "unrealized_pnl": mark_position(grid, price, modes, cross_rates),
+        },
+        index=grid.index,
+    )
+    series["total_pnl"] = series["realized_pnl"] + series["unrealized_pnl"]
+    return series
@@ -0,0 +1,290 @@
+# Asyncio ingestion of live fills into an IncrementalPLCalculator.
+# Sources put fill records on a bounded queue, which blocks them when the
+# calculator falls behind. The service drains the queue in micro-batches that
+# are flushed when they are full or when their oldest fill waited long enough,
+# and publishes the updated totals to a sink after every batch.
+# Usage: python service.py --tail fills.csv --output totals.json
+
+import argparse
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Iterable
+
+import pandas as pd
+
+try:
+    from .constants import BASE_COLUMNS
+    from .incremental import IncrementalPLCalculator
+    from .sinks import sink_for
+except ImportError:  # executed as a script
+    from constants import BASE_COLUMNS
+    from incremental import IncrementalPLCalculator
+    from sinks import sink_for
+
+# Ends a queue source and stops the service once everything before it is done
+STOP = None
+
+
+def records_to_frame(records: list) -> pd.DataFrame:
+    """Fills with BASE_COLUMNS from a list of fill record dicts"""
+    fills = pd.DataFrame.from_records(records, columns=BASE_COLUMNS)
+    fills["side"] = fills["side"].astype(int)
+    fills["amount"] = fills["amount"].astype(float)
+    fills["price"] = fills["price"].astype(float)
+    fills["ts"] = pd.to_datetime(fills["ts"])
+    return fills
+
+
+async def queue_source(queue: asyncio.Queue) -> AsyncIterator[dict]:
+    """Yields fill records put on a queue until STOP is put"""
+    while True:
+        record = await queue.get()
+        if record is STOP:
+            return
+        yield record
+
+
+async def tail_source(
+    filename: str, delimiter=";", thousands=" ", decimal=",", poll_interval=0.1
+) -> AsyncIterator[dict]:
+    """Yields the fill records of a csv file and then those appended to it
+
+    The file has the format of reader.read_data with a header line. It is
+    polled for new lines forever, cancel the task reading it to stop.
+
+    Args:
+        filename (str): Path to the csv file
+        delimiter (str, optional): Delimiter of CSV. Defaults to ';'.
+        thousands (str, optional): Delimiter of thousands for numbers. Defaults to ' '.
+        decimal (str, optional): Delimiter of decimal places. Defaults to ','.
+        poll_interval (float, optional): Seconds to wait for new lines.
+            Defaults to 0.1.
+    """
+
+    def number(text: str) -> str:
+        return text.replace(thousands, "").replace(decimal, ".")
+
+    with open(filename) as f:
+        header = None
+        pending = ""
+        while True:
+            line = f.readline()
+            if not line.endswith("\n"):
+                # nothing or only part of a line was written so far
+                pending += line
+                await asyncio.sleep(poll_interval)
+                continue
+            line, pending = pending + line, ""
+            values = line.rstrip("\r\n").split(delimiter)
+            if header is None:
+                header = values
+                continue
+            if values == [""]:
+                continue
+            record = dict(zip(header, values))
+            for column in ("amount", "price"):
+                record[column] = number(record[column])
+            yield record
+
+
+async def stream_source(reader: asyncio.StreamReader) -> AsyncIterator[dict]:
+    """Yields fill records sent as JSON lines over a socket until it closes
+
+    Args:
+        reader (asyncio.StreamReader): Reader of e.g. asyncio.open_connection
+    """
+    async for line in reader:
+        if line.strip():
+            yield json.loads(line)
+
+
+class IngestionService:
+    """Feeds fill records from async sources into an IncrementalPLCalculator
+
+    Args:
+        calculator (IncrementalPLCalculator, optional): Calculator to update.
+            Defaults to a new one without history.
+        sink (optional): Sink from sinks the totals are written to after every
+            batch. Defaults to None, which only keeps them in latest_totals.
+        max_batch (int, optional): Records after which a batch is flushed.
+            Defaults to 1000.
+        max_latency (float, optional): Seconds after which a batch is flushed
+            even if it isn't full, counted from its first record. Defaults
+            to 0.1.
+        queue_size (int, optional): Records the queue holds before sources
+            are blocked. Defaults to 10 000.
+    """
+
+    def __init__(
+        self,
+        calculator: IncrementalPLCalculator = None,
+        sink=None,
+        max_batch: int = 1000,
+        max_latency: float = 0.1,
+        queue_size: int = 10_000,
+    ):
+        self.calculator = calculator or IncrementalPLCalculator()
+        self.sink = sink
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.latest_totals = self.calculator.totals()
+        self.counters = {
+            "records": 0,
+            "batches": 0,
+            "size_flushes": 0,
+            "latency_flushes": 0,
+            "blocked_puts": 0,
+            "blocked_seconds": 0.0,
+            "calculate_seconds": 0.0,
+            "last_batch_size": 0,
+            "last_batch_latency_seconds": 0.0,
+        }
+
+    def metrics(self) -> dict:
+        """Batching and backpressure counters and the current queue depth"""
+        return {
+            **self.counters,
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+        }
+
+    async def put(self, record: dict):
+        """Queues one fill record, waiting while the queue is full"""
+        if self.queue.full():
+            self.counters["blocked_puts"] += 1
+            start = time.perf_counter()
+            await self.queue.put((time.perf_counter(), record))
+            self.counters["blocked_seconds"] += time.perf_counter() - start
+        else:
+            self.queue.put_nowait((time.perf_counter(), record))
+
+    async def feed(self, source: AsyncIterator[dict]):
+        """Queues every record of a source"""
+        async for record in source:
+            await self.put(record)
+
+    async def stop(self):
+        """Makes run() return once the records queued so far are published"""
+        await self.queue.put((time.perf_counter(), STOP))
+
+    async def _next_batch(self) -> tuple:
+        # waits for a first record, then collects until full or too old,
+        # returns the records, when the first was queued and whether to stop
+        received, record = await self.queue.get()
+        if record is STOP:
+            return [], received, True
+        batch, deadline = [record], received + self.max_latency
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                if timeout > 0:
+                    _, record = await asyncio.wait_for(self.queue.get(), timeout)
+                else:
+                    _, record = self.queue.get_nowait()
+            except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                break
+            if record is STOP:
+                return batch, received, True
+            batch.append(record)
+        flush = "size_flushes" if len(batch) == self.max_batch else "latency_flushes"
+        self.counters[flush] += 1
+        return batch, received, False
+
+    async def _apply(self, batch: list, received: float):
+        start = time.perf_counter()
+        # the calculation blocks, so it runs in a thread and sources keep
+        # filling the queue meanwhile
+        _, totals = await asyncio.to_thread(
+            self.calculator.update, records_to_frame(batch)
+        )
+        now = time.perf_counter()
+        self.latest_totals = totals
+        if self.sink is not None:
+            self.sink.write(totals)
+        self.counters["records"] += len(batch)
+        self.counters["batches"] += 1
+        self.counters["calculate_seconds"] += now - start
+        self.counters["last_batch_size"] = len(batch)
+        self.counters["last_batch_latency_seconds"] = now - received
+
+    async def run(self):
+        """Applies queued records batch by batch until stop() is called"""
+        while True:
+            batch, received, stopped = await self._next_batch()
+            if batch:
+                await self._apply(batch, received)
+            if stopped:
+                return
+
+
+async def replay(service: IngestionService, fills: pd.DataFrame, interval: float = 0.0):
+    """Stand-in producer putting every fill as a record, interval seconds apart
+
+    Args:
+        service (IngestionService): Service to feed
+        fills (pd.DataFrame): Fills with at least BASE_COLUMNS
+        interval (float, optional): Seconds between records. Defaults to 0.
+    """
+    for record in fills[BASE_COLUMNS].to_dict(orient="records"):
+        await service.put(record)
+        await asyncio.sleep(interval)
+
+
+async def serve(sources: Iterable[AsyncIterator[dict]], service: IngestionService):
+    """Runs the service until every source is exhausted
+
+    A batch that fails stops the sources and its error is raised.
+
+    Args:
+        sources (Iterable[AsyncIterator[dict]]): Sources of fill records
+        service (IngestionService): Service to feed
+    """
+    runner = asyncio.create_task(service.run())
+    feeds = asyncio.gather(*(service.feed(source) for source in sources))
+    try:
+        await asyncio.wait({runner, feeds}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        feeds.cancel()
+        runner.cancel()
+        await asyncio.gather(feeds, runner, return_exceptions=True)
+        raise
+    if runner.done():
+        # run() only ends early when a batch failed, the sources would then
+        # block on the full queue forever
+        feeds.cancel()
+        await asyncio.gather(feeds, return_exceptions=True)
+        runner.result()
+        return
+    if feeds.exception() is not None:
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        feeds.result()
+    await service.stop()
+    await runner
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Live P&L from a stream of fills")
+    parser.add_argument("--tail", required=True, help="csv file to follow")
+    parser.add_argument("--output", help="file the totals are written to")
+    parser.add_argument("--max-batch", type=int, default=1000)
+    parser.add_argument("--max-latency", type=float, default=0.1)
+    parser.add_argument("--queue-size", type=int, default=10_000)
+    args = parser.parse_args(args)
+
+    service = IngestionService(
+        sink=sink_for(args.output),
+        max_batch=args.max_batch,
+        max_latency=args.max_latency,
+        queue_size=args.queue_size,
+    )
+    try:
+        asyncio.run(serve([tail_source(args.tail)], service))
+    except KeyboardInterrupt:
+        print(service.metrics())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+# Sinks for the totals of PLCalculator.calculate_totals.
+# A sink is any object with a write(totals) method, so that the caller decides
+# where totals go instead of the calculator printing and writing a fixed file.
+
+import json
+
+import pandas as pd
+
+try:
+    from .writer import write_data
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    from writer import write_data
+
+
+class NullSink:
+    """Discards the totals"""
+
+    def write(self, totals: pd.DataFrame):
+        pass
+
+
+class MemorySink:
+    """Keeps every written totals frame in memory, the latest one in .totals"""
+
+    def __init__(self):
+        self.written = []
+
+    @property
+    def totals(self) -> pd.DataFrame:
+        return self.written[-1] if self.written else None
+
+    def write(self, totals: pd.DataFrame):
+        self.written.append(totals.copy())
+
+
+def _nested(totals: pd.DataFrame) -> dict:
+    # one level of dicts per level of a composite key, e.g.
+    # {account: {instrument_exch: {unrealized_pnl, ...}}}
+    if totals.index.nlevels == 1:
+        return totals.to_dict(orient="index")
+    return {
+        key: _nested(group.droplevel(0))
+        for key, group in totals.groupby(level=0, sort=False)
+    }
+
+
+class JsonSink:
+    """Writes the totals as {instrument_exch: {unrealized_pnl, ...}} JSON
+
+    Totals of a composite group key are nested one level per key column,
+    e.g. {account: {instrument_exch: {unrealized_pnl, ...}}}.
+
+    Args:
+        filename (str): Path to the JSON file
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+
+    def write(self, totals: pd.DataFrame):
+        # converted first, so that a failure leaves no partial file behind
+        nested = _nested(totals)
+        with open(self.filename, "w") as f:
+            json.dump(nested, f)
+
+
+class FileSink:
+    """Writes the totals as a table in the format given by the file extension
+
+    Args:
+        filename (str): Path to a csv, Parquet or Arrow file, see writer.write_data
+        **kwargs: Passed to writer.write_data, e.g. delimiter and decimal of CSV
+    """
+
+    def __init__(self, filename: str, **kwargs):
+        self.filename = filename
+        self.kwargs = kwargs
+
+    def write(self, totals: pd.DataFrame):
+        write_data(totals, self.filename, **self.kwargs)
+
+
+def sink_for(filename: str = None):
+    """Sink for a file name, JsonSink for .json, FileSink otherwise
+
+    Args:
+        filename (str, optional): Path to write to. Defaults to None, which
+            gives a NullSink.
+
+    Returns:
+        Sink with a write(totals) method
+    """
+    if filename is None:
+        return NullSink()
+    if str(filename).lower().endswith(".json"):
+        return JsonSink(filename)
+    return FileSink(filename)
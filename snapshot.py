@@ -0,0 +1,151 @@
+# Snapshots of the per-instrument state so that a restart only has to replay
+# the fills after the snapshot instead of the whole history.
+
+import json
+
+import numpy as np
+import pandas as pd
+
+try:
+    from .constants import STATE_COLUMNS
+    from .pl_calculator import PLCalculator
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    from constants import STATE_COLUMNS
+    from pl_calculator import PLCalculator
+
+# Version 2 stores the names of the index levels and the key of every state as
+# a list, so composite group keys round-trip. Version 1 snapshots, keyed by
+# instrument_exch only, are still read.
+SNAPSHOT_VERSION = 2
+
+
+def _to_json_value(value):
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    if pd.isna(value):
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def state_at(
+    input: pd.DataFrame, ts, initial_state: pd.DataFrame = None, group_by=None
+):
+    """Per-instrument state after all fills up to and including ts
+
+    Args:
+        input (pd.DataFrame): Fills with at least BASE_COLUMNS
+        ts: Point in time of the state
+        initial_state (pd.DataFrame, optional): State before the fills.
+            Defaults to None.
+        group_by (list, optional): Columns of a composite group key, see
+            PLCalculator. Defaults to None, which means instrument_exch.
+
+    Returns:
+        pd.DataFrame: STATE_COLUMNS indexed by instrument_exch, or by the
+            group key with several group_by columns
+    """
+    fills = input[input["ts"] <= pd.Timestamp(ts)].copy()
+    pl_calc = PLCalculator(
+        fills, engine="vectorized", initial_state=initial_state, group_by=group_by
+    )
+    pl_calc.calculate()
+    return pl_calc.final_state()
+
+
+def save_snapshot(state: pd.DataFrame, filename: str, ts=None):
+    """Writes the per-instrument state to a versioned JSON snapshot
+
+    Floats are written with full precision so that a resumed run continues
+    exactly where the snapshot was taken.
+
+    Args:
+        state (pd.DataFrame): STATE_COLUMNS indexed by instrument_exch or by
+            a composite group key
+        filename (str): Path to the snapshot file
+        ts (optional): Point in time of the snapshot. Defaults to the last
+            fill of the state.
+    """
+    if ts is None:
+        ts = state["ts"].max()
+    keys = state.index if state.index.nlevels > 1 else [(key,) for key in state.index]
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "ts": _to_json_value(pd.Timestamp(ts)),
+        "index": list(state.index.names),
+        "columns": STATE_COLUMNS,
+        "states": [
+            [
+                [_to_json_value(value) for value in key],
+                [_to_json_value(value) for value in row],
+            ]
+            for key, row in zip(keys, state[STATE_COLUMNS].itertuples(False))
+        ],
+    }
+    with open(filename, "w") as f:
+        json.dump(snapshot, f)
+
+
+def load_snapshot(filename: str) -> tuple:
+    """Reads a snapshot written by save_snapshot
+
+    Args:
+        filename (str): Path to the snapshot file
+
+    Raises:
+        ValueError: If the snapshot was written by an unsupported version
+
+    Returns:
+        tuple: State indexed by instrument_exch, or by the group key it was
+            saved with, and the point in time of the snapshot
+    """
+    with open(filename) as f:
+        snapshot = json.load(f)
+    version = snapshot.get("version")
+    if version == 1:
+        state = pd.DataFrame.from_dict(
+            snapshot["instruments"], orient="index", columns=snapshot["columns"]
+        )
+        state.index.name = "instrument_exch"
+    elif version == SNAPSHOT_VERSION:
+        names = snapshot["index"]
+        index = pd.MultiIndex.from_tuples(
+            [tuple(key) for key, _ in snapshot["states"]], names=names
+        )
+        state = pd.DataFrame(
+            [row for _, row in snapshot["states"]],
+            columns=snapshot["columns"],
+            index=index if len(names) > 1 else index.get_level_values(0),
+        )
+    else:
+        raise ValueError(
+            f"Unsupported snapshot version {version!r}, expected {SNAPSHOT_VERSION}"
+        )
+    state["ts"] = pd.to_datetime(state["ts"])
+    for column in STATE_COLUMNS:
+        if column not in ("running_balance", "ts"):
+            state[column] = state[column].astype(float)
+    return state[STATE_COLUMNS], pd.Timestamp(snapshot["ts"])
+
+
+def resume(input: pd.DataFrame, filename: str) -> PLCalculator:
+    """Vectorized calculator for the fills after a snapshot, continuing from it
+
+    The fills are grouped by the key the snapshot was saved with.
+
+    Args:
+        input (pd.DataFrame): Fills, those up to the snapshot ts are skipped
+        filename (str): Path to the snapshot file
+
+    Returns:
+        PLCalculator: Calculator ready to calculate() the remaining fills
+    """
+    state, ts = load_snapshot(filename)
+    fills = input[input["ts"] > ts].copy()
+    return PLCalculator(
+        fills,
+        engine="vectorized",
+        initial_state=state,
+        group_by=list(state.index.names),
+    )
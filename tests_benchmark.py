@@ -0,0 +1,54 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from .benchmark import benchmark, generate_fills
+from .pl_calculator import STAGES, PLCalculator
+
+
+def test_generate_fills_knobs():
+    """Should generate the requested instruments, flips and currency mix"""
+    fills = generate_fills(
+        instruments=4, fills_per_instrument=200, flip_probability=0.2, usd_base_share=1
+    )
+    assert fills["instrument_exch"].nunique() == 4
+    assert (fills["cur_base"] == "USD").all()
+    assert fills["ts"].is_monotonic_increasing
+    result = PLCalculator(fills, engine="vectorized").calculate()
+    flipped = result["running_balance"] * result["lag_running_balance"] < 0
+    flips = flipped.groupby(result["instrument_exch"]).sum()
+    assert flips.between(20, 80).all()
+    assert not generate_fills(usd_base_share=0)["cur_quote"].ne("USD").any()
+
+
+def test_benchmark_reports_every_stage():
+    """Should time every stage and calculate_totals separately"""
+    fills = generate_fills(instruments=2, fills_per_instrument=20)
+    results = benchmark(fills, engine="vectorized")
+    assert list(results) == list(STAGES) + ["calculate_totals"]
+    for result in results.values():
+        assert set(result) == {"wall_s", "cpu_s", "rows_per_s", "peak_bytes"}
+
+
+def test_script_loads_cached_kernels():
+    """Should load the kernels compiled by the package from a script"""
+    pytest.importorskip("numba")
+    PLCalculator(generate_fills(instruments=2), engine="vectorized").calculate()
+    script = (
+        "import kernels\n"
+        "from benchmark import generate_fills\n"
+        "from pl_calculator import PLCalculator\n"
+        "PLCalculator(generate_fills(instruments=2), engine='vectorized').calculate()\n"
+        "print(sum(sum(jitted.stats.cache_hits.values())"
+        " for jitted in kernels._JITTED.values()))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert int(output.stdout) > 0
@@ -0,0 +1,96 @@
+import os
+
+import pandas as pd
+import pytest
+
+from . import cli
+from .benchmark import generate_fills
+from .cache import ResultCache, calculate_cached
+from .pl_calculator import PLCalculator
+
+
+@pytest.fixture
+def input_fills():
+    return generate_fills(instruments=4, fills_per_instrument=50, seed=1)
+
+
+@pytest.mark.parametrize("engine", ["rowwise", "vectorized"])
+def test_cache_skips_unchanged_instruments(input_fills, tmp_path, engine):
+    """Should load unchanged instruments and recalculate changed ones"""
+    cache = ResultCache(tmp_path)
+    expected = PLCalculator(input_fills.copy(), engine=engine).calculate()
+    pd.testing.assert_frame_equal(
+        calculate_cached(input_fills, cache, engine=engine), expected
+    )
+    assert (cache.hits, cache.misses) == (0, 4)
+    pd.testing.assert_frame_equal(
+        calculate_cached(input_fills, cache, engine=engine), expected
+    )
+    assert (cache.hits, cache.misses) == (4, 4)
+
+    corrected = input_fills.copy()
+    instrument = corrected["instrument_exch"].iloc[0]
+    corrected.loc[corrected.index[0], "price"] += 1
+    result = calculate_cached(corrected, cache, engine=engine)
+    assert (cache.hits, cache.misses) == (7, 5)
+    pd.testing.assert_frame_equal(
+        result, PLCalculator(corrected.copy(), engine=engine).calculate()
+    )
+    assert (result["instrument_exch"] == instrument).sum() == 50
+
+
+def test_cache_keys_include_options(input_fills, tmp_path):
+    """Should not reuse results calculated with other options"""
+    cache = ResultCache(tmp_path)
+    calculate_cached(input_fills, cache, engine="vectorized")
+    lifo = calculate_cached(input_fills, cache, engine="vectorized", cost_basis="lifo")
+    assert cache.misses == 8
+    expected = PLCalculator(
+        input_fills.copy(), engine="vectorized", cost_basis="lifo"
+    ).calculate()
+    pd.testing.assert_frame_equal(lifo, expected)
+    with pytest.raises(ValueError, match="fx_rates"):
+        calculate_cached(input_fills, cache, fx_rates=None)
+
+
+def test_cache_eviction_and_invalidation(input_fills, tmp_path):
+    """Should evict least recently used entries and forget on request"""
+    cache = ResultCache(tmp_path)
+    calculate_cached(input_fills, cache, engine="vectorized")
+    entries = cache.entries()
+    assert len(entries) == 4
+    entry_size = max(os.path.getsize(path) for path in entries)
+
+    instruments = sorted(input_fills["instrument_exch"].unique())
+    (oldest,) = [
+        path
+        for path in entries
+        if os.path.basename(path).startswith(ResultCache._prefix(instruments[0]))
+    ]
+    # the entry touched longest ago goes first
+    os.utime(oldest, (0, 0))
+    cache.max_bytes = cache.size() - 1
+    cache.evict()
+    assert oldest not in cache.entries()
+    assert len(cache.entries()) == 3
+
+    cache.max_bytes = 10 * entry_size
+    cache.invalidate([instruments[1]])
+    assert len(cache.entries()) == 2
+    calculate_cached(input_fills, cache, engine="vectorized")
+    assert cache.misses == 6
+    cache.invalidate()
+    assert cache.entries() == []
+
+
+def test_cli_cache(input_fills, tmp_path):
+    """Should give the same totals with and without the cache"""
+    filename = tmp_path / "fills.parquet"
+    input_fills.to_parquet(filename)
+    options = [str(filename), "--totals", ""]
+    expected = cli.main(options)
+    cache = tmp_path / "cache"
+    for _ in range(2):
+        totals = cli.main(options + ["--cache", str(cache)])
+        pd.testing.assert_frame_equal(totals, expected, check_exact=False)
+    assert len(ResultCache(cache).entries()) == 4
@@ -0,0 +1,95 @@
+import json
+
+import pandas as pd
+import pytest
+
+from . import cli, pl_calculator, reader
+from .pl_calculator import PLCalculator
+from .reader import read_any, read_data
+
+
+@pytest.fixture
+def input_csv(tmp_path):
+    filename = tmp_path / "data.csv"
+    filename.write_text(
+        "instrument_exch;cur_base;cur_quote;side;amount;price;ts\n"
+        "USD/KZT;USD;KZT;1;1;450,5;2020-02-01 00:00:00\n"
+        "USD/KZT;USD;KZT;1;100;450;2020-02-02 00:00:00\n"
+        "EUR/USD;EUR;USD;1;1 050,5;1,1;2020-02-02 00:00:00\n"
+        "USD/KZT;USD;KZT;-1;201;451;2020-02-03 00:00:00\n"
+        "EUR/USD;EUR;USD;-1;2 150;1,12;2020-02-03 00:00:00\n"
+        "USD/KZT;USD;KZT;1;302;500;2020-02-04 00:00:00\n"
+        "EUR/USD;EUR;USD;1;350;1,09;2020-02-04 00:00:00\n"
+    )
+    return filename
+
+
+def test_cli_writes_rows_and_totals(input_csv, tmp_path):
+    """Should write the same rows and totals as PLCalculator"""
+    expected = PLCalculator(read_data(input_csv))
+    expected_rows = expected.calculate()
+    output, totals_file = tmp_path / "rows.csv", tmp_path / "totals.json"
+    totals = cli.main(
+        [str(input_csv), "--output", str(output), "--totals", str(totals_file)]
+    )
+    pd.testing.assert_frame_equal(totals, expected.calculate_totals())
+    pd.testing.assert_frame_equal(read_data(output), expected_rows, check_dtype=False)
+    assert json.loads(totals_file.read_text()) == totals.to_dict(orient="index")
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        ["--engine", "rowwise"],
+        ["--chunksize", "2"],
+        ["--workers", "2"],
+    ],
+)
+def test_cli_options_agree(input_csv, tmp_path, options):
+    """Should give the same totals with every engine and batch option"""
+    output = tmp_path / "rows.csv"
+    expected = cli.main([str(input_csv), "--totals", ""])
+    totals = cli.main(
+        [str(input_csv), "--totals", "", "--output", str(output)] + options
+    )
+    pd.testing.assert_frame_equal(totals, expected, check_exact=False)
+    assert len(read_data(output)) == 7
+
+
+def test_cli_filters_instruments_and_reports_timings(input_csv, tmp_path, capsys):
+    """Should calculate only the given instruments and print stage timings"""
+    output = tmp_path / "rows.parquet"
+    totals = cli.main(
+        [
+            str(input_csv),
+            "--totals",
+            "",
+            "--instruments",
+            "EUR/USD",
+            "--output",
+            str(output),
+            "--timings",
+        ]
+    )
+    assert totals.index.tolist() == ["EUR/USD"]
+    assert read_any(output)["instrument_exch"].unique().tolist() == ["EUR/USD"]
+    report = capsys.readouterr().err
+    for stage in ("read", "pnl_calc", "write"):
+        assert stage in report
+
+
+def test_cli_rejects_unsupported_options(input_csv, tmp_path):
+    """Should exit with a usage error for options that don't combine"""
+    for options in (
+        ["--chunksize", "2", "--engine", "rowwise"],
+        ["--chunksize", "2", "--output", str(tmp_path / "rows.parquet")],
+        ["--workers", "0"],
+    ):
+        with pytest.raises(SystemExit):
+            cli.main([str(input_csv), "--totals", ""] + options)
+
+
+def test_cli_choices_match_modules():
+    """Should offer the formats and engines the modules support"""
+    assert set(cli.FILE_FORMATS) == set(reader.FORMATS.values())
+    assert cli.ENGINES == pl_calculator.ENGINES
@@ -0,0 +1,95 @@
+import numpy as np
+import pandas as pd
+
+from .constants import BASE_COLUMNS
+from .differential import CANDIDATES, check, random_fills, reference, run
+
+
+def _buggy(input: pd.DataFrame) -> pd.DataFrame:
+    # realized P&L of flips in USD/XXX pairs off by one part in a million
+    result = CANDIDATES["vectorized"](input)
+    flips = (result["flag_liquidation"] == 1) & (result["cur_base"] == "USD")
+    result.loc[flips, "realized_pnl_usd"] *= 1 + 1e-6
+    return result
+
+
+def test_random_fills_cases():
+    """Should generate flips, flat positions, both pair kinds and NaN lags"""
+    cases = [random_fills(np.random.default_rng([0, case])) for case in range(30)]
+    fills = pd.concat(cases, ignore_index=True)
+    assert (fills["cur_base"] == "USD").any() and (fills["cur_quote"] == "USD").any()
+    assert (fills["amount"] % 1 != 0).any()
+    flats = flips = 0
+    for case in cases:
+        expected = reference(case)
+        assert case["ts"].is_monotonic_increasing
+        # the first fill of every instrument has no previous balance
+        assert expected["lag_running_balance"].isna().sum() == len(
+            case["instrument_exch"].unique()
+        )
+        flats += (expected["running_balance"] == 0).sum()
+        flips += expected["flag_liquidation"].sum()
+    assert flats > 10 and flips > 10
+
+
+def test_engines_agree_with_reference():
+    """Should find no differences of any engine, not even in the last bit"""
+    assert run(cases=15, seed=1, rtol=0) == []
+
+
+def test_failures_shrink_to_reproducers():
+    """Should shrink a failing case to a few rows that still fail"""
+    (failure,) = run(cases=20, candidates={"buggy": _buggy}, rtol=0)
+    assert failure.candidate == "buggy"
+    assert len(failure.input) <= 3 < failure.rows
+    assert failure.differences["column"].tolist() == ["realized_pnl_usd"]
+    namespace = {"pd": pd}
+    exec(failure.reproducer(), namespace)
+    pd.testing.assert_frame_equal(namespace["input"], failure.input, check_dtype=False)
+    assert not check(namespace["input"], _buggy, rtol=0).empty
+    assert run(cases=20, candidates={"buggy": _buggy}, rtol=1e-5) == []
+
+
+def test_exceptions_and_flat_positions_fail():
+    """Should report exceptions and inventory left on flat positions"""
+    input = random_fills(np.random.default_rng(4), flatten_probability=0.5)
+
+    def failing(input):
+        raise ValueError("boom")
+
+    def keeps_inventory(input):
+        result = CANDIDATES["vectorized"](input)
+        flat = result["running_balance"] == 0
+        result.loc[flat, "running_inventory"] = 1.0
+        return result
+
+    assert check(input, failing)["actual"].tolist() == ["ValueError('boom')"]
+    differences = check(input, keeps_inventory)
+    assert not differences.empty
+    assert set(differences["column"]) == {"running_inventory"}
+
+
+def test_reference_restarts_at_flat_positions():
+    """Should check the P&L of the flattening fill and of the reopened position"""
+    input = pd.DataFrame(
+        [
+            ("EUR/USD", "EUR", "USD", 1, 10, 100.0),
+            ("EUR/USD", "EUR", "USD", -1, 10, 110.0),
+            ("EUR/USD", "EUR", "USD", 1, 5, 120.0),
+            ("EUR/USD", "EUR", "USD", -1, 2, 130.0),
+        ],
+        columns=BASE_COLUMNS[:-1],
+    )
+    input["ts"] = pd.date_range("2020-01-01", periods=4, freq="min")
+    expected = reference(input)
+    assert expected["running_inventory"].tolist() == [1000, 0, 600, 360]
+    assert expected["realized_pnl_usd"].tolist()[1:] == [100, 0, 20]
+    assert expected["unrealized_pnl_usd"].tolist()[1:] == [0, 0, 30]
+    assert check(input, CANDIDATES["vectorized"], rtol=0).empty
+
+    def reopens_wrong(input):
+        result = CANDIDATES["vectorized"](input)
+        result.loc[[1, 3], "realized_pnl_usd"] += 1
+        return result
+
+    assert check(input, reopens_wrong, rtol=0)["row"].tolist() == [1, 3]
@@ -0,0 +1,124 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .constants import BASE_COLUMNS
+from .fx import FXRates
+from .pl_calculator import PLCalculator
+from .series import pnl_series
+
+
+@pytest.fixture
+def fx_rates():
+    rates = [
+        ("USD", "KZT", datetime(2020, 2, 1, 0, 0), 450.0),
+        ("USD", "KZT", datetime(2020, 2, 2, 0, 0), 500.0),
+        ("EUR", "USD", datetime(2020, 2, 1, 0, 0), 1.1),
+        ("GBP", "EUR", datetime(2020, 2, 1, 0, 0), 1.2),
+    ]
+    return FXRates(pd.DataFrame(rates, columns=["cur_base", "cur_quote", "ts", "rate"]))
+
+
+@pytest.fixture
+def input_cross():
+    input = [
+        ("EUR/KZT", "EUR", "KZT", 1, 10, 490, datetime(2020, 2, 1, 12, 0)),
+        ("USD/KZT", "USD", "KZT", 1, 10, 450, datetime(2020, 2, 1, 12, 0)),
+        ("EUR/KZT", "EUR", "KZT", -1, 4, 550, datetime(2020, 2, 2, 12, 0)),
+        ("USD/KZT", "USD", "KZT", -1, 4, 500, datetime(2020, 2, 2, 12, 0)),
+    ]
+    return pd.DataFrame(input, columns=BASE_COLUMNS)
+
+
+def test_fx_paths(fx_rates: FXRates):
+    """Should resolve direct, inverted and multi-hop paths to USD"""
+    assert fx_rates.path("USD") == []
+    assert fx_rates.path("KZT") == [(2, True)]
+    assert fx_rates.path("GBP") == [(1, False), (0, False)]
+    with pytest.raises(ValueError, match="JPY"):
+        fx_rates.check(["KZT", "JPY"])
+
+
+def test_usd_rates_as_of_bucket(fx_rates: FXRates):
+    """Should take the last rate at or before every time and cache every bucket"""
+    rates = fx_rates.usd_rates(
+        ["KZT", "KZT", "GBP", "KZT"],
+        pd.to_datetime(
+            [
+                "2020-02-01 23:59:30",
+                "2020-02-02 00:00:30",
+                "2020-02-03 00:00:00",
+                "2020-01-31 00:00:00",
+            ]
+        ),
+    )
+    np.testing.assert_allclose(rates[:3], [1 / 450, 1 / 500, 1.2 * 1.1])
+    assert np.isnan(rates[3])
+    assert sum(len(cached) for cached, _, _ in fx_rates._cache.values()) == 4
+
+
+def test_usd_rates_inside_bucket():
+    """Should take a rate published inside the bucket of the time"""
+    rates = pd.DataFrame(
+        [("EUR", "USD", datetime(2020, 2, 1, 10, 0, 30), 1.1)],
+        columns=["cur_base", "cur_quote", "ts", "rate"],
+    )
+    fx_rates = FXRates(rates)
+    times = pd.to_datetime(
+        ["2020-02-01 10:00:10", "2020-02-01 10:00:45", "2020-02-01 10:01:00"]
+    )
+    found = fx_rates.usd_rates(["EUR"] * 3, times)
+    assert np.isnan(found[0])
+    np.testing.assert_allclose(found[1:], [1.1, 1.1])
+    assert sum(len(cached) for cached, _, _ in fx_rates._cache.values()) == 2
+
+    input = pd.DataFrame(
+        [
+            ("EUR/KZT", "EUR", "KZT", 1, 10, 490, datetime(2020, 2, 1, 10, 0, 45)),
+            ("EUR/KZT", "EUR", "KZT", -1, 10, 500, datetime(2020, 2, 1, 10, 0, 50)),
+        ],
+        columns=BASE_COLUMNS,
+    )
+    kzt = pd.DataFrame(
+        [("EUR", "KZT", datetime(2020, 2, 1, 10, 0, 40), 490.0)],
+        columns=["cur_base", "cur_quote", "ts", "rate"],
+    )
+    result = PLCalculator(
+        input, engine="vectorized", fx_rates=FXRates(pd.concat([rates, kzt]))
+    ).calculate()
+    # 100 KZT at 1.1 / 490 USD per KZT
+    assert result["realized_pnl_usd"].iloc[1] == pytest.approx(100 * 1.1 / 490)
+
+
+def test_cross_pairs_converted(input_cross: pd.DataFrame, fx_rates: FXRates):
+    """Should convert crosses at the quote currency rate of the fill time"""
+    result = PLCalculator(
+        input_cross.copy(), engine="vectorized", fx_rates=fx_rates
+    ).calculate()
+    cross = result["instrument_exch"] == "EUR/KZT"
+    np.testing.assert_allclose(
+        result.loc[cross, "realized_pnl_usd"],
+        result.loc[cross, "realized_pnl_quote_currency"] / [450, 500],
+    )
+    expected = PLCalculator(input_cross[~cross].copy(), engine="vectorized").calculate()
+    pd.testing.assert_frame_equal(result[~cross], expected)
+
+    with pytest.raises(ValueError, match="EUR/KZT"):
+        pnl_series(result)
+    series = pnl_series(result, fx_rates=fx_rates)
+    assert series.loc[("EUR/KZT", pd.Timestamp("2020-02-02")), "unrealized_pnl"] == (
+        pytest.approx((550 - 490) * 6 / 500)
+    )
+
+
+def test_cross_pairs_rejected(input_cross: pd.DataFrame, fx_rates: FXRates):
+    """Should reject crosses without rates before computing anything"""
+    with pytest.raises(ValueError, match="EUR/KZT"):
+        PLCalculator(input_cross.copy(), engine="vectorized").calculate()
+    with pytest.raises(ValueError, match="vectorized"):
+        PLCalculator(input_cross, fx_rates=fx_rates)
+    early = input_cross.assign(ts=input_cross["ts"] - pd.Timedelta("1D"))
+    with pytest.raises(ValueError, match="No FX rate at the time .* EUR/KZT"):
+        PLCalculator(early, engine="vectorized", fx_rates=fx_rates).calculate()
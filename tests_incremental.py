@@ -0,0 +1,91 @@
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from .constants import BASE_COLUMNS
+from .incremental import IncrementalPLCalculator, LateFillPLCalculator
+from .pl_calculator import PLCalculator
+
+
+@pytest.fixture
+def input_fills():
+    input = [
+        ("USD/KZT", "USD", "KZT", 1, 1, 450, datetime(2020, 2, 1, 0, 0)),
+        ("USD/KZT", "USD", "KZT", 1, 100, 450, datetime(2020, 2, 2, 0, 0)),
+        ("USD/PHP", "USD", "PHP", 1, 50, 66, datetime(2020, 2, 2, 0, 0)),
+        ("USD/KZT", "USD", "KZT", -1, 201, 450, datetime(2020, 2, 3, 0, 0)),
+        ("USD/PHP", "USD", "PHP", -1, 150, 66, datetime(2020, 2, 3, 0, 0)),
+        ("USD/KZT", "USD", "KZT", 1, 302, 500, datetime(2020, 2, 4, 0, 0)),
+        ("USD/PHP", "USD", "PHP", 1, 350, 60, datetime(2020, 2, 4, 0, 0)),
+        ("USD/KZT", "USD", "KZT", -1, 2, 550, datetime(2020, 2, 5, 0, 0)),
+    ]
+    return pd.DataFrame(input, columns=BASE_COLUMNS)
+
+
+def test_update_equals_full_recompute(input_fills: pd.DataFrame):
+    """Should give the same rows and totals as calculating all fills at once"""
+    expected_rows = PLCalculator(input_fills.copy(), engine="vectorized").calculate()
+    incremental = IncrementalPLCalculator()
+    batches = [input_fills.iloc[:3].copy(), input_fills.iloc[3:].copy()]
+    rows = [incremental.update(batch)[0] for batch in batches]
+    pd.testing.assert_frame_equal(pd.concat(rows), expected_rows)
+
+    totals = incremental.totals()
+    assert totals.index.tolist() == ["USD/KZT", "USD/PHP"]
+    assert totals["realized_pnl"].tolist() == pytest.approx([-10 + 100 / 550, 10])
+    assert totals["unrealized_pnl"].tolist() == pytest.approx([10000 / 550, 25])
+
+
+def test_update_carries_idle_instruments(input_fills: pd.DataFrame):
+    """Should keep the state of instruments without new fills"""
+    incremental = IncrementalPLCalculator()
+    incremental.update(input_fills.iloc[:7].copy())
+    state_php = incremental.state.loc["USD/PHP"].copy()
+    _, totals = incremental.update(input_fills.iloc[7:].copy())
+    pd.testing.assert_series_equal(incremental.state.loc["USD/PHP"], state_php)
+    assert totals.loc["USD/PHP", "total_pnl"] == pytest.approx(35)
+
+
+def test_sort_by_ts_equals_sorted_input(input_fills: pd.DataFrame):
+    """Should calculate every instrument in ts order and keep the row order"""
+    shuffled = input_fills.sample(frac=1, random_state=0)
+    rows = PLCalculator(
+        shuffled.copy(), engine="vectorized", sort_by_ts=True
+    ).calculate()
+    expected = PLCalculator(input_fills.copy(), engine="vectorized").calculate()
+    pd.testing.assert_frame_equal(rows, expected.loc[shuffled.index])
+
+
+def test_late_fills_replay_only_affected_instrument(input_fills: pd.DataFrame):
+    """Should restate the fills after a late one and equal a full recompute"""
+    late = input_fills.iloc[[1]].copy()
+    on_time = input_fills.drop(index=1)
+    calculator = LateFillPLCalculator(checkpoint_every=1)
+    calculator.update(on_time.iloc[:2].copy())
+    calculator.update(on_time.iloc[2:].copy())
+
+    rows, totals = calculator.update(late)
+    # USD/KZT restarts after its fill of 2020-02-01, USD/PHP is untouched
+    assert rows.index.tolist() == [2, 4, 6, 7]
+    assert (rows["instrument_exch"] == "USD/KZT").all()
+    expected = PLCalculator(input_fills.copy(), engine="vectorized")
+    expected_rows = expected.calculate()
+    assert (
+        rows["running_balance"].tolist()
+        == expected_rows.loc[[3, 5, 7, 1], "running_balance"].tolist()
+    )
+    pd.testing.assert_frame_equal(calculator.state, expected.final_state())
+    assert totals["realized_pnl"].tolist() == pytest.approx([-10 + 100 / 550, 10])
+
+
+def test_in_order_batches_replay_nothing(input_fills: pd.DataFrame):
+    """Should only calculate the new fills and keep history per instrument"""
+    calculator = LateFillPLCalculator(checkpoint_every=1)
+    calculator.update(input_fills.iloc[:3].copy())
+    rows, _ = calculator.update(input_fills.iloc[3:].copy())
+    assert rows.index.tolist() == [3, 4, 5, 6, 7]
+    assert {
+        instrument: len(calculator._fills_of(instrument))
+        for instrument in calculator.history
+    } == {"USD/KZT": 5, "USD/PHP": 3}
@@ -0,0 +1,55 @@
+import json
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from .constants import BASE_COLUMNS
+from .metrics import StageMetrics, measure
+from .pl_calculator import STAGES, PLCalculator
+
+
+def test_stage_metrics():
+    """Should record every stage of calculate and calculate_totals"""
+    input = pd.DataFrame(
+        [
+            ("USD/KZT", "USD", "KZT", 1, 1, 450, datetime(2020, 2, 1, 0, 0)),
+            ("USD/KZT", "USD", "KZT", -1, 2, 451, datetime(2020, 2, 2, 0, 0)),
+        ],
+        columns=BASE_COLUMNS,
+    )
+    observer = StageMetrics(trace_memory=True)
+    pl_calc = PLCalculator(input, engine="vectorized", observer=observer)
+    pl_calc.calculate()
+    pl_calc.calculate_totals()
+    observer.stop()
+
+    records = json.loads(observer.to_json())
+    assert [record["stage"] for record in records] == list(STAGES) + [
+        "calculate_totals"
+    ]
+    assert all(record["rows"] == 2 for record in records)
+    assert all(record["wall_seconds"] >= 0 for record in records)
+    assert all(isinstance(record["memory_delta_bytes"], int) for record in records)
+
+    text = observer.to_prometheus(labels={"job": "nightly"})
+    assert "# TYPE pl_calculator_stage_wall_seconds gauge" in text
+    assert 'pl_calculator_stage_rows{job="nightly",stage="pnl_calc"} 2' in text
+
+
+def test_failed_stage_and_label_escaping():
+    """Should report a stage that raises and escape label values"""
+    observer = StageMetrics()
+    with pytest.raises(ValueError):
+        with measure('a "quoted"\\stage\n', 3, observer):
+            raise ValueError("boom")
+    (record,) = observer.records
+    assert record["failed"] == 1
+    assert record["error"] == "ValueError('boom')"
+    assert record["wall_seconds"] >= 0
+
+    text = observer.to_prometheus(labels={"instrument": 'USD/"KZT"'})
+    assert (
+        'pl_calculator_stage_failed{instrument="USD/\\"KZT\\"",'
+        'stage="a \\"quoted\\"\\\\stage\\n"} 1'
+    ) in text
@@ -0,0 +1,37 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .constants import BASE_COLUMNS
+from .parallel import calculate_parallel, shard_instruments
+from .pl_calculator import PLCalculator
+
+
+def test_shard_instruments_balances_rows():
+    """Should spread instruments so that shards get similar row counts"""
+    shards = shard_instruments(np.array([10, 1, 6, 5, 3, 3]), 2)
+    rows = [np.array([10, 1, 6, 5, 3, 3])[shard].sum() for shard in shards]
+    assert sorted(rows) == [14, 14]
+    assert sorted(np.concatenate(shards).tolist()) == [0, 1, 2, 3, 4, 5]
+
+
+def test_calculate_parallel_equals_single_process():
+    """Should give the same output as one process, in the original row order"""
+    input = pd.DataFrame(
+        [
+            ("USD/KZT", "USD", "KZT", 1, 1, 450, datetime(2020, 2, 1, 0, 0)),
+            ("EUR/USD", "EUR", "USD", 1, 10, 1.1, datetime(2020, 2, 1, 0, 0)),
+            ("USD/KZT", "USD", "KZT", 1, 100, 450, datetime(2020, 2, 2, 0, 0)),
+            ("USD/PHP", "USD", "PHP", 1, 50, 66, datetime(2020, 2, 2, 0, 0)),
+            ("USD/KZT", "USD", "KZT", -1, 201, 450, datetime(2020, 2, 3, 0, 0)),
+            ("USD/PHP", "USD", "PHP", -1, 150, 66, datetime(2020, 2, 3, 0, 0)),
+            ("EUR/USD", "EUR", "USD", -1, 4, 1.2, datetime(2020, 2, 3, 0, 0)),
+            ("USD/KZT", "USD", "KZT", 1, 302, 500, datetime(2020, 2, 4, 0, 0)),
+            ("USD/PHP", "USD", "PHP", 1, 350, 60, datetime(2020, 2, 4, 0, 0)),
+        ],
+        columns=BASE_COLUMNS,
+    )
+    expected = PLCalculator(input.copy(), engine="vectorized").calculate()
+    result = calculate_parallel(input.copy(), workers=2)
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,89 @@
+import math
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .benchmark import benchmark, generate_fills
+from .constants import BASE_COLUMNS
+from .differential import run
+from .pl_calculator import PLCalculator
+
+
+@pytest.fixture
+def input_buys():
+    # a long USD/KZT position built from many small fractional buys
+    rng = np.random.default_rng(0)
+    rows = 100_000
+    return pd.DataFrame(
+        {
+            "instrument_exch": "USD/KZT",
+            "cur_base": "USD",
+            "cur_quote": "KZT",
+            "side": 1,
+            "amount": np.round(rng.uniform(0.01, 5, rows), 2),
+            "price": np.round(450 + np.cumsum(rng.normal(0, 0.05, rows)), 2),
+            "ts": pd.Timestamp("2020-01-01")
+            + pd.to_timedelta(np.arange(rows), unit="s"),
+        },
+        columns=BASE_COLUMNS,
+    )
+
+
+def _calculated(input: pd.DataFrame, accumulation: str) -> PLCalculator:
+    pl_calc = PLCalculator(input.copy(), engine="vectorized", accumulation=accumulation)
+    pl_calc.calculate()
+    return pl_calc
+
+
+def test_compensated_inventory_does_not_drift(input_buys: pd.DataFrame):
+    """Should keep the inventory of long histories correctly rounded"""
+    exact = math.fsum(input_buys["amount"] * input_buys["price"])
+    drifted = _calculated(input_buys, "float").input["running_inventory"].iloc[-1]
+    result = _calculated(input_buys, "compensated").input
+    assert drifted != exact
+    assert result["running_inventory"].iloc[-1] == exact
+    assert (
+        result["inventory_cost"].iloc[-1] == exact / result["running_balance"].iloc[-1]
+    )
+
+
+def test_compensated_realized_totals():
+    """Should sum the realized P&L of every instrument correctly rounded"""
+    fills = generate_fills(instruments=3, fills_per_instrument=20_000, seed=2)
+    pl_calc = _calculated(fills, "compensated")
+    realized = pl_calc.input.groupby("instrument_exch")["realized_pnl_usd"].agg(
+        lambda values: math.fsum(values.dropna())
+    )
+    pd.testing.assert_series_equal(
+        pl_calc.final_state()["realized_pnl_usd"], realized, check_names=False
+    )
+    float_state = _calculated(fills, "float").final_state()
+    pd.testing.assert_frame_equal(pl_calc.final_state(), float_state, rtol=1e-9)
+
+
+def test_compensated_agrees_with_reference():
+    """Should only differ from the reference by rounding"""
+    candidate = {
+        "compensated": lambda input: PLCalculator(
+            input, engine="vectorized", accumulation="compensated"
+        ).calculate()
+    }
+    assert run(cases=15, seed=2, candidates=candidate, rtol=1e-9) == []
+
+
+def test_accumulation_options(input_buys: pd.DataFrame):
+    """Should reject accumulations the engine or cost basis can't support"""
+    with pytest.raises(ValueError, match="vectorized"):
+        PLCalculator(input_buys, accumulation="compensated")
+    with pytest.raises(ValueError, match="average"):
+        PLCalculator(
+            input_buys,
+            engine="vectorized",
+            cost_basis="fifo",
+            accumulation="compensated",
+        )
+    with pytest.raises(ValueError, match="accumulation"):
+        PLCalculator(input_buys, engine="vectorized", accumulation="decimal")
+    results = benchmark(input_buys.head(100), accumulation="compensated")
+    assert results["inventory_metrics"]["rows_per_s"] > 0
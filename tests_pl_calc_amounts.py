@@ -4,7 +4,7 @@ import pandas as pd
 import pytest
 
 from .constants import BASE_COLUMNS
-from .pl_calculator import PLCalculator
+from .pl_calculator import ENGINES, PLCalculator
 
 
 @pytest.fixture
@@ -41,9 +41,10 @@ def input_amount_liquidated_calc(input_data_lag_running_balance):
     return pd.concat([input_data_lag_running_balance, input], axis=1)
 
 
-def test_amount_signed_calc(input_data_amount_signed: pd.DataFrame):
+@pytest.mark.parametrize("engine", ENGINES)
+def test_amount_signed_calc(input_data_amount_signed: pd.DataFrame, engine: str):
     """Should correctly calculate signed amount"""
-    pl_calc = PLCalculator(input_data_amount_signed)
+    pl_calc = PLCalculator(input_data_amount_signed, engine=engine)
     expected_data = pd.DataFrame(
         [
             ("USD/KZT", "USD", "KZT", 1, 1, 450, datetime(2020, 2, 1, 0, 0), 1),
@@ -59,9 +60,10 @@ def test_amount_signed_calc(input_data_amount_signed: pd.DataFrame):
     pd.testing.assert_frame_equal(pl_calc.signed_amount(), expected_data)
 
 
-def test_running_balance_calc(input_data_running_balance: pd.DataFrame):
+@pytest.mark.parametrize("engine", ENGINES)
+def test_running_balance_calc(input_data_running_balance: pd.DataFrame, engine: str):
     """Should correctly calculate running balance"""
-    pl_calc = PLCalculator(input_data_running_balance)
+    pl_calc = PLCalculator(input_data_running_balance, engine=engine)
     expected_data = pd.DataFrame(
         [
             ("USD/KZT", "USD", "KZT", 1, 1, 450, datetime(2020, 2, 1, 0, 0), 1, 1),
@@ -117,9 +119,12 @@ def test_running_balance_calc(input_data_running_balance: pd.DataFrame):
     pd.testing.assert_frame_equal(pl_calc.running_balance(), expected_data)
 
 
-def test_lag_running_balance_calc(input_data_lag_running_balance: pd.DataFrame):
+@pytest.mark.parametrize("engine", ENGINES)
+def test_lag_running_balance_calc(
+    input_data_lag_running_balance: pd.DataFrame, engine: str
+):
     """Should correctly calculate lag running balance"""
-    pl_calc = PLCalculator(input_data_lag_running_balance)
+    pl_calc = PLCalculator(input_data_lag_running_balance, engine=engine)
     expected_data = pd.DataFrame(
         [
             (
@@ -213,9 +218,12 @@ def test_lag_running_balance_calc(input_data_lag_running_balance: pd.DataFrame):
     pd.testing.assert_frame_equal(pl_calc.lag_running_balance(), expected_data)
 
 
-def test_amount_liquidated_calc(input_amount_liquidated_calc: pd.DataFrame):
+@pytest.mark.parametrize("engine", ENGINES)
+def test_amount_liquidated_calc(
+    input_amount_liquidated_calc: pd.DataFrame, engine: str
+):
     """Should correctly calculate amount liqiduated"""
-    pl_calc = PLCalculator(input_amount_liquidated_calc)
+    pl_calc = PLCalculator(input_amount_liquidated_calc, engine=engine)
     expected_data = pd.DataFrame(
         [
             (
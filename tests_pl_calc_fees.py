@@ -0,0 +1,100 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .constants import BASE_COLUMNS, DERIVED_COLUMNS, FEE_COLUMNS
+from .fx import FXRates
+from .pl_calculator import PLCalculator
+
+
+@pytest.fixture
+def input_fees():
+    input = [
+        ("USD/KZT", "USD", "KZT", 1, 10, 450, datetime(2020, 2, 1), 9, "KZT"),
+        ("EUR/USD", "EUR", "USD", 1, 10, 100, datetime(2020, 2, 1), 10, "USD"),
+        ("USD/KZT", "USD", "KZT", -1, 10, 460, datetime(2020, 2, 2), 0.02, "USD"),
+        ("EUR/USD", "EUR", "USD", -1, 4, 110, datetime(2020, 2, 2), 4, "USD"),
+        ("EUR/USD", "EUR", "USD", -1, 21, 120, datetime(2020, 2, 3), 0.25, "EUR"),
+    ]
+    return pd.DataFrame(input, columns=BASE_COLUMNS + FEE_COLUMNS)
+
+
+def _realized(input: pd.DataFrame, fee_policy: str) -> pd.DataFrame:
+    pl_calc = PLCalculator(input.copy(), engine="vectorized", fee_policy=fee_policy)
+    return pl_calc.calculate()
+
+
+def test_fees_realized_policy(input_fees: pd.DataFrame):
+    """Should convert every fee to quote currency and book it as realized"""
+    result = _realized(input_fees, "realized")
+    # 0.02 USD at 460 KZT and 0.25 EUR at 120 USD
+    assert result["fee_quote_currency"].tolist() == pytest.approx([9, 10, 9.2, 4, 30])
+    assert result["fee_usd"].tolist() == pytest.approx([9 / 450, 10, 0.02, 4, 30])
+    assert result["realized_pnl_quote_currency"].tolist() == pytest.approx(
+        [-9, -10, 10 * 10 - 9.2, 4 * 10 - 4, 6 * 20 - 30]
+    )
+    # positions are untouched by the fees
+    without = _realized(input_fees[BASE_COLUMNS], None)
+    pd.testing.assert_series_equal(result["inventory_cost"], without["inventory_cost"])
+
+
+def test_fees_inventory_policy(input_fees: pd.DataFrame):
+    """Should add fees of opening fills to the cost and realize them on close"""
+    result = _realized(input_fees, "inventory")
+    assert result["inventory_cost"].tolist()[:2] == pytest.approx([450.9, 101])
+    # the flip opens 15 of 21, so 15 / 21 of its fee goes into the new short
+    assert result["realized_pnl_quote_currency"].tolist()[2:] == pytest.approx(
+        [10 * (460 - 450.9) - 9.2, 4 * (110 - 101) - 4, 6 * (120 - 101) - 30 * 6 / 21]
+    )
+    assert result["inventory_cost"].iloc[4] == pytest.approx(120 - 30 / 21)
+    # a fully closed position realizes the same with both policies
+    realized = _realized(input_fees, "realized")
+    assert result.loc[[0, 2], "realized_pnl_quote_currency"].sum() == pytest.approx(
+        realized.loc[[0, 2], "realized_pnl_quote_currency"].sum()
+    )
+
+
+def test_fees_without_charges_change_nothing(input_fees: pd.DataFrame):
+    """Should give the same P&L as no fee policy when every fee is zero"""
+    input = input_fees.assign(fee=0.0)
+    expected = _realized(input_fees[BASE_COLUMNS], None)
+    for fee_policy in ("realized", "inventory"):
+        result = _realized(input, fee_policy)
+        pd.testing.assert_frame_equal(result[BASE_COLUMNS + DERIVED_COLUMNS], expected)
+
+
+def test_fees_in_other_currencies(input_fees: pd.DataFrame):
+    """Should convert fees in third currencies through fx_rates"""
+    input = input_fees.iloc[[0]].assign(fee=1.0, fee_currency="EUR")
+    with pytest.raises(ValueError, match="EUR need fx_rates"):
+        _realized(input, "realized")
+    rates = pd.DataFrame(
+        [("EUR", "USD", datetime(2020, 1, 1), 1.1)],
+        columns=["cur_base", "cur_quote", "ts", "rate"],
+    )
+    result = PLCalculator(
+        input, engine="vectorized", fx_rates=FXRates(rates), fee_policy="realized"
+    ).calculate()
+    assert result["fee_quote_currency"].iloc[0] == pytest.approx(1.1 * 450)
+    assert result["fee_usd"].iloc[0] == pytest.approx(1.1)
+
+
+def test_fee_policy_options(input_fees: pd.DataFrame):
+    """Should reject fee policies the engine or input can't support"""
+    with pytest.raises(ValueError, match="vectorized"):
+        PLCalculator(input_fees, fee_policy="realized")
+    with pytest.raises(ValueError, match="fee_currency"):
+        PLCalculator(
+            input_fees[BASE_COLUMNS], engine="vectorized", fee_policy="realized"
+        )
+    with pytest.raises(ValueError, match="fee policy"):
+        PLCalculator(input_fees, engine="vectorized", fee_policy="monthly")
+    with pytest.raises(ValueError, match="average"):
+        PLCalculator(
+            input_fees, engine="vectorized", fee_policy="inventory", cost_basis="fifo"
+        )
+    input = input_fees.assign(fee_currency=np.nan)
+    with pytest.raises(ValueError, match="no fee_currency"):
+        _realized(input, "realized")
@@ -4,7 +4,7 @@ import pandas as pd
 import pytest
 
 from .constants import BASE_COLUMNS
-from .pl_calculator import PLCalculator
+from .pl_calculator import ENGINES, PLCalculator
 
 
 @pytest.fixture
@@ -102,9 +102,10 @@ def input_data_flags():
     )
 
 
-def test_flags_calc(input_data_flags: pd.DataFrame):
+@pytest.mark.parametrize("engine", ENGINES)
+def test_flags_calc(input_data_flags: pd.DataFrame, engine: str):
     """Should correctly calculate amount liqiduated"""
-    pl_calc = PLCalculator(input_data_flags)
+    pl_calc = PLCalculator(input_data_flags, engine=engine)
     expected_data = pd.DataFrame(
         [
             (
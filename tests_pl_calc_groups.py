@@ -0,0 +1,113 @@
+import json
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from . import cli
+from .constants import BASE_COLUMNS
+from .pl_calculator import PLCalculator
+
+GROUP_BY = ["account", "strategy", "instrument_exch"]
+
+
+@pytest.fixture
+def input_books():
+    input = [
+        ("A", "s1", "USD/KZT", "USD", "KZT", 1, 1, 450, datetime(2020, 2, 1)),
+        ("B", "s1", "USD/KZT", "USD", "KZT", -1, 5, 440, datetime(2020, 2, 1)),
+        ("A", "s2", "USD/KZT", "USD", "KZT", 1, 100, 450, datetime(2020, 2, 2)),
+        ("A", "s1", "EUR/USD", "EUR", "USD", 1, 50, 1.1, datetime(2020, 2, 2)),
+        ("A", "s1", "USD/KZT", "USD", "KZT", -1, 201, 450, datetime(2020, 2, 3)),
+        ("B", "s1", "USD/KZT", "USD", "KZT", 1, 15, 460, datetime(2020, 2, 3)),
+        ("A", "s1", "EUR/USD", "EUR", "USD", -1, 150, 1.2, datetime(2020, 2, 3)),
+        ("A", "s2", "USD/KZT", "USD", "KZT", -1, 30, 500, datetime(2020, 2, 4)),
+        ("A", "s1", "USD/KZT", "USD", "KZT", 1, 302, 500, datetime(2020, 2, 4)),
+        ("B", "s1", "USD/KZT", "USD", "KZT", -1, 2, 550, datetime(2020, 2, 5)),
+    ]
+    return pd.DataFrame(input, columns=["account", "strategy"] + BASE_COLUMNS)
+
+
+@pytest.mark.parametrize("engine", ["rowwise", "vectorized"])
+def test_groups_equal_separate_books(input_books: pd.DataFrame, engine: str):
+    """Should calculate every book as if it was calculated on its own"""
+    pl_calc = PLCalculator(input_books.copy(), engine=engine, group_by=GROUP_BY)
+    result = pl_calc.calculate()
+    totals = pl_calc.calculate_totals()
+    assert totals.index.names == GROUP_BY
+    assert len(totals) == 4
+    for (account, strategy), book in input_books.groupby(["account", "strategy"]):
+        separate = PLCalculator(book.copy(), engine=engine)
+        pd.testing.assert_frame_equal(
+            result.loc[book.index], separate.calculate(), check_dtype=False
+        )
+        pd.testing.assert_frame_equal(
+            totals.xs((account, strategy), level=["account", "strategy"]),
+            separate.calculate_totals(),
+        )
+
+
+def test_groups_engines_agree(input_books: pd.DataFrame):
+    """Should give identical rows with both engines"""
+    rowwise = PLCalculator(input_books.copy(), group_by=GROUP_BY).calculate()
+    vectorized = PLCalculator(
+        input_books.copy(), engine="vectorized", group_by=GROUP_BY
+    ).calculate()
+    pd.testing.assert_frame_equal(vectorized, rowwise, check_dtype=False)
+
+
+def test_totals_roll_up(input_books: pd.DataFrame):
+    """Should sum the totals up to any subset of the group key"""
+    pl_calc = PLCalculator(input_books, engine="vectorized", group_by=GROUP_BY)
+    pl_calc.calculate()
+    totals = pl_calc.calculate_totals()
+    by_account = pl_calc.calculate_totals(by=["account"])
+    assert by_account.index.tolist() == ["A", "B"]
+    pd.testing.assert_frame_equal(by_account, totals.groupby(level="account").sum())
+    by_instrument = pl_calc.calculate_totals(by=["account", "instrument_exch"])
+    assert by_instrument.index.tolist() == [
+        ("A", "EUR/USD"),
+        ("A", "USD/KZT"),
+        ("B", "USD/KZT"),
+    ]
+    with pytest.raises(ValueError, match="desk"):
+        pl_calc.calculate_totals(by=["desk"])
+
+
+def test_group_by_options(input_books: pd.DataFrame, tmp_path):
+    """Should need instrument_exch in the key and keep it in the state"""
+    with pytest.raises(ValueError, match="instrument_exch"):
+        PLCalculator(input_books, engine="vectorized", group_by=["account"])
+    pl_calc = PLCalculator(
+        input_books, engine="vectorized", memory="compact", group_by=GROUP_BY
+    )
+    pl_calc.calculate()
+    assert pl_calc.final_state().index.names == GROUP_BY
+
+    filename = tmp_path / "books.csv"
+    input_books.to_csv(filename, sep=";", decimal=",", index=False)
+    totals = cli.main(
+        [str(filename), "--totals", "", "--group-by", *GROUP_BY, "--roll-up", "account"]
+    )
+    pd.testing.assert_frame_equal(totals, pl_calc.calculate_totals(by=["account"]))
+
+
+def test_cli_writes_grouped_totals(input_books: pd.DataFrame, tmp_path, monkeypatch):
+    """Should write the group key with the totals to JSON and table files"""
+    filename = tmp_path / "books.csv"
+    input_books.to_csv(filename, sep=";", decimal=",", index=False)
+    # the default totals file is total_metrics.json in the working directory
+    monkeypatch.chdir(tmp_path)
+    totals = cli.main([str(filename), "--group-by", *GROUP_BY])
+    with open(tmp_path / "total_metrics.json") as f:
+        nested = json.load(f)
+    assert nested["A"]["s1"]["USD/KZT"] == pytest.approx(
+        totals.loc[("A", "s1", "USD/KZT")].to_dict()
+    )
+    assert sorted(nested["B"]["s1"]) == ["USD/KZT"]
+
+    csv_totals = tmp_path / "totals.csv"
+    cli.main([str(filename), "--totals", str(csv_totals), "--group-by", *GROUP_BY])
+    written = pd.read_csv(csv_totals, sep=";", decimal=",")
+    assert list(written.columns) == GROUP_BY + list(totals.columns)
+    pd.testing.assert_frame_equal(written.set_index(GROUP_BY), totals)
@@ -4,7 +4,7 @@ import pandas as pd
 import pytest
 
 from .constants import BASE_COLUMNS
-from .pl_calculator import PLCalculator
+from .pl_calculator import ENGINES, PLCalculator
 
 
 @pytest.fixture
@@ -133,9 +133,10 @@ def input_inventory_change():
     return pd.DataFrame(input, columns=BASE_COLUMNS + new_columns)
 
 
-def test_inventory_metrics(input_inventory_change: pd.DataFrame):
+@pytest.mark.parametrize("engine", ENGINES)
+def test_inventory_metrics(input_inventory_change: pd.DataFrame, engine: str):
     """Should correctly calculate running inventory"""
-    pl_calc = PLCalculator(input_inventory_change)
+    pl_calc = PLCalculator(input_inventory_change, engine=engine)
     new_columns = [
         "amount_signed",
         "running_balance",
@@ -288,3 +289,29 @@ def test_inventory_metrics(input_inventory_change: pd.DataFrame):
         columns=BASE_COLUMNS + new_columns,
     )
     pd.testing.assert_frame_equal(pl_calc.inventory_metrics(), expected_data)
+
+
+def test_inventory_metrics_flat_position():
+    """Should close out inventory when the position goes flat"""
+    input = pd.DataFrame(
+        [
+            ("USD/KZT", "USD", "KZT", 1, 100, 450, datetime(2020, 2, 1), 100, 100)
+            + (None, 0, 0),
+            ("USD/KZT", "USD", "KZT", -1, 100, 460, datetime(2020, 2, 2), -100, 0)
+            + (100, 100, 0),
+            ("USD/KZT", "USD", "KZT", 1, 10, 470, datetime(2020, 2, 3), 10, 10)
+            + (0, 0, 0),
+        ],
+        columns=BASE_COLUMNS
+        + [
+            "amount_signed",
+            "running_balance",
+            "lag_running_balance",
+            "amount_liquidated",
+            "flag_liquidation",
+        ],
+    )
+    result = PLCalculator(input, engine="vectorized").inventory_metrics()
+    assert result["inventory_change"].tolist() == [45000.0, -45000.0, 4700.0]
+    assert result["running_inventory"].tolist() == [45000.0, 0.0, 4700.0]
+    assert result["inventory_cost"].tolist() == [450.0, 0.0, 470.0]
@@ -0,0 +1,95 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from . import kernels
+from .benchmark import generate_fills
+from .constants import BASE_COLUMNS
+from .pl_calculator import PLCalculator
+
+
+@pytest.fixture
+def input_lots():
+    input = [
+        ("EUR/USD", "EUR", "USD", 1, 10, 100, datetime(2020, 2, 1, 0, 0), 1, None),
+        ("EUR/USD", "EUR", "USD", 1, 10, 110, datetime(2020, 2, 2, 0, 0), 2, None),
+        ("EUR/USD", "EUR", "USD", 1, 10, 105, datetime(2020, 2, 3, 0, 0), 3, None),
+        ("EUR/USD", "EUR", "USD", -1, 15, 120, datetime(2020, 2, 4, 0, 0), None, 2),
+        ("EUR/USD", "EUR", "USD", -1, 25, 130, datetime(2020, 2, 5, 0, 0), 4, None),
+        ("EUR/USD", "EUR", "USD", 1, 5, 125, datetime(2020, 2, 6, 0, 0), None, None),
+    ]
+    return pd.DataFrame(input, columns=BASE_COLUMNS + ["lot_id", "close_lot_id"])
+
+
+@pytest.mark.parametrize(
+    "cost_basis, realized, inventory_cost",
+    [
+        # selling 15 closes 10@100 and 5@110, the flip closes the remaining
+        # 15 and opens a short lot of 10@130, which the last buy partly covers
+        (
+            "fifo",
+            [0, 0, 0, 10 * 20 + 5 * 10, 5 * 20 + 10 * 25, 25],
+            [100, 105, 105, 1600 / 15, 130, 130],
+        ),
+        (
+            "lifo",
+            [0, 0, 0, 10 * 15 + 5 * 10, 5 * 20 + 10 * 30, 25],
+            [100, 105, 105, 1550 / 15, 130, 130],
+        ),
+        # selling 15 closes lot 2 (10@110) first and then 5@100 by FIFO
+        (
+            "specific",
+            [0, 0, 0, 10 * 10 + 5 * 20, 5 * 30 + 10 * 25, 25],
+            [100, 105, 105, 1550 / 15, 130, 130],
+        ),
+    ],
+)
+def test_lot_cost_basis(input_lots, cost_basis, realized, inventory_cost):
+    """Should close lots in the order of the cost basis, flips open new lots"""
+    result = PLCalculator(
+        input_lots, engine="vectorized", cost_basis=cost_basis
+    ).calculate()
+    assert result["realized_pnl_quote_currency"].tolist() == pytest.approx(realized)
+    assert result["inventory_cost"].tolist() == pytest.approx(inventory_cost)
+    assert result["running_inventory"].iloc[-1] == pytest.approx(-5 * 130)
+
+
+def test_lot_cost_bases_agree_on_closed_positions(monkeypatch):
+    """Should realize the same total once every position is closed"""
+    fills = generate_fills(instruments=3, fills_per_instrument=500, seed=7)
+    balance = (fills["side"] * fills["amount"]).groupby(fills["instrument_exch"]).sum()
+    closing = fills.drop_duplicates("instrument_exch", keep="last").copy()
+    closing["side"] = -np.sign(balance[closing["instrument_exch"]].to_numpy())
+    closing["amount"] = balance[closing["instrument_exch"]].abs().to_numpy()
+    closing["ts"] += pd.Timedelta("1s")
+    fills = pd.concat([fills, closing], ignore_index=True)
+
+    totals = {}
+    for cost_basis in ("average", "fifo", "lifo"):
+        result = PLCalculator(
+            fills.copy(), engine="vectorized", cost_basis=cost_basis
+        ).calculate()
+        totals[cost_basis] = result.groupby("instrument_exch")[
+            "realized_pnl_quote_currency"
+        ].sum()
+    for cost_basis in ("fifo", "lifo"):
+        pd.testing.assert_series_equal(totals[cost_basis], totals["average"])
+
+    expected = PLCalculator(fills.copy(), engine="vectorized", cost_basis="lifo")
+    monkeypatch.setattr(kernels, "numba", None)
+    result = PLCalculator(fills, engine="vectorized", cost_basis="lifo")
+    pd.testing.assert_frame_equal(result.calculate(), expected.calculate())
+
+
+def test_lot_cost_basis_options(input_lots):
+    """Should reject lot methods the engine or input can't support"""
+    with pytest.raises(ValueError, match="vectorized"):
+        PLCalculator(input_lots, cost_basis="fifo")
+    with pytest.raises(ValueError, match="close_lot_id"):
+        PLCalculator(
+            input_lots[BASE_COLUMNS], engine="vectorized", cost_basis="specific"
+        )
+    with pytest.raises(ValueError, match="cost basis"):
+        PLCalculator(input_lots, engine="vectorized", cost_basis="hifo")
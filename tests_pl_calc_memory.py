@@ -0,0 +1,88 @@
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .benchmark import generate_fills
+from .constants import DERIVED_COLUMNS
+from .pl_calculator import PLCalculator
+
+
+@pytest.fixture
+def fills():
+    return generate_fills(instruments=5, fills_per_instrument=2000, seed=3)
+
+
+def test_compact_matches_default(fills: pd.DataFrame):
+    """Should give the default results without touching the caller's frame"""
+    original = fills.copy()
+    expected_calc = PLCalculator(fills.copy(), engine="vectorized")
+    expected = expected_calc.calculate()
+    pl_calc = PLCalculator(fills, engine="vectorized", memory="compact")
+    result = pl_calc.calculate()
+
+    pd.testing.assert_frame_equal(fills, original)
+    assert isinstance(result["instrument_exch"].dtype, pd.CategoricalDtype)
+    assert result["side"].dtype == np.int8
+    assert result["flag_liquidation"].dtype == np.int8
+    for column in DERIVED_COLUMNS:
+        np.testing.assert_array_equal(result[column], expected[column])
+    pd.testing.assert_frame_equal(
+        pl_calc.final_state(), expected_calc.final_state(), check_dtype=False
+    )
+    pd.testing.assert_frame_equal(
+        pl_calc.calculate_totals(), expected_calc.calculate_totals()
+    )
+
+
+def test_compact_keeps_selected_columns(fills: pd.DataFrame):
+    """Should keep only the selected columns, stored as float32"""
+    columns = ["realized_pnl_usd", "unrealized_pnl_usd"]
+    expected = PLCalculator(fills.copy(), engine="vectorized").calculate()
+    result = PLCalculator(
+        fills,
+        engine="vectorized",
+        memory="compact",
+        columns=columns,
+        float_dtype="float32",
+    ).calculate()
+    assert list(result.columns) == list(fills.columns) + columns
+    assert (result[columns].dtypes == np.float32).all()
+    np.testing.assert_allclose(result[columns], expected[columns], rtol=1e-6)
+
+
+def test_compact_memory(fills: pd.DataFrame):
+    """Should hold several times less memory after calculate and peak lower"""
+
+    def traced(input: pd.DataFrame, **kwargs):
+        tracemalloc.start()
+        try:
+            pl_calc = PLCalculator(input, engine="vectorized", **kwargs)
+            pl_calc.calculate()
+            return tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    # the default mode adds its columns to the caller's frame, so it gets a copy
+    default_held, default_peak = traced(fills.copy())
+    compact_held, compact_peak = traced(
+        fills, memory="compact", columns=["realized_pnl_usd"], float_dtype="float32"
+    )
+    assert compact_held < default_held / 3
+    assert compact_peak < default_peak
+    # with every column kept, results aren't stored twice either
+    _, all_columns_peak = traced(fills, memory="compact")
+    assert all_columns_peak < default_peak
+
+
+def test_compact_rejects_bad_options(fills: pd.DataFrame):
+    """Should reject compact rowwise runs, unknown columns and dtypes"""
+    with pytest.raises(ValueError, match="vectorized"):
+        PLCalculator(fills, memory="compact")
+    with pytest.raises(ValueError, match="unknown_column"):
+        PLCalculator(fills, engine="vectorized", columns=["unknown_column"])
+    with pytest.raises(ValueError, match="float_dtype"):
+        PLCalculator(fills, engine="vectorized", float_dtype="float16")
+    with pytest.raises(ValueError, match="memory mode"):
+        PLCalculator(fills, engine="vectorized", memory="tiny")
@@ -0,0 +1,101 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .constants import BASE_COLUMNS
+from .pl_calculator import ENGINES, PLCalculator
+
+INVENTORY_COLUMNS = [
+    "amount_signed",
+    "running_balance",
+    "lag_running_balance",
+    "amount_liquidated",
+    "flag_liquidation",
+    "inventory_change",
+    "running_inventory",
+    "inventory_cost",
+]
+
+PNL_COLUMNS = [
+    "realized_pnl_quote_currency",
+    "unrealized_pnl_quote_currency",
+    "realized_pnl_usd",
+    "unrealized_pnl_usd",
+]
+
+
+@pytest.fixture
+def input_pnl():
+    input = [
+        ("USD/KZT", "USD", "KZT", 1, 1, 450, datetime(2020, 2, 1, 0, 0))
+        + (1, 1, None, 0, 0, 450.0, 450.0, 450.0),
+        ("USD/KZT", "USD", "KZT", 1, 100, 450, datetime(2020, 2, 2, 0, 0))
+        + (100, 101, 1, 0, 0, 45000.0, 45450.0, 450.0),
+        ("USD/PHP", "USD", "PHP", 1, 50, 66, datetime(2020, 2, 2, 0, 0))
+        + (50, 50, None, 0, 0, 3300.0, 3300.0, 66.0),
+        ("USD/KZT", "USD", "KZT", -1, 201, 450, datetime(2020, 2, 3, 0, 0))
+        + (-201, -100, 101, 101.0, 0, -90450.0, -45000.0, 450.0),
+        ("USD/PHP", "USD", "PHP", -1, 150, 66, datetime(2020, 2, 3, 0, 0))
+        + (-150, -100, 50, 50, 0, -9900.0, -6600.0, 66.0),
+        ("USD/KZT", "USD", "KZT", 1, 302, 500, datetime(2020, 2, 4, 0, 0))
+        + (302, 202, -100, 100, 0, 146000.0, 101000.0, 500.0),
+        ("USD/PHP", "USD", "PHP", 1, 350, 60, datetime(2020, 2, 4, 0, 0))
+        + (350, 250, -100, 100, 0, 21600.0, 15000.0, 60.0),
+        ("USD/KZT", "USD", "KZT", -1, 2, 550, datetime(2020, 2, 5, 0, 0))
+        + (-2, 200, 202, 2, 1, -1000.0, 100000.0, 500.0),
+    ]
+    return pd.DataFrame(input, columns=BASE_COLUMNS + INVENTORY_COLUMNS)
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_pnl_calc(input_pnl: pd.DataFrame, engine: str):
+    """Should correctly calculate realized and unrealized pnl"""
+    pl_calc = PLCalculator(input_pnl.copy(), engine=engine)
+    expected_pnl = pd.DataFrame(
+        [
+            (np.nan, np.nan, np.nan, np.nan),
+            (0.0, 0.0, 0.0, 0.0),
+            (np.nan, np.nan, np.nan, np.nan),
+            (0.0, 0.0, 0.0, 0.0),
+            (0.0, 0.0, 0.0, 0.0),
+            (-5000.0, -10100.0, -10.0, -20.2),
+            (600.0, 1500.0, 10.0, 25.0),
+            (100.0, 10000.0, 100 / 550, 10000 / 550),
+        ],
+        columns=PNL_COLUMNS,
+    )
+    expected_data = pd.concat([input_pnl, expected_pnl], axis=1)
+    pd.testing.assert_frame_equal(pl_calc.pnl_calc(), expected_data)
+
+
+def test_pnl_calc_unsupported_pair():
+    """Should reject pairs without USD before computing anything"""
+    input = pd.DataFrame(
+        [
+            ("EUR/USD", "EUR", "USD", 1, 10, 1.1, datetime(2020, 2, 1, 0, 0)),
+            ("EUR/KZT", "EUR", "KZT", 1, 10, 490, datetime(2020, 2, 1, 0, 0)),
+        ],
+        columns=BASE_COLUMNS,
+    )
+    pl_calc = PLCalculator(input, engine="vectorized")
+    with pytest.raises(ValueError, match="EUR/KZT"):
+        pl_calc.calculate()
+    assert list(input.columns) == BASE_COLUMNS
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_calculate_totals(input_pnl: pd.DataFrame, engine: str):
+    """Should take the last unrealized and the summed realized pnl per instrument"""
+    pl_calc = PLCalculator(input_pnl[BASE_COLUMNS].copy(), engine=engine)
+    pl_calc.calculate()
+    expected = pd.DataFrame(
+        {
+            "unrealized_pnl": [10000 / 550, 25.0],
+            "realized_pnl": [-10.0 + 100 / 550, 10.0],
+        },
+        index=pd.Index(["USD/KZT", "USD/PHP"], name="instrument_exch"),
+    )
+    expected["total_pnl"] = expected["unrealized_pnl"] + expected["realized_pnl"]
+    pd.testing.assert_frame_equal(pl_calc.calculate_totals(), expected)
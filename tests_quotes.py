@@ -0,0 +1,89 @@
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from .constants import BASE_COLUMNS
+from .pl_calculator import ENGINES, PLCalculator
+from .quotes import asof_quotes
+from .series import pnl_series
+
+
+@pytest.fixture
+def input_fills():
+    input = [
+        ("USD/KZT", "USD", "KZT", 1, 10, 450, datetime(2020, 2, 1, 0, 0)),
+        ("EUR/USD", "EUR", "USD", 1, 100, 1.1, datetime(2020, 2, 1, 0, 0)),
+        ("USD/KZT", "USD", "KZT", 1, 10, 460, datetime(2020, 2, 2, 0, 0)),
+        ("GBP/USD", "GBP", "USD", -1, 50, 1.3, datetime(2020, 2, 2, 0, 0)),
+    ]
+    return pd.DataFrame(input, columns=BASE_COLUMNS)
+
+
+@pytest.fixture
+def quotes():
+    input = [
+        ("USD/KZT", datetime(2020, 2, 1, 12, 0), 470.0),
+        ("USD/KZT", datetime(2020, 2, 3, 0, 0), 480.0),
+        ("USD/KZT", datetime(2020, 2, 5, 0, 0), 490.0),
+        ("EUR/USD", datetime(2020, 2, 3, 0, 0), 1.2),
+        ("GBP/USD", datetime(2020, 2, 1, 0, 0), 1.25),
+        ("JPY/USD", datetime(2020, 2, 3, 0, 0), 0.01),
+    ]
+    return pd.DataFrame(input, columns=["instrument_exch", "ts", "price"])
+
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_totals_marked_at_quotes(input_fills, quotes, engine: str):
+    """Should mark at the last quote up to ts unless the last fill is newer"""
+    pl_calc = PLCalculator(input_fills, engine=engine)
+    pl_calc.calculate()
+    totals = pl_calc.calculate_totals(quotes=quotes, ts=datetime(2020, 2, 4, 0, 0))
+    # KZT: 20 USD at an average of 455, marked at 480 and converted at 480
+    # EUR: 100 at 1.1 marked at 1.2
+    # GBP: the quote is older than the fill, so the fill price is kept
+    assert totals["unrealized_pnl"].to_dict() == pytest.approx(
+        {"EUR/USD": 10.0, "GBP/USD": 0.0, "USD/KZT": 25 * 20 / 480}
+    )
+    unmarked = pl_calc.calculate_totals()
+    pd.testing.assert_series_equal(totals["realized_pnl"], unmarked["realized_pnl"])
+
+
+def test_asof_quotes_matches_lookup():
+    """Should find the latest quote of every row like a per-row search"""
+    rng = np.random.default_rng(0)
+    instruments = np.array(["A", "B", "C"])
+    quotes = pd.DataFrame(
+        {
+            "instrument_exch": rng.choice(instruments[:2], 500),
+            "ts": pd.Timestamp("2020-01-01")
+            + pd.to_timedelta(rng.integers(0, 10_000, 500), unit="s"),
+            "price": rng.random(500),
+        }
+    )
+    rows = rng.choice(instruments, 200)
+    ts = pd.Timestamp("2020-01-01") + pd.to_timedelta(
+        rng.integers(0, 10_000, 200), unit="s"
+    )
+    price, quote_ts = asof_quotes(rows, ts, quotes)
+    for row, (instrument, at) in enumerate(zip(rows, ts)):
+        earlier = quotes[
+            (quotes["instrument_exch"] == instrument) & (quotes["ts"] <= at)
+        ]
+        if earlier.empty:
+            assert np.isnan(price[row]) and np.isnat(quote_ts[row])
+        else:
+            latest = earlier.sort_values("ts", kind="stable").iloc[-1]
+            assert price[row] == latest["price"]
+            assert quote_ts[row] == latest["ts"]
+
+
+def test_pnl_series_marked_at_quotes(input_fills, quotes):
+    """Should mark every bucket at the last quote before its end"""
+    result = PLCalculator(input_fills, engine="vectorized").calculate()
+    series = pnl_series(result, "1D", quotes=quotes)
+    kzt = series.loc["USD/KZT", "unrealized_pnl"]
+    # Feb 1 is marked at the noon quote, Feb 2 at its own fill, newer than it
+    assert kzt.to_list() == pytest.approx([20 * 10 / 470, 20 * 5 / 460])
+    assert series.loc[("EUR/USD", pd.Timestamp("2020-02-01")), "unrealized_pnl"] == 0
@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+from .incremental import IncrementalPLCalculator, totals_from_state
+from .pl_calculator import PLCalculator
+from .reader import read_any, read_data, read_data_chunks
+from .writer import write_data
+
+DERIVED_COLUMNS = [
+    "running_balance",
+    "amount_liquidated",
+    "flag_liquidation",
+    "running_inventory",
+    "inventory_cost",
+    "realized_pnl_usd",
+    "unrealized_pnl_usd",
+]
+
+
+@pytest.fixture
+def input_csv(tmp_path):
+    filename = tmp_path / "data.csv"
+    filename.write_text(
+        "instrument_exch;cur_base;cur_quote;side;amount;price;ts\n"
+        "USD/KZT;USD;KZT;1;1;450,5;2020-02-01 00:00:00\n"
+        "USD/KZT;USD;KZT;1;100;450;2020-02-02 00:00:00\n"
+        "EUR/USD;EUR;USD;1;1 050,5;1,1;2020-02-02 00:00:00\n"
+        "USD/KZT;USD;KZT;-1;201;451;2020-02-03 00:00:00\n"
+        "EUR/USD;EUR;USD;-1;2 150;1,12;2020-02-03 00:00:00\n"
+        "USD/KZT;USD;KZT;1;302;500;2020-02-04 00:00:00\n"
+        "EUR/USD;EUR;USD;1;350;1,09;2020-02-04 00:00:00\n"
+    )
+    return filename
+
+
+def test_read_data_chunks_dtypes(input_csv):
+    """Should read bounded chunks with compact dtypes"""
+    chunks = list(read_data_chunks(input_csv, chunksize=3))
+    assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+    dtypes = chunks[0].dtypes
+    assert dtypes["instrument_exch"] == "category"
+    assert dtypes["side"] == "int8"
+    assert chunks[0]["amount"].tolist() == [1.0, 100.0, 1050.5]
+    assert pd.api.types.is_datetime64_any_dtype(dtypes["ts"])
+
+
+def test_read_data_chunks_feed_calculator(input_csv):
+    """Should give the same P&L chunk by chunk as for the whole file"""
+    expected = PLCalculator(read_data(input_csv), engine="vectorized").calculate()
+    incremental = IncrementalPLCalculator()
+    chunks = read_data_chunks(input_csv, chunksize=2)
+    result = pd.concat(incremental.update_chunks(chunks))
+    pd.testing.assert_frame_equal(
+        result[DERIVED_COLUMNS], expected[DERIVED_COLUMNS], check_dtype=False
+    )
+
+
+@pytest.mark.parametrize("extension", [".csv", ".parquet", ".arrow"])
+def test_write_and_read_back(input_csv, tmp_path, extension: str):
+    """Should write calculate() output and totals readable in the same format"""
+    if extension != ".csv":
+        pytest.importorskip("pyarrow")
+    pl_calc = PLCalculator(read_data(input_csv), engine="vectorized")
+    output = pl_calc.calculate()
+    totals = totals_from_state(pl_calc.final_state())
+
+    write_data(output, tmp_path / f"output{extension}")
+    write_data(totals, tmp_path / f"totals{extension}")
+    output_read = read_any(tmp_path / f"output{extension}")
+    totals_read = read_any(tmp_path / f"totals{extension}")
+
+    pd.testing.assert_frame_equal(
+        output_read[DERIVED_COLUMNS], output[DERIVED_COLUMNS], check_dtype=False
+    )
+    pd.testing.assert_frame_equal(
+        totals_read.set_index("instrument_exch"), totals, check_index_type=False
+    )
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from .segments import Segments
+
+
+def test_segments_restore_row_order():
+    """Should group interleaved rows and restore their original order"""
+    input = pd.DataFrame({"instrument_exch": ["B", "A", "B", "A", "B"]})
+    segments = Segments.from_frame(input)
+    assert list(segments.keys) == ["A", "B"]
+    assert segments.offsets.tolist() == [0, 2, 5]
+    assert segments.starts.tolist() == [True, False, True, False, False]
+    values = np.array([10, 20, 30, 40, 50])
+    assert segments.sort(values).tolist() == [20, 40, 10, 30, 50]
+    assert segments.unsort(segments.sort(values)).tolist() == values.tolist()
+
+
+def test_segments_reductions():
+    """Should cumsum, shift and reduce inside every segment"""
+    input = pd.DataFrame({"instrument_exch": ["B", "A", "B", "A", "B"]})
+    segments = Segments.from_frame(input)
+    values = segments.sort(np.array([1.0, 2.0, 3.0, np.nan, 5.0]))
+    assert segments.cumsum(values)[[0, 2, 3, 4]].tolist() == [2.0, 1.0, 4.0, 9.0]
+    assert np.isnan(segments.cumsum(values)[1])
+    shifted = segments.shift(values)
+    assert np.isnan(shifted[[0, 2]]).all()
+    assert shifted[[3, 4]].tolist() == [1.0, 3.0]
+    assert segments.sum(values).tolist() == [2.0, 9.0]
+    # keys without rows sum to zero
+    sparse = Segments(np.array([0, 2, 2]), pd.Index(["A", "B", "C"]))
+    assert sparse.sum(np.array([1.0, 2.0, 3.0])).tolist() == [1.0, 0.0, 5.0]
+    assert np.isnan(segments.last(values)[0])
+    assert segments.last(values)[1] == 5.0
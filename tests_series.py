@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from .benchmark import generate_fills
+from .pl_calculator import PLCalculator
+from .series import SERIES_COLUMNS, pnl_series
+
+
+@pytest.fixture
+def fills():
+    return generate_fills(instruments=3, fills_per_instrument=200, seed=4)
+
+
+def test_pnl_series_matches_rerun_per_bucket(fills: pd.DataFrame):
+    """Should equal the totals of recalculating the fills up to every bucket end"""
+    result = PLCalculator(fills.copy(), engine="vectorized").calculate()
+    # quotes an hour after every fill, so some positions are marked at quotes
+    quotes = fills[["instrument_exch", "ts", "price"]].assign(
+        ts=fills["ts"] + pd.Timedelta("1h"), price=fills["price"] * 1.001
+    )
+    series = pnl_series(result, "3D", quotes=quotes)
+    assert list(series.columns) == SERIES_COLUMNS
+
+    for (instrument, start), row in series.iloc[::4].iterrows():
+        end = start + pd.Timedelta("3D")
+        pl_calc = PLCalculator(fills[fills["ts"] < end].copy(), engine="vectorized")
+        pl_calc.calculate()
+        # buckets mark at quotes strictly before their end
+        totals = pl_calc.calculate_totals(
+            quotes=quotes[quotes["ts"] < end], ts=end - pd.Timedelta(1, "ns")
+        ).loc[instrument]
+        assert row["realized_pnl"] == pytest.approx(totals["realized_pnl"])
+        assert row["unrealized_pnl"] == pytest.approx(totals["unrealized_pnl"])
+
+
+def test_pnl_series_per_group(fills: pd.DataFrame):
+    """Should give every book of a composite key its own curve"""
+    fills["account"] = np.where(np.arange(len(fills)) % 3 == 0, "A", "B")
+    group_by = ["account", "instrument_exch"]
+    result = PLCalculator(
+        fills.copy(), engine="vectorized", group_by=group_by
+    ).calculate()
+    series = pnl_series(result, "3D", group_by=group_by)
+    assert series.index.names == group_by + ["ts"]
+    for account, book in fills.groupby("account"):
+        separate = PLCalculator(
+            book.drop(columns="account"), engine="vectorized"
+        ).calculate()
+        pd.testing.assert_frame_equal(
+            series.xs(account, level="account"), pnl_series(separate, "3D")
+        )
+    with pytest.raises(ValueError, match="instrument_exch"):
+        pnl_series(result, "3D", group_by=["account"])
+
+
+def test_pnl_series_carries_quiet_buckets():
+    """Should repeat the last values in buckets without fills"""
+    fills = generate_fills(instruments=2, fills_per_instrument=50, seed=5)
+    quiet = fills["instrument_exch"].eq(fills["instrument_exch"].iloc[0]) & fills[
+        "ts"
+    ].between("2020-01-10", "2020-01-20")
+    fills = fills[~quiet].reset_index(drop=True)
+    result = PLCalculator(fills, engine="vectorized", memory="compact").calculate()
+    series = pnl_series(result, "1D")
+    instrument = result["instrument_exch"].iloc[0]
+    curve = series.loc[instrument]
+    assert curve.index.is_unique
+    assert len(curve) == (curve.index[-1] - curve.index[0]).days + 1
+    pd.testing.assert_series_equal(
+        curve.loc[pd.Timestamp("2020-01-11")],
+        curve.loc[pd.Timestamp("2020-01-19")],
+        check_names=False,
+    )
+    traded = pnl_series(result, "1D", carry=False)
+    assert pd.Timestamp("2020-01-15") not in traded.loc[instrument].index
+    pd.testing.assert_frame_equal(traded, series.loc[traded.index])
@@ -0,0 +1,122 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+from .benchmark import generate_fills
+from .constants import BASE_COLUMNS
+from .pl_calculator import PLCalculator
+from .service import (
+    STOP,
+    IngestionService,
+    queue_source,
+    replay,
+    serve,
+    tail_source,
+)
+from .sinks import MemorySink
+
+
+@pytest.fixture
+def fills():
+    return generate_fills(instruments=3, fills_per_instrument=100, seed=6)
+
+
+def expected_totals(fills: pd.DataFrame) -> pd.DataFrame:
+    pl_calc = PLCalculator(fills.copy(), engine="vectorized")
+    pl_calc.calculate()
+    return pl_calc.calculate_totals()
+
+
+def test_service_batches_and_publishes(fills: pd.DataFrame):
+    """Should flush full batches, publish totals and block a full queue"""
+    sink = MemorySink()
+    service = IngestionService(sink=sink, max_batch=64, queue_size=16)
+
+    async def scenario():
+        runner = asyncio.create_task(service.run())
+        await replay(service, fills)
+        await service.stop()
+        await runner
+
+    asyncio.run(scenario())
+    metrics = service.metrics()
+    assert metrics["records"] == len(fills)
+    assert metrics["batches"] == len(sink.written)
+    assert metrics["blocked_puts"] > 0
+    assert metrics["queue_depth"] == 0
+    pd.testing.assert_frame_equal(sink.totals, expected_totals(fills))
+
+
+def test_service_flushes_on_latency(fills: pd.DataFrame):
+    """Should publish a partial batch once its first record is old enough"""
+    service = IngestionService(max_batch=1000, max_latency=0.01)
+    queue = asyncio.Queue()
+
+    async def scenario():
+        runner = asyncio.create_task(serve([queue_source(queue)], service))
+        for record in fills.iloc[:5][BASE_COLUMNS].to_dict(orient="records"):
+            queue.put_nowait(record)
+        await asyncio.sleep(0.5)
+        published = service.metrics()["batches"]
+        queue.put_nowait(STOP)
+        await runner
+        return published
+
+    assert asyncio.run(scenario()) == 1
+    assert service.metrics()["latency_flushes"] == 1
+    pd.testing.assert_frame_equal(
+        service.latest_totals, expected_totals(fills.iloc[:5])
+    )
+
+
+def test_serve_raises_a_failed_batch(fills: pd.DataFrame):
+    """Should stop the sources and raise instead of blocking on a full queue"""
+    service = IngestionService(max_batch=4, max_latency=0.01, queue_size=2)
+    record = {
+        **fills.iloc[0][BASE_COLUMNS].to_dict(),
+        "instrument_exch": "EUR/KZT",
+        "cur_base": "EUR",
+        "cur_quote": "KZT",
+    }
+
+    async def endless():
+        while True:
+            yield record
+
+    async def scenario():
+        await asyncio.wait_for(serve([endless()], service), timeout=30)
+
+    with pytest.raises(ValueError, match="EUR/KZT"):
+        asyncio.run(scenario())
+    assert service.metrics()["batches"] == 0
+
+
+def test_tail_source_follows_appended_lines(fills: pd.DataFrame, tmp_path):
+    """Should read existing lines and then lines appended later"""
+    filename = tmp_path / "fills.csv"
+    lines = fills.iloc[:4].to_csv(sep=";", decimal=",", index=False).splitlines()
+    filename.write_text("\n".join(lines[:3]) + "\n")
+
+    async def scenario():
+        source = tail_source(filename, poll_interval=0.01)
+        records = [await anext(source), await anext(source)]
+        with open(filename, "a") as f:
+            f.write("\n".join(lines[3:]) + "\n")
+        records += [await anext(source), await anext(source)]
+        await source.aclose()
+        return records
+
+    records = asyncio.run(scenario())
+    service = IngestionService()
+
+    async def apply():
+        for record in records:
+            await service.put(record)
+        await service.stop()
+        await service.run()
+
+    asyncio.run(apply())
+    pd.testing.assert_frame_equal(
+        service.latest_totals, expected_totals(fills.iloc[:4])
+    )
@@ -0,0 +1,60 @@
+import json
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from .constants import BASE_COLUMNS
+from .pl_calculator import PLCalculator
+from .reader import read_any
+from .sinks import FileSink, JsonSink, MemorySink, NullSink, sink_for
+
+
+@pytest.fixture
+def pl_calc():
+    input = pd.DataFrame(
+        [
+            ("USD/KZT", "USD", "KZT", 1, 10, 450, datetime(2020, 2, 1, 0, 0)),
+            ("EUR/USD", "EUR", "USD", 1, 10, 1.1, datetime(2020, 2, 1, 0, 0)),
+            ("USD/KZT", "USD", "KZT", -1, 4, 460, datetime(2020, 2, 2, 0, 0)),
+        ],
+        columns=BASE_COLUMNS,
+    )
+    pl_calc = PLCalculator(input, engine="vectorized")
+    pl_calc.calculate()
+    return pl_calc
+
+
+def test_json_sink(pl_calc: PLCalculator, tmp_path):
+    """Should write the totals keyed by instrument as before"""
+    filename = tmp_path / "total_metrics.json"
+    totals = pl_calc.calculate_totals(sink=JsonSink(filename))
+    with open(filename) as f:
+        written = json.load(f)
+    assert list(written) == ["EUR/USD", "USD/KZT"]
+    assert written["USD/KZT"] == {
+        "unrealized_pnl": totals.loc["USD/KZT", "unrealized_pnl"],
+        "realized_pnl": totals.loc["USD/KZT", "realized_pnl"],
+        "total_pnl": totals.loc["USD/KZT", "total_pnl"],
+    }
+
+
+@pytest.mark.parametrize("extension", ["csv", "parquet"])
+def test_file_sink(pl_calc: PLCalculator, tmp_path, extension: str):
+    """Should write the totals with instrument_exch as a column"""
+    filename = tmp_path / f"totals.{extension}"
+    totals = pl_calc.calculate_totals(sink=sink_for(filename))
+    assert isinstance(sink_for(filename), FileSink)
+    written = read_any(filename).set_index("instrument_exch")
+    pd.testing.assert_frame_equal(written, totals, check_dtype=False)
+
+
+def test_memory_and_null_sinks(pl_calc: PLCalculator, tmp_path, monkeypatch):
+    """Should keep the totals in memory or discard them without touching the CWD"""
+    monkeypatch.chdir(tmp_path)
+    sink = MemorySink()
+    totals = pl_calc.calculate_totals(sink=sink)
+    pd.testing.assert_frame_equal(sink.totals, totals)
+    assert isinstance(sink_for(None), NullSink)
+    pl_calc.calculate_totals(sink=NullSink())
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,87 @@
+import json
+from datetime import datetime
+
+import pandas as pd
+import pytest
+
+from .constants import BASE_COLUMNS, STATE_COLUMNS
+from .pl_calculator import PLCalculator
+from .snapshot import load_snapshot, resume, save_snapshot, state_at
+
+
+@pytest.fixture
+def input_fills():
+    input = [
+        ("USD/KZT", "USD", "KZT", 1, 1.5, 450.1, datetime(2020, 2, 1, 0, 0)),
+        ("USD/KZT", "USD", "KZT", 1, 100.25, 450.3, datetime(2020, 2, 2, 0, 0)),
+        ("EUR/USD", "EUR", "USD", 1, 50, 1.1, datetime(2020, 2, 2, 0, 0)),
+        ("USD/KZT", "USD", "KZT", -1, 201, 451.7, datetime(2020, 2, 3, 0, 0)),
+        ("EUR/USD", "EUR", "USD", -1, 150, 1.12, datetime(2020, 2, 3, 0, 0)),
+        ("USD/KZT", "USD", "KZT", 1, 302, 500.9, datetime(2020, 2, 4, 0, 0)),
+        ("EUR/USD", "EUR", "USD", 1, 350, 1.09, datetime(2020, 2, 4, 0, 0)),
+    ]
+    return pd.DataFrame(input, columns=BASE_COLUMNS)
+
+
+def test_snapshot_round_trip(input_fills: pd.DataFrame, tmp_path):
+    """Should read back exactly the state that was written"""
+    state = state_at(input_fills, datetime(2020, 2, 3, 0, 0))
+    filename = tmp_path / "snapshot.json"
+    save_snapshot(state, filename)
+    loaded, ts = load_snapshot(filename)
+    assert ts == pd.Timestamp(2020, 2, 3)
+    pd.testing.assert_frame_equal(loaded, state, check_exact=True)
+
+
+def test_resume_from_snapshot(input_fills: pd.DataFrame, tmp_path):
+    """Should continue from a snapshot as if all fills were calculated"""
+    expected = PLCalculator(input_fills.copy(), engine="vectorized").calculate()
+    filename = tmp_path / "snapshot.json"
+    save_snapshot(state_at(input_fills, datetime(2020, 2, 2, 0, 0)), filename)
+    result = resume(input_fills, filename).calculate()
+    pd.testing.assert_frame_equal(result, expected.iloc[3:], check_exact=True)
+
+
+def test_snapshot_version_check(tmp_path):
+    """Should refuse snapshots of an unknown version"""
+    filename = tmp_path / "snapshot.json"
+    filename.write_text('{"version": 0}')
+    with pytest.raises(ValueError, match="Unsupported snapshot version"):
+        load_snapshot(filename)
+
+
+def test_snapshot_composite_key(input_fills: pd.DataFrame, tmp_path):
+    """Should round-trip a state keyed by several columns and resume from it"""
+    input_fills["account"] = ["A", "B", "A", "A", "B", "B", "A"]
+    group_by = ["account", "instrument_exch"]
+    expected = PLCalculator(
+        input_fills.copy(), engine="vectorized", group_by=group_by
+    ).calculate()
+    state = state_at(input_fills, datetime(2020, 2, 2, 0, 0), group_by=group_by)
+    filename = tmp_path / "snapshot.json"
+    save_snapshot(state, filename)
+    loaded, _ = load_snapshot(filename)
+    assert loaded.index.names == group_by
+    pd.testing.assert_frame_equal(loaded, state, check_exact=True)
+    result = resume(input_fills, filename).calculate()
+    pd.testing.assert_frame_equal(result, expected.iloc[3:], check_exact=True)
+
+
+def test_snapshot_version_1(tmp_path):
+    """Should still read snapshots keyed by instrument_exch only"""
+    filename = tmp_path / "snapshot.json"
+    row = [1.0, 0.0, 450.0, 450.0, 0.0, 0.0, 450.0, "2020-02-01T00:00:00"]
+    filename.write_text(
+        json.dumps(
+            {
+                "version": 1,
+                "ts": "2020-02-01T00:00:00",
+                "columns": STATE_COLUMNS,
+                "instruments": {"USD/KZT": row},
+            }
+        )
+    )
+    state, _ = load_snapshot(filename)
+    assert state.index.tolist() == ["USD/KZT"]
+    assert state.index.name == "instrument_exch"
+    assert state.loc["USD/KZT", "inventory_cost"] == 450.0
@@ -0,0 +1,57 @@
+import pandas as pd
+
+try:
+    from .reader import _import_pyarrow, file_format
+except ImportError:  # imported as a top-level module, e.g. from main.py
+    from reader import _import_pyarrow, file_format
+
+
+def write_data(
+    input: pd.DataFrame,
+    filename: str,
+    delimiter=";",
+    decimal=",",
+    format: str = None,
+    append: bool = False,
+):
+    """This function writes a DataFrame in the format given by the file extension
+
+    Fills, calculate() output and totals can all be written, named index
+    levels such as instrument_exch or the composite group key of the totals
+    are written as columns. Files are readable again with reader.read_any.
+
+    Args:
+        input (pd.DataFrame): Data to write
+        filename (str): Path to a csv, Parquet or Arrow file
+        delimiter (str, optional): Delimiter of CSV. Defaults to ';'.
+        decimal (str, optional): Delimiter of decimal places of CSV. Defaults to ','.
+        format (str, optional): One of the values of reader.FORMATS. Defaults
+            to the format of the file extension.
+        append (bool, optional): Appends the rows without header to an
+            existing csv file, e.g. chunk after chunk. Defaults to False.
+
+    Raises:
+        ValueError: If appending to a Parquet or Arrow file
+    """
+    if any(name is not None for name in input.index.names):
+        input = input.reset_index()
+    file_type = format or file_format(filename)
+    if append and file_type != "csv":
+        raise ValueError(f"Only csv files can be appended to, not {file_type}")
+    if file_type == "parquet":
+        _import_pyarrow()
+        input.to_parquet(filename, index=False)
+    elif file_type == "arrow":
+        pyarrow = _import_pyarrow()
+        table = pyarrow.Table.from_pandas(input, preserve_index=False)
+        with pyarrow.ipc.new_file(str(filename), table.schema) as sink:
+            sink.write_table(table)
+    else:
+        input.to_csv(
+            filename,
+            sep=delimiter,
+            decimal=decimal,
+            index=False,
+            mode="a" if append else "w",
+            header=not append,
+        )